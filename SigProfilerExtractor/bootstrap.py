@@ -0,0 +1,69 @@
+"""
+Vectorised multinomial bootstrap of mutational catalogues: the mutations of every sample are resampled among its
+mutation types, for all the samples (and replicates) in one call of numpy's Generator.multinomial
+"""
+
+import numpy as np
+import scipy.sparse
+
+
+def _sample_probabilities(genomes):
+    totals = genomes.sum(axis=0)
+    probabilities = np.divide(genomes, totals, out=np.zeros(genomes.shape), where=totals>0)
+    return np.rint(totals).astype(np.int64), probabilities
+
+
+def bootstrap_genomes(genomes, seed=None, replicates=None, dtype=np.float64, floor=None):
+
+    """
+    Resamples the mutations of every sample of genomes with a multinomial distribution.
+
+    :param genomes: array of mutation types x samples
+    :param seed: a seed, a SeedSequence or a numpy Generator
+    :param replicates: None for one replicate, or the number of replicates to draw together
+    :param dtype: the floating point type of the output, the one of the NMF engine that consumes it
+    :param floor: if not None, the entries below floor are set to floor, as the NMF engines require
+    :return: a C-contiguous array of mutation types x samples, or of replicates x mutation types x samples
+    """
+
+    rng = np.random.default_rng(seed)
+    genomes = np.asarray(genomes, dtype=np.float64)
+    totals, probabilities = _sample_probabilities(genomes)
+
+    # multinomial draws one row of counts per sample, so the samples go first and are transposed back
+    size = None if replicates is None else (replicates, genomes.shape[1])
+    bootstrap = np.swapaxes(rng.multinomial(totals, probabilities.T, size=size), -1, -2).astype(dtype)
+    if floor is not None:
+        np.maximum(bootstrap, floor, out=bootstrap)
+    return np.ascontiguousarray(bootstrap)
+
+
+def bootstrap_sparse_genomes(genomes, seed=None):
+
+    """
+    Sparse version of bootstrap_genomes: resamples the mutations of every sample among its nonzero mutation types only.
+
+    The probabilities of the nonzero entries of every sample are packed, left aligned, into a samples x (largest number
+    of nonzero entries of a sample) array, so that all the samples are drawn in one call however sparse they are.
+
+    :param genomes: array or scipy.sparse matrix of mutation types x samples
+    :param seed: a seed, a SeedSequence or a numpy Generator
+    :return: the bootstrapped genomes as a scipy.sparse CSC matrix of float64, without explicit zeros
+    """
+
+    rng = np.random.default_rng(seed)
+    genomes = scipy.sparse.csc_matrix(genomes, dtype=np.float64)
+    genomes.sum_duplicates()
+    lengths = np.diff(genomes.indptr)
+    columns = np.repeat(np.arange(genomes.shape[1]), lengths)
+    positions = np.arange(genomes.nnz)-np.repeat(genomes.indptr[:-1], lengths)
+
+    totals = np.asarray(genomes.sum(axis=0)).ravel()
+    packed = np.zeros((genomes.shape[1], max(lengths.max(initial=0), 1)))
+    packed[columns, positions] = genomes.data/totals[columns]
+    counts = rng.multinomial(np.rint(totals).astype(np.int64), packed)
+
+    bootstrap = genomes.copy()
+    bootstrap.data = counts[columns, positions].astype(np.float64)
+    bootstrap.eliminate_zeros()
+    return bootstrap
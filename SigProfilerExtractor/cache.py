@@ -0,0 +1,136 @@
+"""
+Content-addressed cache of NMF replicates, shared by the runs on the same genomes, so that running a matrix again with
+another endProcess, another penalty or just to plot again does not fit the same replicates again
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from SigProfilerExtractor.version import version
+
+
+class ReplicateCache:
+    def __init__(self, directory, genomes, seeds, settings, max_size=1024, reuse_seeds=True):
+
+        """
+        Cache of the W, H and convergence information of the NMF replicates of one genome matrix in directory.
+
+        A replicate is stored under the hash of the genomes, its number of signatures, its seed, the settings that change
+        its result and the version of the package, so a cached replicate is only reused by a run that would fit exactly
+        the same replicate. The directory can be shared by any number of runs. When it grows over max_size megabytes,
+        the replicates that were used the longest time ago are removed.
+
+        The seeds of the first run on the genomes and settings are kept in the cache, and every later run on them with
+        reuse_seeds True takes these seeds instead of its own, so that it finds the replicates of the first run. A run
+        with reuse_seeds False keeps its own seeds, and only finds the replicates of the runs with the same seeds.
+
+        :param genomes: the genome matrix
+        :param seeds: the seeds of the replicates, used if the cache has none for the genomes and settings or if
+            reuse_seeds is False
+        :param settings: a dictionary of the JSON-serialisable settings that change the result of a replicate
+        """
+
+        self.directory = directory
+        self.max_size = max_size*2**20
+        self._prefix = json.dumps({"genomes": hashlib.sha1(np.ascontiguousarray(genomes, dtype=np.float64)).hexdigest(),
+                                   "shape": list(np.shape(genomes)), "settings": settings, "version": version}, sort_keys=True)
+        self._size = None
+        os.makedirs(os.path.join(directory, "seeds"), exist_ok=True)
+
+        path = os.path.join(directory, "seeds", hashlib.sha1(self._prefix.encode()).hexdigest()+".json")
+        if reuse_seeds and os.path.exists(path):
+            with open(path) as f:
+                seeds = json.load(f)
+        elif not os.path.exists(path):
+            seeds = [int(seed) for seed in seeds]
+            temporary = "{}.{}.tmp".format(path, os.getpid())
+            with open(temporary, "w") as f:
+                json.dump(seeds, f)
+            os.replace(temporary, path)
+        # the seeds can exceed the range of int64, which numpy would read as float64
+        self.seeds = np.array(seeds, dtype=np.uint64)
+
+    def _path(self, k, j):
+        key = hashlib.sha1("{}|{}|{}".format(self._prefix, k, int(self.seeds[j])).encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key+".npz")
+
+    def _entries(self):
+        for subdirectory in os.scandir(self.directory):
+            if subdirectory.is_dir() and subdirectory.name != "seeds":
+                for entry in os.scandir(subdirectory.path):
+                    if entry.name.endswith(".npz"):
+                        yield entry
+
+    def restore(self, k, chunk, Wall, Hall):
+
+        """
+        Writes the cached replicates of a chunk for k signatures into the SharedArrays Wall and Hall.
+
+        :return: the convergence information of the replicates, or None if any of them is not cached
+        """
+
+        paths = [self._path(k, j) for j in chunk]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        Wall = Wall.open()
+        Hall = Hall.open()
+        information = []
+        try:
+            for j, path in zip(chunk, paths):
+                with np.load(path) as replicate:
+                    Wall[:, j*k:(j+1)*k] = replicate["W"]
+                    Hall[j*k:(j+1)*k, :] = replicate["H"]
+                    information.append(replicate["information"])
+                # the modification time orders the replicates for the eviction
+                os.utime(path)
+        except OSError:  # evicted by another run in the meantime
+            return None
+        Wall.flush()
+        Hall.flush()
+        return information
+
+    def save(self, k, chunk, Wall, Hall, information):
+
+        """
+        Caches the replicates of a chunk for k signatures from the SharedArrays Wall and Hall they were written into,
+        with their convergence information, and evicts the least recently used replicates if the cache is full.
+        """
+
+        Wall = Wall.open(mode="r")
+        Hall = Hall.open(mode="r")
+        for j, info in zip(chunk, information):
+            path = self._path(k, j)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written under a name of its own and renamed, so that no run reads a partial file
+            temporary = "{}.{}.tmp".format(path, os.getpid())
+            with open(temporary, "wb") as f:
+                np.savez_compressed(f, W=Wall[:, j*k:(j+1)*k], H=Hall[j*k:(j+1)*k, :], information=info)
+            size = os.path.getsize(temporary)
+            os.replace(temporary, path)
+            if self._size is not None:
+                self._size += size
+        self.evict()
+
+    def evict(self):
+
+        """
+        Removes the least recently used replicates until the cache is under 90% of its maximum size, if it is over it.
+        """
+
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._entries())
+        if self._size <= self.max_size:
+            return
+        entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._entries()))
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= 0.9*self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # removed by another run
+                pass
+            self._size -= size
@@ -0,0 +1,136 @@
+"""
+On-disk checkpoints of an extraction, so that a run that was stopped can be resumed without fitting again the NMF
+replicates and the clusterings that were already done
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+class Checkpoint:
+    def __init__(self, directory):
+
+        """
+        Store of the finished work of the extraction of one mutation context, in directory:
+
+            manifest.json                  the settings of the run and the seeds of the replicates
+            rank_<k>/replicate_<j>.npz     the W, H and convergence information of replicate j for k signatures
+            rank_<k>/clustering.npz        the best clustering of the replicates for k signatures
+
+        Every file is written to a temporary name first and then renamed, so an interrupted write never leaves a
+        truncated checkpoint behind.
+        """
+
+        self.directory = directory
+
+    @classmethod
+    def open(cls, directory, genomes, seeds, settings, resume=False):
+
+        """
+        Opens the checkpoints of a run in directory.
+
+        If resume is True and the directory holds the checkpoints of a previous run, they are kept, and the seeds of
+        that run are used again so that the replicates that are left get the seeds they would have had. The previous
+        run must have had the same genomes and settings. Otherwise any checkpoint in directory is removed and the run
+        starts with seeds.
+
+        :param genomes: the genome matrix
+        :param seeds: the seeds of the replicates of a new run
+        :param settings: a dictionary of the JSON-serialisable settings that change the result of a replicate
+        :return: the Checkpoint and the seeds of the run
+        """
+
+        checkpoint = cls(directory)
+        manifest = {"genomes": hashlib.sha1(np.ascontiguousarray(genomes, dtype=np.float64)).hexdigest(),
+                    "shape": list(np.shape(genomes)), "settings": settings}
+        path = os.path.join(directory, "manifest.json")
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                previous = json.load(f)
+            seeds = np.array(previous.pop("seeds"), dtype=np.uint64)
+            if previous != json.loads(json.dumps(manifest)):
+                raise ValueError("The checkpoints in {} were written by a run with other genomes or settings. "
+                                 "Run with resume=False to start again.".format(directory))
+            return checkpoint, seeds
+
+        checkpoint.remove()
+        os.makedirs(directory)
+        manifest["seeds"] = [int(seed) for seed in seeds]
+        checkpoint._write(path, lambda f: f.write(json.dumps(manifest).encode()))
+        return checkpoint, seeds
+
+    def _rank(self, k):
+        directory = os.path.join(self.directory, "rank_{}".format(k))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _write(self, path, write):
+        with open(path+".tmp", "wb") as f:
+            write(f)
+        os.replace(path+".tmp", path)
+
+    def save(self, k, chunk, Wall, Hall, information):
+
+        """
+        Saves the replicates of a chunk for k signatures from the SharedArrays Wall and Hall they were written into,
+        with their convergence information.
+        """
+
+        Wall = Wall.open(mode="r")
+        Hall = Hall.open(mode="r")
+        for j, info in zip(chunk, information):
+            self._write(os.path.join(self._rank(k), "replicate_{}.npz".format(j)),
+                        lambda f: np.savez_compressed(f, W=Wall[:, j*k:(j+1)*k], H=Hall[j*k:(j+1)*k, :], information=info))
+
+    def restore(self, k, chunk, Wall, Hall):
+
+        """
+        Writes the saved replicates of a chunk for k signatures into the SharedArrays Wall and Hall.
+
+        :return: the convergence information of the replicates, or None if any of them was not saved
+        """
+
+        paths = [os.path.join(self.directory, "rank_{}".format(k), "replicate_{}.npz".format(j)) for j in chunk]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        Wall = Wall.open()
+        Hall = Hall.open()
+        information = []
+        for j, path in zip(chunk, paths):
+            with np.load(path) as replicate:
+                Wall[:, j*k:(j+1)*k] = replicate["W"]
+                Hall[j*k:(j+1)*k, :] = replicate["H"]
+                information.append(replicate["information"])
+        Wall.flush()
+        Hall.flush()
+        return information
+
+    def save_clustering(self, k, clustering):
+
+        """
+        Saves the best clustering for k signatures, as returned by subroutines.best_clustering.
+        """
+
+        names = ["processAvg", "exposureAvg", "processSTE", "exposureSTE", "avgSilhouetteCoefficients", "clusterSilhouetteCoefficients"]
+        self._write(os.path.join(self._rank(k), "clustering.npz"),
+                    lambda f: np.savez_compressed(f, **dict(zip(names, clustering))))
+
+    def clustering(self, k):
+
+        """
+        :return: the saved best clustering for k signatures, or None
+        """
+
+        path = os.path.join(self.directory, "rank_{}".format(k), "clustering.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as clustering:
+            return (clustering["processAvg"], clustering["exposureAvg"], clustering["processSTE"], clustering["exposureSTE"],
+                    float(clustering["avgSilhouetteCoefficients"]), clustering["clusterSilhouetteCoefficients"])
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
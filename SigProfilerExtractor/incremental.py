@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental extraction: updates a previous solution of sigProfilerExtractor with new samples instead of extracting
+the signatures of the enlarged cohort again.
+"""
+
+from SigProfilerExtractor import subroutines as sub
+from SigProfilerExtractor import single_sample as ss
+from SigProfilerExtractor import bootstrap
+import numpy as np
+import pandas as pd
+import multiprocessing
+import os
+from numpy import linalg as LA
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+
+
+def _mutation_type(context_type):
+    if context_type == "DINUC":
+        return "DBS78"
+    elif context_type == "INDEL":
+        return "ID83"
+    return "SBS"+context_type
+
+
+def load_solution(previous_output, context_type="96", number_of_signatures=None):
+
+    """
+    Reads a solution of a previous run of sigProfilerExtractor from its "All_solutions" folder.
+
+    Parameters:
+        previous_output: A string. Path to the output folder of the previous run.
+        context_type: A string. The context type of the solution, as in the output folder. Example: "96", "1536", "DINUC", "INDEL". The default value is "96".
+        number_of_signatures: Positive integer. The solution to read. The default is the number of signatures of the suggested solution.
+
+    Values:
+        A tuple of the signatures (mutation types x signatures), the activities (samples x signatures) and the
+        signature stats as pandas DataFrames, followed by the Wall and the Hall of the NMF replicates as numpy
+        arrays, or None if the previous run was not made with wall=True.
+    """
+
+    mutation_type = _mutation_type(context_type)
+    directory = os.path.join(previous_output, mutation_type)
+    if number_of_signatures is None:
+        suggested = os.path.join(directory, "Suggested_Solution", "De_Novo_Solution", "De_Novo_Solution_Signatures_"+mutation_type+".txt")
+        number_of_signatures = pd.read_csv(suggested, sep="\t", index_col=0).shape[1]
+    prefix = os.path.join(directory, "All_solutions", mutation_type+"_"+str(number_of_signatures)+"_Signatures", mutation_type+"_S"+str(number_of_signatures)+"_")
+    if not os.path.exists(prefix+"Signatures.txt"):
+        raise ValueError("No solution with {} signatures for {} in {}".format(number_of_signatures, mutation_type, previous_output))
+
+    signatures = pd.read_csv(prefix+"Signatures.txt", sep="\t", index_col=0)
+    activities = pd.read_csv(prefix+"Activities.txt", sep="\t", index_col=0)
+    signature_stats = pd.read_csv(prefix+"Signatures_stats.txt", sep="\t", index_col=0)
+    if os.path.exists(prefix+"Wall.txt") and os.path.exists(prefix+"Hall.txt"):
+        Wall = np.loadtxt(prefix+"Wall.txt", delimiter="\t", ndmin=2)
+        Hall = np.loadtxt(prefix+"Hall.txt", delimiter="\t", ndmin=2)
+    else:
+        Wall, Hall = None, None
+    return signatures, activities, signature_stats, Wall, Hall
+
+
+def fit_new_samples(W, new_genomes):
+    return np.array([ss.fit_signatures(W, new_genomes[:, x])[0] for x in range(new_genomes.shape[1])]).reshape(-1, W.shape[1]).T
+
+
+def refine_replicate(genomes, W, H, new_genomes, iterations=100, precision="double", seed=None, new_H=None):
+
+    """
+    Carries one NMF replicate of the previous run over to the enlarged cohort: the exposures of the new samples are fitted
+    to W, and W and H are then refined together on a bootstrap replicate of all the genomes for a bounded number of
+    multiplicative updates. genomes holds the previous samples followed by the new ones; H holds the exposures of the
+    previous samples only, and new_H the exposures of the new samples if they are already fitted. Returns the refined W,
+    normalised as in pnmf, and H.
+    """
+
+    if new_H is None:
+        new_H = fit_new_samples(W, new_genomes)
+    H = np.hstack([H, new_H])
+    if seed is not None:
+        genomes = bootstrap.bootstrap_genomes(genomes, seed=seed)
+    genomes = np.maximum(genomes, 0.0001)
+
+    # the multiplicative updates cannot move entries away from zero
+    min_genomes = np.min(genomes)
+    W, H = sub.inhouse_nmf(genomes, np.maximum(W, min_genomes), np.maximum(H, min_genomes), iterations=iterations, tol=-1,
+                           precision=precision, test_conv=iterations+1)
+    W, H = np.float64(W), np.float64(H)
+    total = W.sum(axis=0)[np.newaxis]
+    return W/total, H*total.T
+
+
+def update_signatures(samples, output, previous_output, context_type="96", number_of_signatures=None, previous_samples=None,
+                      refinement_iterations=100, stability=0.8, similarity=0.95, cpu=-1, precision="double"):
+
+    """
+    Adds new samples to a previous solution of sigProfilerExtractor without extracting the signatures again.
+
+    The exposures of the new samples are fitted to the previous signatures, and the signatures and the exposures of all
+    the samples are then refined together with a bounded number of NMF iterations. If the previous run kept its NMF
+    replicates (wall=True), every replicate is carried over to the enlarged cohort the same way and the replicates are
+    clustered again, which gives the stability of the refined signatures. A new extraction is recommended only if a
+    signature moved away from its previous version or became unstable.
+
+    Parameters:
+
+        samples: A string or a pandas DataFrame. Path to a tab delimited file, or the table, of the new samples, where the rows are mutation types and the columns are sample IDs.
+        output: A string. Path to the output folder.
+        previous_output: A string. Path to the output folder of the previous run of sigProfilerExtractor.
+        context_type: A string. The context type of the solution to update. Example: "96", "1536", "DINUC", "INDEL". The default value is "96".
+        number_of_signatures: Positive integer. The solution to update. The default is the number of signatures of the suggested solution.
+        previous_samples: A string or a pandas DataFrame, optional. The table of the samples of the previous run, in the same format as samples. The default is the Samples.txt file of the mutation type in previous_output. If that file does not exist either, the previous samples are represented by their reconstruction from the previous signatures and activities, with a warning.
+        refinement_iterations: Positive integer. The number of NMF iterations that refine the signatures on the enlarged cohort. The default value is 100.
+        stability: Float. A signature whose stability falls below this value while it was above it in the previous run calls for a new extraction. The default value is 0.8.
+        similarity: Float. A signature whose cosine similarity to its previous version falls below this value calls for a new extraction. The default value is 0.95.
+        cpu: Integer. The number of processes that refine and cluster the replicates. The default value is -1 (all the processors).
+        precision: A string. "single" or "double" precision of the NMF iterations. The default value is "double".
+
+    Values:
+        A tuple of the refined signatures and the activities of all the samples as pandas DataFrames, the report of the
+        signatures as a pandas DataFrame and a boolean that is True if a new extraction is recommended.
+
+        The files below will be generated in the "Incremental_Solution" folder of the mutation type in the output folder.
+
+        [mutation_type]_S[k]_Signatures.txt
+        [mutation_type]_S[k]_Activities.txt
+        [mutation_type]_S[k]_Samples_stats.txt
+        [mutation_type]_S[k]_Incremental_Report.txt
+        incremental_logfile.txt
+    """
+
+    signatures, activities, signature_stats, Wall, Hall = load_solution(previous_output, context_type, number_of_signatures)
+    k = signatures.shape[1]
+    mutation_type = _mutation_type(context_type)
+
+    if not isinstance(samples, pd.DataFrame):
+        samples = pd.read_csv(samples, sep="\t", index_col=0)
+    if not samples.index.isin(signatures.index).all() or len(samples.index) != len(signatures.index):
+        raise ValueError("The mutation types of the new samples do not match the mutation types of the previous solution")
+    samples = samples.loc[signatures.index]
+    if previous_samples is None:
+        # the previous run saved the matrix it extracted the signatures from
+        previous_samples = os.path.join(previous_output, mutation_type, "Samples.txt")
+        if not os.path.exists(previous_samples):
+            print("\nWARNING!!! {} was not found, so the previous samples are represented by their reconstruction from the previous "
+                  "signatures and activities, which favours the previous signatures. Pass previous_samples to use the real ones.".format(previous_samples))
+            previous_samples = pd.DataFrame(np.dot(signatures, activities.T), index=signatures.index, columns=activities.index)
+    if not isinstance(previous_samples, pd.DataFrame):
+        previous_samples = pd.read_csv(previous_samples, sep="\t", index_col=0)
+    previous_samples = previous_samples.loc[signatures.index, activities.index]
+    new_genomes = np.array(samples, dtype=np.float64)
+    genomes = np.hstack([np.array(previous_samples, dtype=np.float64), new_genomes])
+    colnames = list(previous_samples.columns)+list(samples.columns)
+
+    # the previous solution itself, carried over to the enlarged cohort
+    W = np.array(signatures, dtype=np.float64)
+    H = np.array(activities, dtype=np.float64).T
+    new_H = fit_new_samples(W, new_genomes)
+    previous_error = LA.norm(genomes-np.dot(W, np.hstack([H, new_H])), 'fro')/LA.norm(genomes, 'fro')
+    processAvg, exposureAvg = refine_replicate(genomes, W, H, new_genomes, iterations=refinement_iterations, precision=precision, new_H=new_H)
+    reconstruction_error = LA.norm(genomes-np.dot(processAvg, exposureAvg), 'fro')/LA.norm(genomes, 'fro')
+    similarities = 1-np.diag(cdist(W.T, processAvg.T, metric="cosine"))
+
+    report = pd.DataFrame({"Cosine Similarity to Previous": np.round(similarities, 3)}, index=signatures.columns)
+    report["Previous Stability"] = signature_stats["Stability"].values if "Stability" in signature_stats.columns else np.nan
+    report["Stability"] = np.nan
+    if Wall is not None:
+        # every replicate of the previous run is carried over to the enlarged cohort and they are clustered again
+        replicates = Wall.shape[1]//k
+        pool = multiprocessing.Pool() if cpu == -1 else multiprocessing.Pool(processes=cpu)
+        try:
+            results = pool.starmap(refine_replicate, [(genomes, Wall[:, r*k:(r+1)*k], Hall[r*k:(r+1)*k, :], new_genomes, refinement_iterations,
+                                                       precision, r) for r in range(replicates)])
+            newWall = np.hstack([W_r for W_r, _ in results])
+            newHall = np.vstack([H_r for _, H_r in results])
+            clusterAvg, _, _, _, _, clusterSilhouetteCoefficients = sub.cluster_converge_outerloop(newWall, newHall, k, pool=pool)
+        finally:
+            pool.close()
+            pool.join()
+        # the clusters come in any order: match them to the refined signatures
+        _, order = linear_sum_assignment(cdist(processAvg.T, clusterAvg.T, metric="cosine"))
+        report["Stability"] = np.round(np.array(clusterSilhouetteCoefficients)[order], 2)
+
+    unstable = (report["Stability"] < stability) & ~(report["Previous Stability"] < stability)
+    report["New Extraction Recommended"] = (report["Cosine Similarity to Previous"] < similarity) | unstable
+    reextraction = bool(report["New Extraction Recommended"].any())
+
+    # export the updated solution
+    subdirectory = os.path.join(output, mutation_type, "Incremental_Solution")
+    if not os.path.exists(subdirectory):
+        os.makedirs(subdirectory)
+    prefix = os.path.join(subdirectory, mutation_type+"_S"+str(k)+"_")
+    processes = pd.DataFrame(processAvg, index=signatures.index, columns=signatures.columns)
+    processes = processes.rename_axis("MutationType", axis="columns")
+    processes.to_csv(prefix+"Signatures.txt", "\t", index_label=[processes.columns.name])
+    exposures = pd.DataFrame(np.round(exposureAvg.T).astype(int), index=colnames, columns=signatures.columns)
+    exposures = exposures.rename_axis("Samples", axis="columns")
+    exposures.to_csv(prefix+"Activities.txt", "\t", index_label=[exposures.columns.name])
+    samples_stats = sub.calculate_similarities(genomes, np.dot(processAvg, exposureAvg), colnames)[0]
+    samples_stats.to_csv(prefix+"Samples_stats.txt", sep="\t")
+    report.to_csv(prefix+"Incremental_Report.txt", "\t", index_label="Signatures")
+
+    lognote = open(os.path.join(subdirectory, "incremental_logfile.txt"), "w")
+    lognote.write("Previous Output: {}\n".format(previous_output))
+    lognote.write("Number of Signatures: {}\n".format(k))
+    lognote.write("Previous Samples: {}\n".format(previous_samples.shape[1]))
+    lognote.write("New Samples: {}\n".format(samples.shape[1]))
+    lognote.write("Refinement Iterations: {}\n".format(refinement_iterations))
+    lognote.write("Replicates Carried Over: {}\n".format(0 if Wall is None else Wall.shape[1]//k))
+    lognote.write("Reconstruction Error with the Previous Signatures: {}\n".format(round(previous_error, 4)))
+    lognote.write("Reconstruction Error with the Refined Signatures: {}\n".format(round(reconstruction_error, 4)))
+    lognote.write("Minimum Cosine Similarity to the Previous Signatures: {}\n".format(round(np.min(similarities), 3)))
+    lognote.write("New Extraction Recommended: {}\n".format(reextraction))
+    lognote.close()
+    print("The reconstruction error is {} with the refined signatures and {} with the previous ones. A new extraction is {}recommended.".format(
+        round(reconstruction_error, 4), round(previous_error, 4), "" if reextraction else "not "))
+
+    return processes, exposures, report, reextraction
@@ -0,0 +1,69 @@
+"""
+Truncated SVDs of the bootstrap replicates, shared by all the numbers of signatures of an extraction, so that the NNDSVD
+initialisation of a replicate does not compute a new SVD of the same matrix for every number of signatures
+"""
+
+import os
+
+import numpy as np
+from sklearn.utils.extmath import randomized_svd
+
+# the smallest rank of a stored SVD; the ranks double from it
+MIN_RANK = 8
+
+
+def svd_rank(rank):
+    """
+    The rank of the stored SVD that serves the NNDSVD initialisation of rank signatures: the smallest of MIN_RANK,
+    2*MIN_RANK, 4*MIN_RANK... that is at least rank
+    """
+    stored = MIN_RANK
+    while stored < rank:
+        stored *= 2
+    return stored
+
+
+class SVDStore:
+    def __init__(self, directory):
+
+        """
+        Store of the truncated SVDs of the bootstrap replicate of every seed, in directory.
+
+        The replicates of every number of signatures that have the same seed fit the same bootstrap matrix, so a
+        truncated randomized SVD of it is computed once, by the first worker that needs it, and the NNDSVD initialisation
+        of every number of signatures up to its rank takes its leading singular triplets. The ranks of the stored SVDs
+        are fixed by svd_rank, so a number of signatures that needs more triplets gets a larger SVD of its own, and the
+        triplets of a number of signatures do not depend on the other numbers of signatures of the run nor on the order
+        they are fitted in. The SVD draws from a child stream of the SeedSequence of the seed of its own, so it is the same
+        whichever worker computes it and whatever the other random streams of the replicate have drawn.
+
+        The store only holds file names, so it can be passed to the workers. The directory is not removed by the store.
+        """
+
+        self.directory = directory
+
+    def svd(self, genomes, seed, rank):
+
+        """
+        :param genomes: the bootstrap matrix of the replicate with seed
+        :param rank: the number of singular triplets needed
+        :return: the U, S and V of the truncated SVD of genomes at svd_rank(rank), or at the rank of genomes if it is
+                 lower, or None if seed is None
+        """
+
+        if seed is None:
+            return None
+        stored = min(svd_rank(rank), *np.shape(genomes))
+        path = os.path.join(self.directory, "svd_{}_{}.npz".format(int(seed), stored))
+        if os.path.exists(path):
+            with np.load(path) as svd:
+                return svd["U"], svd["S"], svd["V"]
+
+        random_state = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(int(seed)).spawn(3)[2]))
+        U, S, V = randomized_svd(np.asarray(genomes, dtype=np.float64), stored, random_state=random_state)
+        # written under a name of its own and renamed, as another worker may compute the same SVD at the same time
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as f:
+            np.savez(f, U=U, S=S, V=V)
+        os.replace(temporary, path)
+        return U, S, V
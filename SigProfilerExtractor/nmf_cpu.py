@@ -0,0 +1,611 @@
+"""
+Implementation of batched non-negative matrix factorization for CPU
+"""
+
+import numpy as np
+import scipy.sparse
+from scipy.special import xlogy
+
+
+class ConvergenceMonitor:
+    def __init__(self, V, test_conv=500, tolerance=1e-6, patience=3, min_iterations=0):
+
+        """
+        Track the generalised Kullback-Leibler objective of a batch of NMF replicates and decide when each of them
+        has converged. The objective is D(V||WH) = sum(V log V - V) - sum(V log WH) + sum(WH), where the first term
+        is constant and sum(WH) comes from the column sums of W and the row sums of H, so a test costs one
+        logarithm of the reconstruction.
+
+        Args:
+          V: (batch, m, n) array of the matrices being factorised. A 2-D matrix is put in a batch of 1.
+          test_conv: (int) How often (in iterations) to compute the objective
+          tolerance: relative change of the objective between two tests below which a test passes; a larger rise fails it
+          patience: (int) number of successive passing tests after which a replicate is converged
+          min_iterations: (int) the minimum number of iterations before a replicate can converge
+        """
+        if len(V.shape) == 2:
+            V = V[None, :, :]
+        # V is the array of the engine, which is not copied: the objective upcasts it one matrix at a time
+        self._V = V
+        self._constant = np.zeros(V.shape[0])
+        for b in range(V.shape[0]):
+            v = np.asarray(V[b], dtype=np.float64)
+            self._constant[b] = (xlogy(v, v) - v).sum()
+        self._init_state(V.shape[0], test_conv, tolerance, patience, min_iterations)
+
+    def _init_state(self, replicates, test_conv, tolerance, patience, min_iterations):
+        """
+        Set the convergence settings and the state of the tests of `replicates` replicates. Every monitor sets `_V`
+        and `_constant` itself and then calls this.
+        """
+        self.test_conv = test_conv
+        self.tolerance = tolerance
+        self.patience = patience
+        self.min_iterations = min_iterations
+        self.loss = np.full(replicates, np.inf)
+        self.iterations = np.zeros(replicates, dtype=int)
+        self.converged = np.zeros(replicates, dtype=bool)
+        self._passed = np.zeros(replicates, dtype=int)
+
+    def due(self, iteration):
+        """
+        Whether the objective has to be tested after the (zero based) `iteration`
+        """
+        return (iteration + 1) % self.test_conv == 0
+
+    def kl_loss(self, W, H, WH, active=None):
+        """
+        Objective of the `active` replicates (all of them if None) given their factors and reconstructions
+        """
+        if active is None:
+            active = np.arange(self._V.shape[0])
+        total = np.einsum('bi,bi->b', W.sum(axis=1, dtype=np.float64), H.sum(axis=2, dtype=np.float64))
+        cross = np.array([(np.asarray(self._V[b], dtype=np.float64) * np.log(wh, dtype=np.float64)).sum()
+                          for b, wh in zip(active, WH)])
+        return self._constant[active] - cross + total
+
+    def update(self, iteration, W, H, WH, active=None):
+        """
+        Record the objective of the `active` replicates after the (zero based) `iteration`.
+        Returns a boolean mask over `active` of the replicates that converged with this test.
+        """
+        if len(W.shape) == 2:
+            W, H, WH = W[None], H[None], WH[None]
+        if active is None:
+            active = np.arange(self._V.shape[0])
+
+        return self.record(iteration, self.kl_loss(W, H, WH, active), active)
+
+    def record(self, iteration, loss, active=None):
+        """
+        Record the objective `loss` of the `active` replicates, computed by the caller, after the (zero based)
+        `iteration`. Returns a boolean mask over `active` of the replicates that converged with this test.
+        """
+        if active is None:
+            active = np.arange(len(self.loss))
+
+        previous = self.loss[active]
+        with np.errstate(invalid='ignore'):
+            passed = np.abs(previous - loss) / np.abs(loss) < self.tolerance
+        self._passed[active] = np.where(passed, self._passed[active] + 1, 0)
+        self.loss[active] = loss
+        self.iterations[active] = iteration + 1
+
+        done = (self._passed[active] >= self.patience) & (iteration + 1 >= self.min_iterations)
+        self.converged[active[done]] = True
+        return done
+
+
+class SparseConvergenceMonitor(ConvergenceMonitor):
+    def __init__(self, V, test_conv=500, tolerance=1e-6, patience=3, min_iterations=0):
+
+        """
+        ConvergenceMonitor of a single sparse matrix. The reconstruction passed to `update` is only its values at
+        the nonzero entries of V, in the order of V.data, since sum(V log WH) is zero everywhere else.
+
+        Args:
+          V: scipy.sparse matrix being factorised, in CSC format
+          The other arguments are those of ConvergenceMonitor.
+        """
+        data = np.asarray(V.data, dtype=np.float64)
+        self._V = data[None, :]
+        self._constant = (xlogy(self._V, self._V) - self._V).sum(axis=1)
+        self._init_state(1, test_conv, tolerance, patience, min_iterations)
+
+    def kl_loss(self, W, H, WH, active=None):
+        total = np.einsum('bi,bi->b', W.sum(axis=1, dtype=np.float64), H.sum(axis=2, dtype=np.float64))
+        return self._constant - (self._V * np.log(WH, dtype=np.float64)).sum(axis=1) + total
+
+
+class OutOfCoreConvergenceMonitor(ConvergenceMonitor):
+    def __init__(self, V_t, block_size=4096, test_conv=500, tolerance=1e-6, patience=3, min_iterations=0):
+
+        """
+        ConvergenceMonitor of a single matrix that does not fit in memory. V_t is the transposed matrix (samples
+        in rows, e.g. a numpy.memmap) and is only read `block_size` samples at a time. The objective is computed
+        by `kl_loss` from W and the transposed H and passed to `record`.
+
+        Args:
+          V_t: (n, m) array of the transposed matrix being factorised
+          block_size: (int) number of samples (rows of V_t) read at a time
+          The other arguments are those of ConvergenceMonitor.
+        """
+        self._V = V_t
+        self.block_size = block_size
+        self._constant = np.zeros(1)
+        for start in range(0, V_t.shape[0], block_size):
+            V = np.asarray(V_t[start:start + block_size], dtype=np.float64)
+            self._constant += (xlogy(V, V) - V).sum()
+        self._init_state(1, test_conv, tolerance, patience, min_iterations)
+
+    def kl_loss(self, W, H_t, WH=None, active=None):
+        """
+        Objective given the basis matrix W (m, rank) and the transposed coefficient matrix H_t (n, rank)
+        """
+        W = np.asarray(W, dtype=np.float64)
+        loss = self._constant.copy()
+        for start in range(0, self._V.shape[0], self.block_size):
+            V = np.asarray(self._V[start:start + self.block_size], dtype=np.float64)
+            H = np.asarray(H_t[start:start + self.block_size], dtype=np.float64)
+            loss += np.dot(W.sum(axis=0), H.sum(axis=0)) - (V * np.log(np.dot(H, W.T))).sum()
+        return loss
+
+
+class NMF:
+    def __init__(self, V, W, H, max_iterations=200000, tolerance=1e-6, test_conv=500, patience=3,
+                 floating_point_precision='double'):
+
+        """
+        Run non-negative matrix factorisation of a batch of matrices using NumPy. Uses the generalised
+        Kullback-Leibler multiplicative updates of `inhouse_nmf`, applied to every matrix of the batch at once.
+
+        Args:
+          V: (batch, m, n) array of matrices to be factorised. A 2-D matrix is put in a batch of 1.
+          W: (batch, m, rank) array of initial basis matrices
+          H: (batch, rank, n) array of initial coefficient matrices
+          max_iterations: (int) Maximum number of update iterations for every replicate
+          tolerance: relative change of the KL objective between two tests below which a test passes; a larger rise fails it
+          test_conv: (int) How often to test for convergence
+          patience: (int) number of successive passing tests after which a replicate is converged
+          floating_point_precision: (string or type). Can be `double`, `float` or any type numpy can interpret.
+        """
+        if floating_point_precision == 'float':
+            self._dtype = np.float32
+        elif floating_point_precision == 'double':
+            self._dtype = np.float64
+        else:
+            self._dtype = np.dtype(floating_point_precision).type
+
+        # If V is not in a batch, put it in a batch of 1
+        if len(V.shape) == 2:
+            V, W, H = V[None, :, :], W[None, :, :], H[None, :, :]
+
+        self._V = np.array(V, dtype=self._dtype)
+        self._W = np.array(W, dtype=self._dtype)
+        self._H = np.array(H, dtype=self._dtype)
+        self._eps = self._dtype(np.finfo(float).eps)
+        self.max_iterations = max_iterations
+        self.monitor = ConvergenceMonitor(self._V, test_conv=test_conv, tolerance=tolerance, patience=patience)
+
+    @property
+    def W(self):
+        return self._W
+
+    @property
+    def H(self):
+        return self._H
+
+    @property
+    def iterations(self):
+        return self.monitor.iterations
+
+    @property
+    def converged(self):
+        return self.monitor.converged
+
+    @property
+    def loss(self):
+        return self.monitor.loss
+
+    @property
+    def reconstruction(self):
+        return self._W @ self._H
+
+    def fit(self):
+        """
+        Fit the basis (W) and coefficient (H) matrices of every replicate of the batch. Replicates are tested for
+        convergence independently; a converged replicate is written back and dropped from the working batch so
+        the remaining replicates continue on a smaller stacked problem.
+        """
+        active = np.arange(self._V.shape[0])
+        V, W, H = self._V, self._W.copy(), self._H.copy()
+        WH, dot1, dot2 = self._buffers(W, H)
+
+        for i in range(self.max_iterations):
+            # update rule for H
+            np.matmul(W, H, out=WH)
+            np.divide(V, WH, out=WH)
+            np.matmul(W.transpose(0, 2, 1), WH, out=dot1)
+            H *= dot1
+            H /= W.sum(axis=1)[:, :, np.newaxis]
+
+            # update rule for W
+            np.matmul(W, H, out=WH)
+            np.divide(V, WH, out=WH)
+            np.matmul(WH, H.transpose(0, 2, 1), out=dot2)
+            W *= dot2
+            W /= H.sum(axis=2)[:, np.newaxis, :]
+
+            # Adjust small values every ten steps to avoid underflow
+            if (i + 1) % 10 == 0:
+                np.maximum(H, self._eps, out=H)
+                np.maximum(W, self._eps, out=W)
+
+            if self.monitor.due(i):
+                np.matmul(W, H, out=WH)
+                done = self.monitor.update(i, W, H, WH, active)
+                if done.any():
+                    self._W[active[done]] = W[done]
+                    self._H[active[done]] = H[done]
+
+                    keep = ~done
+                    active = active[keep]
+                    if not len(active):
+                        return
+                    V, W, H = V[keep], W[keep], H[keep]
+                    WH, dot1, dot2 = self._buffers(W, H)
+
+        self._W[active] = W
+        self._H[active] = H
+        if self.max_iterations % self.monitor.test_conv:
+            self.monitor.update(self.max_iterations - 1, W, H, W @ H, active)
+
+    def _buffers(self, W, H):
+        """
+        Allocate the work buffers for a working batch: the reconstruction (which also holds V/WH) and the
+        numerators of the H and W updates
+        """
+        return np.empty((W.shape[0], W.shape[1], H.shape[2]), dtype=self._dtype), \
+            np.empty(H.shape, dtype=self._dtype), \
+            np.empty(W.shape, dtype=self._dtype)
+
+
+def hals_kl_nmf(v, w=0, h=0, k=2, iterations=200000, tol=1e-6, precision="single", test_conv=10, patience=3,
+                monitor=None, newton_steps=1):
+    """
+    KL coordinate descent NMF of v starting from w and h (the CCD method of Hsieh & Dhillon, 2011), updating one
+    component at a time like HALS. For every component, the entries of its row of H (and then of its column of W)
+    have independent one-variable KL subproblems, which are solved together with `newton_steps` projected Newton
+    steps. The reconstruction is kept up to date with rank one corrections and recomputed at every sweep.
+
+    Takes the same arguments as `inhouse_nmf`; `iterations` and `test_conv` count sweeps over all components.
+    """
+    dtype = np.float32 if precision == "single" else np.float64
+    v = np.asarray(v, dtype=dtype)
+    w = np.array(w, dtype=dtype)
+    h = np.array(h, dtype=dtype)
+    k = w.shape[1]
+    EPS = dtype(np.finfo(float).eps)
+    np.maximum(w, EPS, out=w)
+    np.maximum(h, EPS, out=h)
+
+    if monitor is None:
+        monitor = ConvergenceMonitor(v, test_conv=test_conv, tolerance=tol, patience=patience)
+    for i in range(iterations):
+        wh = np.dot(w, h)
+
+        # update the rows of h
+        for j in range(k):
+            wj = w[:, j]
+            for _ in range(newton_steps):
+                ratio = v / wh
+                grad = wj.sum() - np.dot(wj, ratio)
+                hess = np.dot(wj * wj, ratio / wh)
+                new = np.maximum(h[j] - grad / hess, EPS)
+                wh += np.outer(wj, new - h[j])
+                np.maximum(wh, EPS, out=wh)  # cancellation in low precision
+                h[j] = new
+
+        # update the columns of w
+        for j in range(k):
+            hj = h[j]
+            for _ in range(newton_steps):
+                ratio = v / wh
+                grad = hj.sum() - np.dot(ratio, hj)
+                hess = np.dot(ratio / wh, hj * hj)
+                new = np.maximum(w[:, j] - grad / hess, EPS)
+                wh += np.outer(new - w[:, j], hj)
+                np.maximum(wh, EPS, out=wh)  # cancellation in low precision
+                w[:, j] = new
+
+        if monitor.due(i):
+            if monitor.update(i, w, h, np.dot(w, h))[0]:
+                break
+    else:
+        if iterations % monitor.test_conv:
+            monitor.update(iterations - 1, w, h, np.dot(w, h))
+
+    return w, h
+
+
+def accelerated_mu_nmf(v, w=0, h=0, k=2, iterations=200000, tol=1e-6, precision="single", test_conv=100,
+                       patience=3, monitor=None, inner_iterations=2, delta=0.1):
+    """
+    Accelerated multiplicative update NMF of v starting from w and h (the A-MU scheme of Gillis & Glineur, 2012,
+    applied to the KL updates of `inhouse_nmf`). Each factor is updated several times in a row while the other is
+    fixed, at most `inner_iterations` times and until an update changes the factor by less than `delta` times the
+    change of the first one, so the iterations concentrate on the factor that is further from its optimum.
+
+    Takes the same arguments as `inhouse_nmf`; `iterations` and `test_conv` count outer (W and H) iterations.
+    """
+    dtype = np.float32 if precision == "single" else np.float64
+    v = np.asarray(v, dtype=dtype)
+    w = np.array(w, dtype=dtype)
+    h = np.array(h, dtype=dtype)
+    n, m = v.shape
+    k = w.shape[1]
+    EPS = dtype(np.finfo(float).eps)
+
+    # work buffers reused by every iteration
+    wh = np.empty((n, m), dtype=dtype)
+    dot1 = np.empty((k, m), dtype=dtype)
+    dot2 = np.empty((n, k), dtype=dtype)
+
+    if monitor is None:
+        monitor = ConvergenceMonitor(v, test_conv=test_conv, tolerance=tol, patience=patience)
+    for i in range(iterations):
+
+        # inner updates of h with w fixed
+        x1 = w.sum(axis=0)[:, np.newaxis]
+        first = None
+        for _ in range(inner_iterations):
+            np.dot(w, h, out=wh)
+            np.divide(v, wh, out=wh)
+            np.dot(w.T, wh, out=dot1)
+            dot1 /= x1
+            dot1 -= 1
+            dot1 *= h          # the change of h made by this update
+            h += dot1
+            change = np.linalg.norm(dot1)
+            if first is None:
+                first = change
+            elif change <= delta * first:
+                break
+
+        # inner updates of w with h fixed
+        x2 = h.sum(axis=1)[np.newaxis, :]
+        first = None
+        for _ in range(inner_iterations):
+            np.dot(w, h, out=wh)
+            np.divide(v, wh, out=wh)
+            np.dot(wh, h.T, out=dot2)
+            dot2 /= x2
+            dot2 -= 1
+            dot2 *= w          # the change of w made by this update
+            w += dot2
+            change = np.linalg.norm(dot2)
+            if first is None:
+                first = change
+            elif change <= delta * first:
+                break
+
+        np.maximum(h, EPS, out=h)
+        np.maximum(w, EPS, out=w)
+        if monitor.due(i):
+            np.dot(w, h, out=wh)
+            if monitor.update(i, w, h, wh)[0]:
+                break
+    else:
+        if iterations % monitor.test_conv:
+            monitor.update(iterations - 1, w, h, np.dot(w, h))
+
+    return w, h
+
+
+def extrapolated_mu_nmf(v, w=0, h=0, k=2, iterations=200000, tol=1e-6, precision="single", test_conv=500,
+                        patience=3, monitor=None, safeguard=10, step=0.5, growth=1.05, max_growth=1.01, shrink=1.5):
+    """
+    Extrapolated multiplicative update NMF of v starting from w and h (the extrapolation scheme of Ang & Gillis,
+    2019, applied to the KL updates of `inhouse_nmf`). After every update, w and h are moved further along their
+    last change, by `step` times it, and the next update starts from there. Every `safeguard` iterations the
+    objective of the last update, before its extrapolation, is checked: if it went up since the previous check, by
+    more than the rounding of the floating point type, the extrapolation is dropped, the step is divided by `shrink`
+    and the step it had becomes its maximum. Otherwise the step is multiplied by `growth`, up to its maximum, which
+    is multiplied by `max_growth`, up to 1.
+
+    Takes the same arguments as `inhouse_nmf`.
+    """
+    dtype = np.float32 if precision == "single" else np.float64
+    v = np.asarray(v, dtype=dtype)
+    w = np.array(w, dtype=dtype)
+    h = np.array(h, dtype=dtype)
+    n, m = v.shape
+    k = w.shape[1]
+    EPS = dtype(np.finfo(float).eps)
+    np.maximum(w, EPS, out=w)
+    np.maximum(h, EPS, out=h)
+
+    # work buffers reused by every iteration
+    wh = np.empty((n, m), dtype=dtype)
+    dot1 = np.empty((k, m), dtype=dtype)
+    dot2 = np.empty((n, k), dtype=dtype)
+    # the last iterates of the updates, which are extrapolated into w and h
+    w_last, h_last = w.copy(), h.copy()
+
+    if monitor is None:
+        monitor = ConvergenceMonitor(v, test_conv=test_conv, tolerance=tol, patience=patience)
+    np.dot(w, h, out=wh)
+    checked_loss = monitor.kl_loss(w[None], h[None], wh[None])[0]
+    max_step = 1.0
+    for i in range(iterations):
+
+        # update rule for h
+        np.dot(w, h, out=wh)
+        np.divide(v, wh, out=wh)
+        np.dot(w.T, wh, out=dot1)
+        h *= dot1
+        h /= w.sum(axis=0)[:, np.newaxis]
+
+        # update rule for w
+        np.dot(w, h, out=wh)
+        np.divide(v, wh, out=wh)
+        np.dot(wh, h.T, out=dot2)
+        w *= dot2
+        w /= h.sum(axis=1)[np.newaxis, :]
+
+        # extrapolation: x + step*(x - previous x), kept positive so that the updates can move every entry
+        for x, last, change in ((h, h_last, dot1), (w, w_last, dot2)):
+            np.subtract(x, last, out=change)
+            last[...] = x
+            change *= step
+            x += change
+            np.maximum(x, EPS, out=x)
+
+        if (i + 1) % safeguard == 0:
+            np.dot(w_last, h_last, out=wh)
+            loss = monitor.kl_loss(w_last[None], h_last[None], wh[None])[0]
+            # a change below the rounding of the factors is not a rise
+            if loss > checked_loss*(1 + np.finfo(dtype).eps):
+                # the extrapolation went uphill: restart from the last update with a smaller step
+                w[...], h[...] = w_last, h_last
+                max_step = step
+                step /= shrink
+            else:
+                step = min(max_step, step * growth)
+                max_step = min(1.0, max_step * max_growth)
+            checked_loss = loss
+
+        # the test is on the last update before its extrapolation, as the objective of the extrapolated w and h can go
+        # up, and the last update is returned
+        if monitor.due(i):
+            np.dot(w_last, h_last, out=wh)
+            if monitor.update(i, w_last, h_last, wh)[0]:
+                break
+    else:
+        if iterations % monitor.test_conv:
+            monitor.update(iterations - 1, w_last, h_last, np.dot(w_last, h_last))
+
+    return w_last, h_last
+
+
+def sparse_kl_nmf(v, w=0, h=0, k=2, iterations=200000, tol=1e-6, precision="single", test_conv=500, patience=3,
+                  monitor=None, block_size=2 ** 22):
+    """
+    Kullback-Leibler multiplicative update NMF of a sparse matrix v starting from w and h. The updates of
+    `inhouse_nmf` only need the ratio v/(wh) at the nonzero entries of v, so it is kept as a CSC matrix with the
+    sparsity pattern of v and the numerators of the updates are sparse-dense products. The reconstruction at the
+    nonzero entries is gathered from blocks of columns of wh of at most `block_size` entries, which is cheaper
+    than gathering the rows of w and h for every entry unless v is extremely sparse.
+
+    Takes the same arguments as `inhouse_nmf`, with v any scipy.sparse matrix. monitor, if given, must be a
+    SparseConvergenceMonitor of v.
+    """
+    dtype = np.float32 if precision == "single" else np.float64
+    v = scipy.sparse.csc_matrix(v, dtype=dtype)
+    v.sum_duplicates()
+    w = np.array(w, dtype=dtype)
+    h = np.array(h, dtype=dtype)
+    n, m = v.shape
+    EPS = dtype(np.finfo(float).eps)
+
+    # position of every stored entry in the transposed block of wh that holds its column
+    block = max(1, min(m, block_size // n))
+    cols = np.repeat(np.arange(m), np.diff(v.indptr))
+    position = (cols % block) * n + v.indices
+    whT = np.empty((block, n), dtype=dtype)
+    wh = np.empty(v.nnz, dtype=dtype)
+    ratio = v.copy()     # holds v/(w.h) at the nonzero entries
+    ratio_t = ratio.T    # CSR view sharing the data of ratio
+
+    def reconstruction():
+        for start in range(0, m, block):
+            stop = min(start + block, m)
+            lo, hi = v.indptr[start], v.indptr[stop]
+            np.dot(h[:, start:stop].T, w.T, out=whT[:stop - start])
+            np.take(whT.ravel(), position[lo:hi], out=wh[lo:hi])
+        return wh
+
+    if monitor is None:
+        monitor = SparseConvergenceMonitor(v, test_conv=test_conv, tolerance=tol, patience=patience)
+    for i in range(iterations):
+
+        # update rule for h
+        np.divide(v.data, reconstruction(), out=ratio.data)
+        h *= (ratio_t @ w).T
+        h /= w.sum(axis=0)[:, np.newaxis]
+
+        # update rule for w
+        np.divide(v.data, reconstruction(), out=ratio.data)
+        w *= ratio @ h.T
+        w /= h.sum(axis=1)[np.newaxis, :]
+
+        # Adjust small values every ten steps to avoid underflow
+        if (i + 1) % 10 == 0:
+            np.maximum(h, EPS, out=h)
+            np.maximum(w, EPS, out=w)
+        if monitor.due(i):
+            if monitor.update(i, w, h, reconstruction())[0]:
+                break
+    else:
+        if iterations % monitor.test_conv:
+            monitor.update(iterations - 1, w, h, reconstruction())
+
+    return w, h
+
+
+def out_of_core_kl_nmf(v_t, w, h_t, iterations=200000, tol=1e-6, precision="single", test_conv=500, patience=3,
+                       monitor=None, block_size=4096):
+    """
+    Kullback-Leibler multiplicative update NMF of a matrix that does not fit in memory, processed in blocks of
+    `block_size` samples. v_t and h_t are the transposed matrix (samples in rows) and the transposed coefficient
+    matrix, e.g. numpy.memmap arrays; h_t is updated in place and w is returned.
+
+    The updates are those of `inhouse_nmf`: the H update of a block only needs its own samples, and the
+    numerator and denominator of the W update are sums over the samples, accumulated block by block with the
+    updated H and applied at the end of the pass. Only w and one block of v_t and h_t are in memory at a time.
+
+    monitor, if given, must be an OutOfCoreConvergenceMonitor of v_t.
+    """
+    dtype = np.float32 if precision == "single" else np.float64
+    w = np.array(w, dtype=dtype)
+    n, k = h_t.shape
+    EPS = dtype(np.finfo(float).eps)
+
+    if monitor is None:
+        monitor = OutOfCoreConvergenceMonitor(v_t, block_size=block_size, test_conv=test_conv, tolerance=tol,
+                                              patience=patience)
+    for i in range(iterations):
+        x1 = w.sum(axis=0)
+        dot2 = np.zeros(w.shape, dtype=dtype)
+        x2 = np.zeros(k, dtype=dtype)
+        for start in range(0, n, block_size):
+            v = np.asarray(v_t[start:start + block_size], dtype=dtype)
+            h = np.array(h_t[start:start + block_size], dtype=dtype)
+
+            # update rule for the block of h
+            h *= np.dot(v / np.dot(h, w.T), w)
+            h /= x1
+
+            # the block's share of the update of w
+            dot2 += np.dot((v / np.dot(h, w.T)).T, h)
+            x2 += h.sum(axis=0)
+
+            if (i + 1) % 10 == 0:
+                np.maximum(h, EPS, out=h)
+            h_t[start:start + block_size] = h
+
+        # update rule for w
+        w *= dot2
+        w /= x2[np.newaxis, :]
+
+        # Adjust small values every ten steps to avoid underflow
+        if (i + 1) % 10 == 0:
+            np.maximum(w, EPS, out=w)
+        if monitor.due(i):
+            if monitor.record(i, monitor.kl_loss(w, h_t))[0]:
+                break
+    else:
+        if iterations % monitor.test_conv:
+            monitor.record(iterations - 1, monitor.kl_loss(w, h_t))
+
+    return w
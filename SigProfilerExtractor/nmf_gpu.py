@@ -1,9 +1,7 @@
 """
-Implementation of non-negative matrix factorization for GPU
+Implementation of non-negative matrix factorization for GPU, or for any other torch device such as the CPU
 """
 
-from datetime import datetime
-
 from nimfa.methods.seeding import nndsvd
 import numpy as np
 import torch
@@ -11,45 +9,175 @@ import torch.nn
 from torch import nn
 
 
+def _generators(sequences, device="cpu"):
+    """
+    A torch.Generator on device for every numpy SeedSequence of sequences
+    """
+    return [torch.Generator(device=device).manual_seed(int(sequence.generate_state(1, dtype=np.uint64)[0]))
+            for sequence in sequences]
+
+
+def bootstrap(genomes, seeds, floor=None):
+    """
+    Resamples the mutations of every sample of genomes with a multinomial distribution, once for every seed, on the
+    device of genomes.
+
+    The multinomial draw of a sample is split into binomial draws down a binary tree over the mutation types: the
+    mutations of a node go to its left half with the probability of that half, the others to its right half. All the
+    nodes of a level and all the samples are drawn together, so a replicate takes one torch.binomial call per level,
+    log2 of the number of mutation types. Every replicate draws from a generator on the device seeded by the first child
+    of the numpy SeedSequence of its seed, so it does not depend on the other replicates of the batch.
+
+    Args:
+      genomes: tensor of mutation types x samples
+      seeds: the seed of every replicate, or None for fresh entropy
+      floor: if not None, the entries below floor are set to floor, as the NMF engines require
+    Returns:
+      a tensor of replicates x mutation types x samples, of the dtype of genomes
+    """
+    n_types, n_samples = genomes.shape
+    counts = genomes.double()
+    totals = counts.sum(dim=0, keepdim=True).round()
+
+    # the probability of every node of the tree, from the leaves (padded to a power of two) to the root
+    leaves = 1 << max(n_types-1, 0).bit_length()
+    probabilities = [torch.cat([counts, counts.new_zeros(leaves-n_types, n_samples)])]
+    while probabilities[-1].shape[0] > 1:
+        probabilities.append(probabilities[-1].view(-1, 2, n_samples).sum(dim=1))
+    # the probability of the left half of every node that is not a leaf, given the node
+    splits = [torch.where(node > 0, children[0::2]/node, torch.zeros_like(node))
+              for node, children in zip(probabilities[:0:-1], probabilities[-2::-1])]
+
+    replicates = []
+    for generator in _generators([np.random.SeedSequence(None if seed is None else int(seed)).spawn(1)[0]
+                                  for seed in seeds], device=genomes.device):
+        nodes = totals
+        for split in splits:
+            left = torch.binomial(nodes, split, generator=generator)
+            nodes = torch.stack([left, nodes-left], dim=1).view(-1, n_samples)
+        replicates.append(nodes[:n_types])
+    replicates = torch.stack(replicates).to(genomes.dtype)
+    if floor is not None:
+        replicates.clamp_(min=floor)
+    return replicates
+
+
+class _Extrapolation:
+    def __init__(self, W, H, loss, step=0.5, growth=1.05, max_growth=1.01, shrink=1.5):
+
+        """
+        State of the safeguarded extrapolation of the multiplicative updates of a batch of matrices, the scheme of
+        nmf_cpu.extrapolated_mu_nmf with a step of its own for every matrix.
+
+        Args:
+          W, H: the factors of the batch before the first update
+          loss: the KL divergence of every matrix of the batch at W and H
+          step, growth, max_growth, shrink: as in nmf_cpu.extrapolated_mu_nmf
+        """
+        self._last = [W.clone(), H.clone()]
+        self._loss = loss
+        self._step = torch.full_like(loss, step)
+        self._max_step = torch.ones_like(loss)
+        self._growth = growth
+        self._max_growth = max_growth
+        self._shrink = shrink
+        self._eps = float(np.finfo(float).eps)
+
+    @property
+    def last(self):
+        """
+        The W and H of the last update, before its extrapolation
+        """
+        return self._last
+
+    def extrapolate(self, W, H, padding=None):
+        """
+        Moves W and H, in place, further along their change since the previous call, by the step of their matrix.
+        padding is None or 1 for the padding components of every matrix, which stay zero.
+        """
+        step = self._step.view(-1, 1, 1)
+        for x, last in zip((W, H), self._last):
+            change = torch.sub(x, last).mul_(step)
+            last.copy_(x)
+            x.add_(change).clamp_(min=self._eps)
+        if padding is not None:
+            W *= 1 - padding.unsqueeze(1)
+            H *= 1 - padding.unsqueeze(2)
+
+    def check(self, W, H, loss):
+        """
+        The safeguard, given the KL divergence loss of every matrix at the W and H of `last`: the matrices whose
+        divergence went up since the previous check, by more than the rounding of their dtype, drop their
+        extrapolation, W and H going back in place to `last`, and take a smaller step, and the steps of the others
+        grow.
+        """
+        # a change below the rounding of the factors is not a rise
+        uphill = loss > self._loss*(1 + torch.finfo(self._last[0].dtype).eps)
+        restart = uphill.view(-1, 1, 1)
+        for x, last in zip((W, H), self._last):
+            x.copy_(torch.where(restart, last, x))
+        self._loss = loss
+        step, max_step = self._step, self._max_step
+        self._step = torch.where(uphill, step/self._shrink, torch.minimum(max_step, step*self._growth))
+        self._max_step = torch.where(uphill, step, torch.clamp(max_step*self._max_growth, max=1.0))
+
+    def keep(self, mask):
+        """
+        Keeps the state of the matrices of the batch selected by the boolean mask
+        """
+        self._last = [x[mask] for x in self._last]
+        self._loss, self._step, self._max_step = self._loss[mask], self._step[mask], self._max_step[mask]
+
+
 class NMF:
     def __init__(self, V, rank, max_iterations=100000, tolerance=1e-8, test_conv=1000, gpu_id=0, seed=None,
-                 init_method='random', floating_point_precision='double', min_iterations=2000):
+                 init_method='random', floating_point_precision='double', min_iterations=2000, device=None,
+                 extrapolate=False, safeguard=10):
 
         """
-        Run non-negative matrix factorisation using GPU. Uses beta-divergence.
+        Run non-negative matrix factorisation using GPU, or another torch device. Uses beta-divergence.
 
         Args:
           V: Matrix to be factorised
-          rank: (int) number of latent dimensnions to use in factorisation
+          rank: (int) number of latent dimensnions to use in factorisation, or a list with the rank of every
+              matrix of the batch. The matrices of lower ranks are padded to the largest one with components
+              that are masked out of the updates and stay zero
           max_iterations: (int) Maximum number of update iterations to use during fitting
           tolerance: tolerance to use in convergence tests. Lower numbers give longer times to convergence
           test_conv: (int) How often to test for convergnce
-          gpu_id: (int) Which GPU device to use
-          seed: random seed, if None (default) datetime is used
+          gpu_id: (int) Which GPU device to use, if device is None
+          seed: random seed, or a list with the seed of every matrix of the batch. Every matrix gets its own
+              random stream, a child of the numpy SeedSequence of its seed, so its initialisation does not
+              depend on the batch it is in. If None (default), fresh entropy is used
           init_method: how to initialise basis and coefficient matrices, options are:
             - random (will always be the same if seed != None)
             - NNDSVD
             - NNDSVDa (fill in the zero elements with the average),
             - NNDSVDar (fill in the zero elements with random values in the space [0:average/100]).
-          floating_point_precision: (string or type). Can be `double`, `float` or any type/string which
-              torch can interpret.
+          floating_point_precision: (string or type). Can be `double`, `float`, a torch dtype or the name
+              of one.
           min_iterations: the minimum number of iterations to execute before termination. Useful when using
               fp32 tensors as convergence can happen too early.
+          device: the torch device to run on, e.g. "cpu", "cuda:1" or a torch.device. If None (default), the
+              GPU gpu_id.
+          extrapolate: if True, the updates are extrapolated as in nmf_cpu.extrapolated_mu_nmf, with a safeguard
+              on the KL divergence of every matrix every `safeguard` iterations
         """
-        torch.cuda.set_device(gpu_id)
-
-        if seed is None:
-            seed = datetime.now().timestamp()
+        self._device = torch.device("cuda", gpu_id) if device is None else torch.device(device)
+        if self._device.type == 'cuda':
+            # a bare "cuda" is the current GPU
+            if self._device.index is None:
+                self._device = torch.device("cuda", torch.cuda.current_device())
+            torch.cuda.set_device(self._device)
 
         if floating_point_precision == 'float':
-            self._tensor_type = torch.FloatTensor
+            self._dtype = torch.float32
         elif floating_point_precision == 'double':
-            self._tensor_type = torch.DoubleTensor
+            self._dtype = torch.float64
+        elif isinstance(floating_point_precision, str):
+            self._dtype = getattr(torch, floating_point_precision)
         else:
-            self._tensor_type = floating_point_precision
-
-        torch.manual_seed(seed)
-        torch.cuda.manual_seed(seed)
+            self._dtype = floating_point_precision
 
         self.max_iterations = max_iterations
         self.min_iterations = min_iterations
@@ -58,14 +186,26 @@ class NMF:
         if len(V.shape) == 2:
             V = V[None, :, :]
 
-        self._V = V.type(self._tensor_type).cuda()
+        if seed is None or np.ndim(seed) == 0:
+            sequences = np.random.SeedSequence(None if seed is None else int(seed)).spawn(V.shape[0])
+        else:
+            sequences = [np.random.SeedSequence(None if s is None else int(s)) for s in seed]
+        self._generators = _generators(sequences)
+
+        self._V = V.to(self._device, self._dtype)
         self._fix_neg = nn.Threshold(0., 1e-8)
         self._tolerance = tolerance
         self._prev_loss = None
         self._iter = 0
         self._test_conv = test_conv
-        self._gpu_id = gpu_id
-        self._rank = rank
+        self._extrapolate = extrapolate
+        self._safeguard = safeguard
+        self._ranks = [rank]*V.shape[0] if np.ndim(rank) == 0 else [int(r) for r in rank]
+        self._rank = max(self._ranks)
+        # 1 for the padding components of every matrix, which are added to the denominators of their updates
+        padding = torch.tensor([[float(i >= r) for i in range(self._rank)] for r in self._ranks],
+                               dtype=self._dtype, device=self._device)
+        self._padding = padding if padding.any() else None
         self._W, self._H = self._initialise_wh(init_method)
 
     def _initialise_wh(self, init_method):
@@ -73,9 +213,12 @@ class NMF:
         Initialise basis and coefficient matrices according to `init_method`
         """
         if init_method == 'random':
-            W = torch.rand(self._V.shape[0], self._V.shape[1], self._rank).type(self._tensor_type).cuda()
-            H = torch.rand(self._V.shape[0], self._rank, self._V.shape[2]).type(self._tensor_type).cuda()
-            return W, H
+            # drawn on the CPU from the stream of every matrix, so the initialisation is the same on any device
+            W = torch.stack([nn.functional.pad(torch.rand(self._V.shape[1], r, generator=g), (0, self._rank-r))
+                             for g, r in zip(self._generators, self._ranks)])
+            H = torch.stack([nn.functional.pad(torch.rand(r, self._V.shape[2], generator=g), (0, 0, 0, self._rank-r))
+                             for g, r in zip(self._generators, self._ranks)])
+            return W.to(self._device, self._dtype), H.to(self._device, self._dtype)
 
         elif init_method == 'NNDSVD':
             nv = nndsvd.Nndsvd()
@@ -92,8 +235,8 @@ class NMF:
             vin = np.mat(self._V.cpu().numpy())
             W, H = nv.initialize(vin, self._rank, options={'flag': 2})
 
-        W = torch.from_numpy(W).type(self._tensor_type).cuda(self._gpu_id)
-        H = torch.from_numpy(H).type(self._tensor_type).cuda(self._gpu_id)
+        W = torch.from_numpy(W).to(self._device, self._dtype)
+        H = torch.from_numpy(H).to(self._device, self._dtype)
         return W, H
 
     @property
@@ -104,30 +247,75 @@ class NMF:
     def W(self):
         return self._W
 
+    @property
+    def ranks(self):
+        return self._ranks
+
     @property
     def H(self):
         return self._H
 
+    @staticmethod
+    def _kl_losses(V, W, H, out=None):
+        """
+        KL divergence of every matrix of the batch V from its reconstruction W @ H. The reconstruction is computed
+        once, into out if it is given (a tensor of the shape of V), and its sum is taken from the sums of W and H.
+        """
+        ratio = torch.matmul(W, H, out=out)
+        torch.div(V, ratio, out=ratio)
+        torch.xlogy(V, ratio, out=ratio)
+        return ratio.sum(dim=(1, 2)) - V.sum(dim=(1, 2)) + (W.sum(dim=1) * H.sum(dim=2)).sum(dim=1)
+
     @property
     def _kl_loss(self):
-        return (self._V * (self._V / self.reconstruction).log()).sum() - self._V.sum() + self.reconstruction.sum()
+        return self._kl_losses(self._V, self.W, self.H).sum()
 
-    @property
-    def _loss_converged(self):
+    @staticmethod
+    def _update(V, W, H, beta, out=None, padding=None):
         """
-        Check if loss has converged
+        One multiplicative update of W and H, in place, for the beta divergence. out is None or a tensor of the shape
+        of V that holds the reconstruction and the ratios, so that the update allocates no matrix of that size.
+        padding is None or 1 for the padding components of every matrix: their denominators, which are zero, become 1,
+        so that their W and H stay zero.
         """
-        if not self._iter:
-            self._loss_init = self._kl_loss
-        elif ((self._prev_loss - self._kl_loss) / self._loss_init) < self._tolerance:
-            return True
-        self._prev_loss = self._kl_loss
-        return False
+        padding_w, padding_h = (0, 0) if padding is None else (padding.unsqueeze(1), padding.unsqueeze(2))
+        if beta == 2:
+            wt = W.transpose(1, 2)
+            H *= (wt @ V) / ((wt @ W) @ H + padding_h)
+            ht = H.transpose(1, 2)
+            W *= (V @ ht) / (W @ (H @ ht) + padding_w)
+
+        # Optimisations for the (common) beta=1 (KL) case: ones @ H^T is the row sums of H and W^T @ ones the
+        # column sums of W. The reconstruction is computed again after the update of W, as H is updated from it.
+        elif beta == 1:
+            ratio = torch.matmul(W, H, out=out)
+            torch.div(V, ratio, out=ratio)
+            W *= (ratio @ H.transpose(1, 2)) / (H.sum(dim=2).unsqueeze(1) + padding_w)
+
+            ratio = torch.matmul(W, H, out=ratio)
+            torch.div(V, ratio, out=ratio)
+            H *= (W.transpose(1, 2) @ ratio) / (W.sum(dim=1).unsqueeze(2) + padding_h)
+
+        else:
+            reconstruction = W @ H
+            wt = W.transpose(1, 2)
+            H *= (wt @ (reconstruction ** (beta - 2) * V)) / (wt @ reconstruction ** (beta - 1) + padding_h)
+            reconstruction = torch.matmul(W, H, out=reconstruction)
+            ht = H.transpose(1, 2)
+            W *= ((reconstruction ** (beta - 2) * V) @ ht) / (reconstruction ** (beta - 1) @ ht + padding_w)
+        return W, H
 
     def fit(self, beta=1):
         """
         Fit the basis (W) and coefficient (H) matrices to the input matrix (V) using multiplicative updates and
             beta divergence
+
+        Every matrix of the batch is tested for convergence on its own KL divergence every test_conv iterations,
+        and, with extrapolate, has its own extrapolation step, checked on its KL divergence.
+        The matrices that converged are taken out of the batch, which goes on with the others, and the fit stops
+        when all of them converged or after max_iterations. The number of iterations of every matrix is then in
+        the `iterations` attribute.
+
         Args:
           beta: value to use for generalised beta divergence. Default is 1 for KL divergence
             beta == 2 => Euclidean updates
@@ -135,44 +323,52 @@ class NMF:
             beta == 0 => Itakura-Saito updates
         """
         with torch.no_grad():
-            def stop_iterations():
-                stop = (self._V.shape[0] == 1) and \
-                       (self._iter % self._test_conv == 0) and \
-                       self._loss_converged and \
-                       (self._iter > self.min_iterations)
-                if stop:
-                    print("loss converged with {} iterations".format(self._iter))
-                return stop
-
-            if beta == 2:
-                for self._iter in range(self.max_iterations):
-                    self.H = self.H * (self.W.transpose(1, 2) @ self._V) / (self.W.transpose(1, 2) @ (self.W @ self.H))
-                    self.W = self.W * (self._V @ self.H.transpose(1, 2)) / (self.W @ (self.H @ self.H.transpose(1, 2)))
-                    if stop_iterations():
-                        break
-
-            # Optimisations for the (common) beta=1 (KL) case.
-            elif beta == 1:
-                ones = torch.ones(self._V.shape).type(self._tensor_type).cuda(self._gpu_id)
-                for self._iter in range(self.max_iterations):
-                    ht = self.H.transpose(1, 2)
-                    numerator = (self._V / (self.W @ self.H)) @ ht
-
-                    denomenator = ones @ ht
-                    self._W *= numerator / denomenator
-
-                    wt = self.W.transpose(1, 2)
-                    numerator = wt @ (self._V / (self.W @ self.H))
-                    denomenator = wt @ ones
-                    self._H *= numerator / denomenator
-                    if stop_iterations():
-                        break
+            self.iterations = np.full(self._V.shape[0], self.max_iterations)
+            # the indices in the batch of the matrices that did not converge yet, and their V, W and H
+            active = torch.arange(self._V.shape[0], device=self._V.device)
+            V, W, H, padding = self._V, self._W, self._H, self._padding
+            # the one work matrix of the size of V, shared by the updates and the losses
+            buffer = torch.empty_like(V)
+            extrapolation = _Extrapolation(W, H, self._kl_losses(V, W, H, buffer)) if self._extrapolate else None
+
+            for self._iter in range(self.max_iterations):
+                W, H = self._update(V, W, H, beta, buffer[:len(active)], padding)
+                if extrapolation is not None:
+                    extrapolation.extrapolate(W, H, padding)
+                    if (self._iter + 1) % self._safeguard == 0:
+                        extrapolation.check(W, H, self._kl_losses(V, *extrapolation.last, buffer[:len(active)]))
+                if self._iter % self._test_conv:
+                    continue
+
+                # with extrapolation, the test is on the last update before it, as the objective of the extrapolated W
+                # and H can go up
+                tested_W, tested_H = (W, H) if extrapolation is None else extrapolation.last
+                loss = self._kl_losses(V, tested_W, tested_H, buffer[:len(active)])
+                if not self._iter:
+                    loss_init = loss
+                else:
+                    converged = ((self._prev_loss - loss).abs() / loss_init < self._tolerance) & \
+                                (self._iter > self.min_iterations)
+                    if converged.any():
+                        done = active[converged]
+                        self._W[done] = tested_W[converged]
+                        self._H[done] = tested_H[converged]
+                        self.iterations[done.cpu().numpy()] = self._iter + 1
 
+                        remaining = ~converged
+                        if not remaining.any():
+                            break
+                        active, V, W, H = active[remaining], V[remaining], W[remaining], H[remaining]
+                        loss, loss_init = loss[remaining], loss_init[remaining]
+                        if padding is not None:
+                            padding = padding[remaining]
+                        if extrapolation is not None:
+                            extrapolation.keep(remaining)
+                self._prev_loss = loss
             else:
-                for self._iter in range(self.max_iterations):
-                    self.H = self.H * ((self.W.transpose(1, 2) @ (((self.W @ self.H) ** (beta - 2)) * self._V)) /
-                                       (self.W.transpose(1, 2) @ ((self.W @ self.H)**(beta-1))))
-                    self.W = self.W * ((((self.W@self.H)**(beta-2) * self._V) @ self.H.transpose(1, 2)) /
-                                       (((self.W @ self.H) ** (beta - 1)) @ self.H.transpose(1, 2)))
-                    if stop_iterations():
-                        break
+                if extrapolation is not None:
+                    W, H = extrapolation.last
+                # the matrices that did not converge within max_iterations, unless they are still those of the batch
+                if W is not self._W:
+                    self._W[active] = W
+                    self._H[active] = H
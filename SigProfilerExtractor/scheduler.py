@@ -0,0 +1,292 @@
+"""
+Scheduler that runs the NMF replicates, the clustering and the optimisation of all the numbers of signatures
+of a mutation context on one pool of workers
+"""
+
+import functools
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from numpy import linalg as LA
+
+from SigProfilerExtractor import subroutines as sub
+from SigProfilerExtractor import single_sample as ss
+
+
+class Scheduler:
+    def __init__(self, pool, n_workers):
+
+        """
+        Runs tasks on a multiprocessing pool in the order of their priority.
+
+        Only as many tasks as there are workers are handed to the pool at a time, so a task submitted
+        late with a high priority does not wait behind everything that was submitted before it.
+
+        :param pool: multiprocessing.Pool that runs the tasks
+        :param n_workers: number of processes of the pool
+        """
+
+        self.pool = pool
+        self.n_workers = n_workers
+        self._tasks = []
+        self._count = itertools.count()
+        self._events = queue.Queue()
+        self._running = 0
+        self._cancelled = False
+
+    def submit(self, priority, on_done, fn, args=(), kwds=None):
+
+        """
+        Queues the call fn(*args, **kwds). Tasks with the lowest priority run first, and tasks of
+        equal priority run in the order they were submitted.
+
+        :param priority: a tuple or a number
+        :param on_done: called with the result of the task, on the thread that runs the scheduler.
+                        It may submit more tasks.
+        """
+
+        heapq.heappush(self._tasks, (priority, next(self._count), on_done, fn, args, kwds or {}))
+
+    def cancel(self):
+
+        """
+        Stops handing queued tasks to the pool. The tasks already running are left to finish.
+        """
+
+        self._cancelled = True
+
+    def _dispatch(self):
+        while self._running < self.n_workers and self._tasks and not self._cancelled:
+            _, _, on_done, fn, args, kwds = heapq.heappop(self._tasks)
+            self.pool.apply_async(fn, args, kwds,
+                                  callback=lambda result, on_done=on_done: self._events.put((on_done, result, None)),
+                                  error_callback=lambda error: self._events.put((None, None, error)))
+            self._running += 1
+
+    def run(self):
+
+        """
+        Runs the tasks until none is left. The first error raised by a task is raised again here.
+        """
+
+        self._dispatch()
+        while self._running:
+            on_done, result, error = self._events.get()
+            self._running -= 1
+            if error is not None:
+                raise error
+            on_done(result)
+            self._dispatch()
+
+
+def extract_signatures(genomes, startProcess=1, endProcess=2, totalIterations=1, cpu=-1, mut_context="96", resample=True, seeds=None,
+                       init="alexandrov-lab-custom", normalization_cutoff=1, gpu=False, batch_size=128, batched=False, precision="single",
+                       tolerance=1e-6, test_conv=None, patience=3, solver="mu", warm_start=False, refit=True, pool=None, sparse=False,
+                       out_of_core=False, block_size=4096, checkpoint=None, cache=None, device=None, torch_threads=None, svd_store=None, bootstraps=None, identical=False, starts=1,
+                       start_iterations=500):
+
+    """
+    Extracts the signatures of every number of signatures from startProcess to endProcess with one pool of workers.
+
+    All the NMF replicates are queued up front, the ones with the most signatures first. As soon as all the replicates
+    of a number of signatures are done, its clustering is queued, and after it the optimisation of its exposures, while
+    the NMF of the other numbers of signatures keeps running. If warm_start is True, the replicates of k signatures are
+    queued when the same replicates for k-1 signatures are done. With the GPU engine (gpu True), the replicates of all
+    the numbers of signatures are packed together into full batches instead, see subroutines.rank_packs.
+
+    This is a generator: it yields the numbers of signatures in increasing order, as a tuple of the values returned by
+    subroutines.decipher_signatures and the output of single_sample.fit_signatures_pool for every sample (None if
+    refit is False or the clustering failed).
+    
+    pool is the multiprocessing.Pool to run on, with cpu processes. If it is None, a pool is created for this extraction.
+
+    checkpoint is None or a checkpoint.Checkpoint: the replicates and the clusterings it holds are restored instead of
+    queued, and the others are saved in it as they are done. cache is None or a cache.ReplicateCache that is used the
+    same way for the replicates.
+
+    If identical is True, as subroutines.identical_replicates decides, only the first replicate of every number of signatures
+    is fitted, and it is copied to the others before the clustering.
+    """
+
+    genomes = np.array(genomes)
+    ranks = list(range(startProcess, endProcess+1))
+    n_workers = multiprocessing.cpu_count() if cpu==-1 else cpu
+    if gpu:
+        # the GPU engine fits the replicates of different numbers of signatures together, in full batches
+        chunks, packs = sub.rank_packs(ranks, totalIterations, n_cpu=cpu, batch_size=batch_size, device=device)
+    else:
+        chunks = dict.fromkeys(ranks, sub.nmf_chunks(1 if identical else totalIterations, n_cpu=cpu, gpu=gpu, batch_size=batch_size, batched=batched, device=device))
+    warm_start = warm_start and not gpu and not out_of_core
+
+    # the genomes are shared with the workers, which write the W and H of every replicate into a shared Wall and Hall per rank
+    directory = tempfile.mkdtemp(prefix="sigprofiler_")
+    sharedGenomes = sub.SharedArray.create(directory, "genomes", array=genomes.T if out_of_core else genomes)
+    sharedWall = {k: sub.SharedArray.create(directory, "Wall_{}".format(k), shape=(genomes.shape[0], k*totalIterations)) for k in ranks}
+    sharedHall = {k: sub.SharedArray.create(directory, "Hall_{}".format(k), shape=(k*totalIterations, genomes.shape[1])) for k in ranks}
+
+    # the per-rank state, filled by the handlers below on the scheduler thread
+    started = {}
+    replicates = {k: [None]*totalIterations for k in ranks}
+    remaining = {k: len(chunks[k]) for k in ranks}
+    outputs = {}
+    done = threading.Condition()
+    failure = []
+
+    def restore_nmf(scheduler, k, c):
+        if k not in started:
+            started[k] = time.time()
+            print ("Extracting signature {} for mutation type {}".format(k, mut_context))
+        restored = sub.restore_replicates([checkpoint, cache], k, chunks[k][c], sharedWall[k], sharedHall[k])
+        if restored is not None:
+            nmf_done(scheduler, k, c, restored, saved=True)
+        return restored is not None
+
+    def submit_nmf(scheduler, k, c, warm_starts=None):
+        if restore_nmf(scheduler, k, c):
+            return
+        fn, args, kwds = sub.nmf_task(chunks[k][c], genomes=sharedGenomes, totalProcesses=k, seeds=seeds, init=init,
+                                      normalization_cutoff=normalization_cutoff, resample=resample, gpu=gpu, batched=batched,
+                                      precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience,
+                                      solver=solver, warm_starts=warm_starts, Wall=sharedWall[k], Hall=sharedHall[k], sparse=sparse,
+                                      out_of_core=out_of_core, block_size=block_size, device=device, torch_threads=torch_threads,
+                                      svd_store=svd_store, bootstraps=bootstraps, starts=starts, start_iterations=start_iterations)
+        # longest expected first: the cost of a chunk grows with the number of signatures and of replicates
+        scheduler.submit((1, -k*len(chunks[k][c])), lambda result: nmf_done(scheduler, k, c, result), fn, args, kwds)
+
+    def submit_pack(scheduler, pack):
+        pieces = [(k, c) for k, c in pack if not restore_nmf(scheduler, k, c)]
+        if not pieces:
+            return
+        fn = functools.partial(sub.pnmf_packed, genomes=sharedGenomes, seeds=seeds, Wall={k: sharedWall[k] for k, _ in pieces},
+                               Hall={k: sharedHall[k] for k, _ in pieces}, resample=resample, device=device, torch_threads=torch_threads, solver=solver)
+        def pack_done(result):
+            for (k, c), information in zip(pieces, result):
+                nmf_done(scheduler, k, c, information)
+        scheduler.submit((1, -sum(k*len(chunks[k][c]) for k, c in pieces)), pack_done, fn, ([(k, chunks[k][c]) for k, c in pieces],))
+
+    def nmf_done(scheduler, k, c, result, saved=False):
+        if not saved:
+            sub.save_replicates([checkpoint, cache], k, chunks[k][c], sharedWall[k], sharedHall[k], result)
+        for j, information in zip(chunks[k][c], result):
+            replicates[k][j] = information
+        remaining[k] -= 1
+        if warm_start and k < ranks[-1]:
+            Wall, Hall = sharedWall[k].open(mode="r"), sharedHall[k].open(mode="r")
+            warm_starts = [None]*totalIterations
+            for j in chunks[k][c]:
+                warm_starts[j] = (np.array(Wall[:, j*k:(j+1)*k]), np.array(Hall[j*k:(j+1)*k, :]))
+            submit_nmf(scheduler, k+1, c, warm_starts)
+        if remaining[k] == 0:
+            submit_clustering(scheduler, k)
+
+    def submit_clustering(scheduler, k):
+        print ("Time taken to collect {} iterations for {} signatures is {} seconds".format(totalIterations, k, round(time.time()-started[k], 2)))
+        if identical:
+            sub.copy_replicate(sharedWall[k], sharedHall[k], k, totalIterations)
+            replicates[k] = replicates[k][:1]*totalIterations
+        converge_information = np.array(replicates[k])
+        replicates[k] = None
+        Wall = sharedWall[k].read()
+        os.remove(sharedWall[k].path)
+        if out_of_core:
+            # the clustering workers map the out-of-core Hall, which is removed once they are done
+            finalgenomeErrors, finalgenomesReconstructed = None, None
+            Hall = sharedHall[k].open(mode="c")
+            clusteringHall = sharedHall[k]
+        else:
+            Hall = sharedHall[k].read()
+            os.remove(sharedHall[k].path)
+            finalgenomeErrors, finalgenomesReconstructed = sub.collect_replicates(genomes, Wall, Hall, k)
+            clusteringHall = Hall
+        collected = (finalgenomeErrors, finalgenomesReconstructed, Wall, Hall, converge_information)
+
+        clustering = None if checkpoint is None else checkpoint.clustering(k)
+        if clustering is not None:
+            submit_refit(scheduler, k, collected, [clustering])
+            return
+        # the restarts are compared as they are done, so that only the best one so far is kept with its exposures
+        restarts = 50
+        best = [None]
+        pending = [restarts]
+        def clustering_done(i, result):
+            best[0] = sub.better_clustering(best[0], i, result)
+            pending[0] -= 1
+            if pending[0] == 0:
+                clustering = best[0][1]
+                if checkpoint is not None:
+                    checkpoint.save_clustering(k, clustering)
+                submit_refit(scheduler, k, collected, [clustering])
+        # the restarts get the child streams that subroutines.parallel_clustering gives them
+        restart_seeds = sub.clustering_seed(seeds, k).spawn(restarts)
+        for i in range(restarts):
+            scheduler.submit((0, k), lambda result, i=i: clustering_done(i, result), sub.cluster_converge_innerloop, (Wall, clusteringHall, k, i, False, restart_seeds[i]))
+
+    def submit_refit(scheduler, k, collected, clusterings):
+        processAvg, exposureAvg, processSTE, exposureSTE, avgSilhouetteCoefficients, clusterSilhouetteCoefficients = sub.best_clustering(clusterings)
+        if out_of_core:
+            os.remove(sharedHall[k].path)
+        reconstruction_error = round(LA.norm(genomes-np.dot(processAvg, exposureAvg), 'fro')/LA.norm(genomes, 'fro'), 2)
+        output = (processAvg, exposureAvg, processSTE, exposureSTE, avgSilhouetteCoefficients, np.round(clusterSilhouetteCoefficients,3)) + collected + (reconstruction_error, k)
+
+        if not refit or avgSilhouetteCoefficients <= -1.0:
+            finish(k, output, None)
+            return
+        fits = [None]*genomes.shape[1]
+        pending = [len(fits)]
+        def refit_done(x, result):
+            fits[x] = result
+            pending[0] -= 1
+            if pending[0] == 0:
+                finish(k, output, fits)
+        for x in range(len(fits)):
+            scheduler.submit((0, k), lambda result, x=x: refit_done(x, result), ss.fit_signatures_pool, (genomes, processAvg, x))
+
+    def finish(k, output, fits):
+        with done:
+            outputs[k] = (output, fits)
+            done.notify_all()
+
+    def run(scheduler):
+        if gpu:
+            for pack in packs:
+                submit_pack(scheduler, pack)
+        for k in ([] if gpu else ranks[:1] if warm_start else ranks):
+            for c in range(len(chunks[k])):
+                submit_nmf(scheduler, k, c)
+        try:
+            scheduler.run()
+        except BaseException as error:
+            with done:
+                failure.append(error)
+                done.notify_all()
+
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes=n_workers)
+    scheduler = Scheduler(pool, n_workers)
+    thread = threading.Thread(target=run, args=(scheduler,), daemon=True)
+    thread.start()
+    try:
+        for k in ranks:
+            with done:
+                while k not in outputs and not failure:
+                    done.wait()
+                if failure:
+                    raise failure[0]
+                yield outputs.pop(k)
+        thread.join()
+    finally:
+        # also stops the work if the extraction failed or the generator was closed early
+        scheduler.cancel()
+        if own_pool:
+            pool.terminate()
+            pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -35,6 +35,7 @@ from SigProfilerExtractor import subroutines as sub
 import SigProfilerMatrixGenerator
 from SigProfilerMatrixGenerator.scripts import SigProfilerMatrixGeneratorFunc as datadump   
 import shutil
+import tempfile
 import multiprocessing as mp
 import SigProfilerExtractor as cosmic
 import platform
@@ -42,6 +43,10 @@ import datetime
 import psutil
 import sigProfilerPlotting 
 from SigProfilerExtractor import single_sample as ss
+from SigProfilerExtractor import scheduler as sched
+from SigProfilerExtractor import checkpoint as ckpt
+from SigProfilerExtractor import cache
+from SigProfilerExtractor import initialization
 import pickle
 def memory_usage():
     pid = os.getpid()
@@ -101,7 +106,7 @@ def importdata(datatype="matobj"):
     return data
 
 
-def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genome_build = 'GRCh37', startProcess=1, endProcess=10, totalIterations=8, init="alexandrov-lab-custom", cpu=-1,  mtype = "default",exome = False, penalty=0.05, resample = True, wall= False, gpu=False): 
+def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genome_build = 'GRCh37', startProcess=1, endProcess=10, totalIterations=8, init="alexandrov-lab-custom", cpu=-1,  mtype = "default",exome = False, penalty=0.05, resample = True, wall= False, gpu=False, batched=False, batch_size=128, precision="single", nmf_tolerance=1e-6, nmf_test_conv=None, nmf_patience=3, nmf_solver="mu", warm_start=False, scheduler=False, pool=None, nmf_sparse_density=0.5, out_of_core=False, out_of_core_block_size=4096, checkpoint=False, resume=False, nmf_cache=None, nmf_cache_size=1024, seed=None, device=None, torch_threads=None, nmf_shared_svd=True, nmf_shared_bootstraps=True, nmf_identical_replicates="once", nmf_starts=1, nmf_start_iterations=500): 
     memory_usage()
     """
     Extracts mutational signatures from an array of samples.
@@ -143,6 +148,111 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
     
     resample: Boolean, optional. Default is True. If True, add poisson noise to samples by resampling.  
     
+    batched: Boolean, optional. Default is False. If True, the replicates assigned to each processor are factorised together on the CPU 
+    as one stacked (3-D) problem instead of one at a time. Has no effect if "gpu" is True.
+    
+    batch_size: A positive integer, optional. Default is 128. The maximum number of replicates factorised together in a batch 
+    by the GPU or the batched CPU engine.
+    
+    precision: A string, optional. Default is "single". The floating point precision of the CPU NMF updates. Valid options are 
+    "single" (float32) and "double" (float64).
+    
+    nmf_tolerance: Float, optional. Default is 1e-6. A convergence test of an NMF replicate passes when the relative change of its 
+    Kullback-Leibler objective since the previous test is below this value; a larger rise fails it.
+    
+    nmf_test_conv: A positive integer, optional. The number of NMF iterations between two convergence tests. The default value depends 
+    on the "nmf_solver": 500 for "mu" and "emu", 100 for "amu" and 10 for "hals".
+    
+    nmf_patience: A positive integer, optional. Default is 3. The number of successive passing convergence tests after which an NMF 
+    replicate is converged. The iterations and the final objective of every replicate are reported in the "NMF_Convergence_Information" file.
+    "nmf_tolerance", "nmf_test_conv" and "nmf_patience" apply to the CPU engines. The GPU engine ("gpu" True or "device") tests every 2000 
+    iterations whether the decrease of the objective relative to its initial value is below 1e-8, once 2000 iterations are done.
+    
+    nmf_solver: A string, optional. Default is "mu". The CPU algorithm used to fit every NMF replicate. Valid options are:
+            - "mu": Kullback-Leibler multiplicative updates.
+            - "amu": accelerated multiplicative updates, where each factor is updated several times before switching to the other.
+            - "hals": Kullback-Leibler coordinate descent, updating one signature at a time with Newton steps.
+            - "emu": extrapolated multiplicative updates, where every update starts from the previous iterate moved further along 
+              its last change, with a step that shrinks whenever the objective goes up.
+    The batched CPU engine always uses multiplicative updates. The GPU engine uses multiplicative updates too, extrapolated with "emu".
+    
+    warm_start: Boolean, optional. Default is False. If True, every replicate of a number of signatures k starts from the solution of the 
+    same replicate for k-1 signatures, extended by one signature taken from the residual, instead of a fresh "init". Has no effect if "gpu" is True.
+    
+    scheduler: Boolean, optional. Default is False. If True, the NMF replicates of all the numbers of signatures are queued up front on one pool 
+    of workers, the ones with the most signatures first, and the clustering and optimisation of a number of signatures start as soon as its 
+    replicates are done, while the NMF of the other numbers of signatures keeps running. With the GPU engine, the replicates of different 
+    numbers of signatures are packed together into full batches of "batch_size" replicates.
+    
+    pool: multiprocessing.Pool, optional. Default is None. The pool of workers used by every parallel step of every mutation context. If None, 
+    one pool with "cpu" processes is created at the start of the run and closed at its end. A pool passed by the caller is left open.
+    
+    nmf_sparse_density: Float, optional. Default is 0.5. If less than this fraction of the entries of the mutational matrix are nonzero, the 
+    single CPU engine with the "mu" solver keeps the matrix in scipy.sparse format, bootstraps only its nonzero entries and computes the 
+    updates only at them. Set it to 0 to always use the dense engine.
+    
+    out_of_core: Boolean, optional. Default is False. If True, the single CPU engine keeps every bootstrap replicate, its H and the Hall of all 
+    the replicates in memory-mapped files in the temporary directory (set TMPDIR to choose it) and processes them "out_of_core_block_size" samples 
+    at a time, for cohorts whose replicates do not fit in memory. The clustering of the replicates reads Hall from its file in blocks of 
+    samples too, so only the exposures averaged over the replicates are held in memory. The errors and reconstructions of the individual 
+    replicates are not kept. Takes precedence over the sparse engine, and "warm_start" has no effect with it.
+    
+    out_of_core_block_size: Positive integer, optional. Default is 4096. The number of samples processed at a time by the out-of-core engine.
+    
+    checkpoint: Boolean, optional. Default is False. If True, every NMF replicate is saved as soon as it is fitted, and the clustering of every 
+    number of signatures as soon as it is done, in the "checkpoint" folder of the mutation context in the output folder. The folder is removed 
+    once the extraction of the mutation context is complete.
+    
+    resume: Boolean, optional. Default is False. If True, a run that was stopped is resumed from its checkpoints: the replicates and clusterings 
+    that were saved are not computed again, and the replicates that are left use the seeds of the stopped run. The run must be made on the same 
+    output folder with the same input and settings, and with the same "seed" or none; "startProcess" and "endProcess" may change. Implies 
+    "checkpoint".
+    
+    nmf_cache: A string, optional. Default is None. The path to a folder where the NMF replicates are cached, under the hash of the mutational 
+    matrix, the number of signatures, the seed, the NMF settings and the version of the package. A run that finds a replicate in the cache takes 
+    it instead of fitting it again. Every run on the same matrix and NMF settings without a "seed" uses the seeds of the first one, so that 
+    running the matrix again with another "endProcess" or "penalty", or to plot it again, reuses the replicates. A run with a "seed" keeps its 
+    own seeds. The folder can be shared by any number of runs.
+    
+    nmf_cache_size: Positive number, optional. Default is 1024. The maximum size of the "nmf_cache" folder in megabytes. When it is exceeded, the 
+    replicates that were used the longest time ago are removed.
+    
+    seed: A non-negative integer, optional. Default is None. The seed of the run. The bootstrap, the initialisation of every NMF replicate, the 
+    restarts of the clustering and the GPU engine all draw from their own child stream of its numpy SeedSequence, so the same seed gives the same 
+    results whatever the number of processors. If None, fresh entropy is used; it is written to JOB_METADATA.txt and can be passed as "seed" 
+    to reproduce the run. The seeds of the replicates that are used, which come from "nmf_cache" or from the stopped run with "resume", are 
+    written to JOB_METADATA.txt too.
+    
+    device: A string or a torch.device, optional. Default is None. The torch device of the GPU engine, e.g. "cpu", "cuda" or "cuda:1". If given, 
+    the replicates are factorised in batches by the torch engine on this device, as with "gpu" True, which needs no GPU with "cpu": the replicates 
+    are then split among the processors as by the batched CPU engine. If None, "gpu" True runs every processor on a GPU of its own.
+    
+    torch_threads: A positive integer, optional. The number of threads of every processor for the torch engine on the "cpu" device. The default 
+    value shares the processors of the machine equally among the "cpu" processes.
+    
+    nmf_shared_svd: Boolean, optional. Default is True. If True, a truncated SVD of every bootstrap replicate is computed once and shared by 
+    the NNDSVD initialisations ("init" other than "random") of the replicates of every number of signatures with the same seed, which are 
+    fitted on the same bootstrap matrix. The SVDs have ranks 8, 16, 32..., and a number of signatures takes the smallest one that is large 
+    enough, so its initialisation does not depend on "endProcess". If False, every number of signatures computes a new randomized SVD. The 
+    CPU engines use it, except the out-of-core engine and with "warm_start".
+    
+    nmf_shared_bootstraps: Boolean, optional. Default is True. If True and "resample" is True, the bootstrap replicates are drawn once, at the 
+    start of every mutation context, into a temporary memory-mapped file of "totalIterations" x mutation types x samples 32-bit counts, and 
+    the replicates of every number of signatures read them from it instead of drawing them again. The results are the same. The dense and 
+    batched CPU engines use it when more than one number of signatures is extracted. Set it to False if the file does not fit on the disk.
+    
+    nmf_identical_replicates: String, optional. Default is "once". What the CPU engines do when "resample" is False and "init" is deterministic 
+    ("nndsvd", "nndsvda" or "alexandrov-lab-custom"), which would fit the same factorisation "totalIterations" times. With "once", the 
+    factorisation is fitted once and copied to every replicate. With "diversify", the first replicate keeps "init" and the others start in turn 
+    from "nndsvdar" and "random" initialisations of their own seeds.
+    
+    nmf_starts: A positive integer, optional. Default is 1. If more than 1, every replicate of the dense and batched CPU engines starts from the 
+    best of "nmf_starts" initialisations: "init" and, in turn, "nndsvdar" and "random" initialisations of the seed of the replicate. They are 
+    fitted together for "nmf_start_iterations" iterations, the half with the lowest KL divergence is fitted for twice as many iterations, and so 
+    on until one is left, which is fitted to convergence.
+    
+    nmf_start_iterations: A positive integer, optional. Default is 500. The number of iterations of the first round of "nmf_starts".
+    
     
     Returns
     -------
@@ -240,11 +350,17 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
     
     
     """
+    if nmf_identical_replicates not in ("once", "diversify"):
+        raise ValueError("Invalid nmf_identical_replicates {}. Valid options are: once, diversify".format(nmf_identical_replicates))
+    if device is not None:
+        gpu = True # the torch engine, on device
     if gpu == True:
         import torch
     
-        if gpu and (torch.cuda.device_count() == 0):
+        if device is None and (torch.cuda.device_count() == 0):
             raise RuntimeError("GPU not available!")
+        if torch_threads is None:
+            torch_threads = max(1, mp.cpu_count() // (mp.cpu_count() if cpu==-1 else cpu))
     
     
     #################################### At first create the system data file ####################################
@@ -277,7 +393,9 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
             project_name = project.split("/")[-2]
     except:
         project_name = "Input from DataFrame"
-    sysdata.write("input_type: {}\ninputdata: {}\nstartProcess: {}\nendProcess: {}\ntotalIterations: {}\ncpu: {}\nrefgen: {}\ngenome_build: {}\nmtype: {} \ninit: {}\n".format(input_type, project_name, startProcess, endProcess, totalIterations, cpu, refgen, genome_build, mtype, init))
+    # every random stream of the run derives from this sequence
+    seed_sequence = np.random.SeedSequence(seed)
+    sysdata.write("input_type: {}\ninputdata: {}\nstartProcess: {}\nendProcess: {}\ntotalIterations: {}\ncpu: {}\nrefgen: {}\ngenome_build: {}\nmtype: {} \ninit: {}\nbatched: {}\nbatch_size: {}\nprecision: {}\nnmf_tolerance: {}\nnmf_test_conv: {}\nnmf_patience: {}\nnmf_solver: {}\nwarm_start: {}\nscheduler: {}\nnmf_sparse_density: {}\nout_of_core: {}\nout_of_core_block_size: {}\ncheckpoint: {}\nresume: {}\nnmf_cache: {}\nnmf_cache_size: {}\nseed: {}\ndevice: {}\ntorch_threads: {}\nnmf_shared_svd: {}\nnmf_shared_bootstraps: {}\nnmf_identical_replicates: {}\nnmf_starts: {}\nnmf_start_iterations: {}\n".format(input_type, project_name, startProcess, endProcess, totalIterations, cpu, refgen, genome_build, mtype, init, batched, batch_size, precision, nmf_tolerance, nmf_test_conv, nmf_patience, nmf_solver, warm_start, scheduler, nmf_sparse_density, out_of_core, out_of_core_block_size, checkpoint, resume, nmf_cache, nmf_cache_size, seed_sequence.entropy, device, torch_threads, nmf_shared_svd, nmf_shared_bootstraps, nmf_identical_replicates, nmf_starts, nmf_start_iterations))
     
     sysdata.write("\n-------Date and Time Data------- \n")
     tic = datetime.datetime.now()
@@ -469,7 +587,16 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
           
     ###########################################################################################################################################################################################                  
     
-    for m in mtypes:
+    # one pool of workers, started once, for every parallel step of every mutation context
+    own_pool = pool is None
+    if own_pool and cpu==-1:
+        pool = mp.Pool()
+    elif own_pool:
+        pool = mp.Pool(processes=cpu)
+    
+    def extract_mutation_type(m, temporary_directories):
+        # the names the mutation contexts share with the rest of the run, as when this was the body of their loop
+        nonlocal genomes, allgenomes, index, colnames, allcolnames, startProcess, endProcess
         
        
         mutation_context = m
@@ -514,7 +641,7 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
                 sysdata.write("Sample is not a nonzero matrix for the mutation context "+ m+"\n")
                 print("Sample is not a nozero matrix for the mutation context "+ m)
                 sysdata.close()
-                continue
+                return
                 
             genomes = genomes.loc[:, (genomes != 0).any(axis=0)]
             
@@ -560,19 +687,88 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
         
         
         # set up the seeds generation same matrices for different number of signatures
-        seeds = np.random.randint(0, 10000000, size=totalIterations) # set the seeds ranging from 0 to 10000000 for resampling and same seeds are used in different number of signatures
+        seeds = seed_sequence.spawn(1)[0].generate_state(totalIterations, dtype=np.uint64) # the same seeds are used in different number of signatures
         
         # get the cutoff for normatization to handle the hypermutators 
         
         normalization_cutoff = sub.get_normalization_cutoff(genomes)
+        
+        # fit the replicates with the sparse engine if most of the matrix is zeros
+        sparse = nmf_solver == "mu" and gpu == False and batched == False and out_of_core == False and np.count_nonzero(genomes) < nmf_sparse_density*genomes.size
+        
+        # without resampling, the deterministic initialisations would fit the same replicate totalIterations times
+        identical = sub.identical_replicates(resample, init, gpu, nmf_starts if sparse == False and out_of_core == False else 1)
+        replicate_init = init
+        if identical and nmf_identical_replicates == "diversify":
+            replicate_init, identical = sub.diverse_inits(init, totalIterations), False
+        
+        # the SVD of every bootstrap replicate, shared by the NNDSVD initialisations of all the numbers of signatures
+        if nmf_shared_svd == True and init != "random" and gpu == False and out_of_core == False and warm_start == False:
+            svd_store = initialization.SVDStore(tempfile.mkdtemp(prefix="sigprofiler_svd_"))
+            temporary_directories.append(svd_store.directory)
+        else:
+            svd_store = None
+        
+        # the settings that change the result of a replicate
+        settings = {"totalIterations": totalIterations, "resample": resample, "init": replicate_init, "gpu": gpu, "batched": batched, "precision": precision, 
+                    "nmf_tolerance": nmf_tolerance, "nmf_test_conv": nmf_test_conv, "nmf_patience": nmf_patience, "nmf_solver": nmf_solver, 
+                    "warm_start": warm_start, "sparse": bool(sparse), "out_of_core": out_of_core, "device": None if device is None else str(device), 
+                    "nmf_shared_svd": svd_store is not None, "nmf_starts": nmf_starts, "nmf_start_iterations": nmf_start_iterations}
+        
+        # take the replicates of earlier runs from the cache, which then decides the seeds unless the run has a seed of its own
+        if nmf_cache is not None:
+            replicate_cache = cache.ReplicateCache(nmf_cache, genomes, seeds, settings, max_size=nmf_cache_size, reuse_seeds=seed is None)
+            seeds = replicate_cache.seeds
+        else:
+            replicate_cache = None
+        
+        # save the replicates and clusterings as they are done, and take back those of a stopped run
+        if checkpoint == True or resume == True:
+            checkpoints, resumed_seeds = ckpt.Checkpoint.open(output+"/checkpoint", genomes, seeds, settings, resume=resume)
+            if seed is not None and not np.array_equal(resumed_seeds, seeds):
+                raise ValueError("The checkpoints in {} were written by a run with another seed. "
+                                 "Run with its seed, without a seed or with resume=False.".format(output+"/checkpoint"))
+            seeds = resumed_seeds
+            if replicate_cache is not None:
+                replicate_cache.seeds = seeds
+        else:
+            checkpoints = None
+        
+        # the seeds that are used, which may come from the cache or from the stopped run
+        sysdata = open(out_put+"/JOB_METADATA.txt", "a")
+        sysdata.write("Seeds of the replicates for {}: {}\n".format(mutation_type, ", ".join(str(int(s)) for s in seeds)))
+        sysdata.close()
+        
+        # the bootstrap replicates of the seeds, drawn once for all the numbers of signatures
+        if nmf_shared_bootstraps == True and resample == True and endProcess > startProcess and gpu == False and sparse == False and out_of_core == False:
+            temporary_directories.append(tempfile.mkdtemp(prefix="sigprofiler_bootstraps_"))
+            bootstraps = sub.bootstrap_replicates(genomes, seeds, temporary_directories[-1], pool)
+        else:
+            bootstraps = None
         #print("Normalization Cutoff is :", normalization_cutoff)
         
         #genomes = sub.normalize_samples(genomes, normalize=False, all_samples=False, number=30000)
         
         
+        previous_solution = None # the Wall and Hall of the previous number of signatures, used to warm start the next one
+        if scheduler == True:
+            extraction = sched.extract_signatures(genomes, startProcess=startProcess, endProcess=endProcess, totalIterations=totalIterations, 
+                                                  cpu=cpu, mut_context=m, resample=resample, seeds=seeds, init=replicate_init, 
+                                                  normalization_cutoff=normalization_cutoff, gpu=gpu, batch_size=batch_size, batched=batched, 
+                                                  precision=precision, tolerance=nmf_tolerance, test_conv=nmf_test_conv, patience=nmf_patience, 
+                                                  solver=nmf_solver, warm_start=warm_start, pool=pool, 
+                                                  sparse=sparse, out_of_core=out_of_core, block_size=out_of_core_block_size, 
+                                                  checkpoint=checkpoints, cache=replicate_cache, device=device, torch_threads=torch_threads, 
+                                                  svd_store=svd_store, bootstraps=bootstraps, identical=identical, 
+                                                  starts=nmf_starts, start_iterations=nmf_start_iterations)
         for i in range(startProcess,endProcess+1):
             current_time_start = datetime.datetime.now()
             
+            if scheduler == True:
+                deciphered, refitted = next(extraction)
+            else:
+                deciphered, refitted = None, None
+            
             #memory_usage()    
             processAvg, \
             exposureAvg, \
@@ -586,16 +782,39 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
             finalHall, \
             converge_information, \
             reconstruction_error, \
-            processes = sub.decipher_signatures(genomes= genomes, \
+            processes = deciphered or sub.decipher_signatures(genomes= genomes, \
                                                 i = i, \
                                                 totalIterations=totalIterations, \
                                                 cpu=cpu, \
                                                 mut_context=m, \
                                                 resample = resample,
                                                 seeds=seeds, 
-                                                init = init,
+                                                init = replicate_init,
                                                 normalization_cutoff=normalization_cutoff,
-                                                gpu=gpu,)
+                                                gpu=gpu,
+                                                batch_size=batch_size,
+                                                batched=batched,
+                                                precision=precision,
+                                                tolerance=nmf_tolerance,
+                                                test_conv=nmf_test_conv,
+                                                patience=nmf_patience,
+                                                solver=nmf_solver,
+                                                warm_start=previous_solution,
+                                                pool=pool,
+                                                sparse=sparse,
+                                                out_of_core=out_of_core,
+                                                block_size=out_of_core_block_size,
+                                                checkpoint=checkpoints,
+                                                cache=replicate_cache,
+                                                device=device,
+                                                torch_threads=torch_threads,
+                                                svd_store=svd_store,
+                                                bootstraps=bootstraps,
+                                                identical=identical,
+                                                starts=nmf_starts,
+                                                start_iterations=nmf_start_iterations)
+            if warm_start == True:
+                previous_solution = (finalWall, finalHall)
             
             
             
@@ -630,10 +849,11 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
                     
                 #refitting signatures:
                 #removing signatures:
-                pool = mp.Pool()
-                results = [pool.apply_async(ss.fit_signatures_pool, args=(genomes,processAvg,x,)) for x in range(genomes.shape[1])]
-                pooloutput = [p.get() for p in results]
-                pool.close()
+                if refitted is None:
+                    results = [pool.apply_async(ss.fit_signatures_pool, args=(genomes,processAvg,x,)) for x in range(genomes.shape[1])]
+                    pooloutput = [p.get() for p in results]
+                else:
+                    pooloutput = refitted
                                     
                 for i in range(len(pooloutput)):
                     
@@ -801,9 +1021,24 @@ def sigProfilerExtractor(input_type, out_put, input_data, refgen="GRCh37", genom
         except:
             print("\nWARNING!!! We apolozize we don't have a global signature database for the mutational context you provided. We have a database only for SBS96, DINUC and INDELS.\nTherefore no result for signature Decomposition is generated." )
             shutil.rmtree(layer_directory2)
+        
+        if checkpoints is not None:
+            checkpoints.remove()
                 
-            
-           
+    # the temporary directories of the mutation context in progress, removed with the pool even if the run fails
+    temporary_directories = []
+    try:
+        for m in mtypes:
+            extract_mutation_type(m, temporary_directories)
+            for directory in temporary_directories:
+                shutil.rmtree(directory, ignore_errors=True)
+            del temporary_directories[:]
+    finally:
+        for directory in temporary_directories:
+            shutil.rmtree(directory, ignore_errors=True)
+        if own_pool:
+            pool.close()
+            pool.join()
     
     sysdata = open(out_put+"/JOB_METADATA.txt", "a")
     toc = datetime.datetime.now()
@@ -16,17 +16,23 @@ import time
 import multiprocessing
 from multiprocessing import current_process
 from functools import partial
+import itertools
 from numpy import linalg as LA
 import sigProfilerPlotting as plot
 import string 
 import os
+import shutil
+import tempfile
 import scipy
+import scipy.sparse
 os.environ["MKL_NUM_THREADS"] = "1" 
 os.environ["NUMEXPR_NUM_THREADS"] = "1" 
 os.environ["OMP_NUM_THREADS"] = "1"
 import SigProfilerExtractor as cosmic
 from scipy.stats import  ranksums
 from SigProfilerExtractor import single_sample as ss
+from . import nmf_cpu
+from . import bootstrap
 #from sklearn.cluster import KMeans
 from sklearn.decomposition import NMF
 from sklearn import mixture
@@ -302,164 +308,278 @@ def matdiv(a,b):
     
     
     
-def inhouse_nmf(v, w=0, h=0, k=2, iterations=200000,tol=None):
+def inhouse_nmf(v, w=0, h=0, k=2, iterations=200000,tol=1e-6, precision="single", test_conv=500, patience=3, monitor=None):
     
-    v = np.float32(v)
-    #min_v = np.min(v[v>0])
+    """
+    Kullback-Leibler multiplicative update NMF of v starting from w and h.
+    
+    precision: "single" or "double". v, w and h are all cast to the same floating point type so no iteration
+    upcasts, and the updates run in preallocated work buffers with out= operations.
+    
+    Every test_conv iterations the KL objective is computed; the fit stops once its relative change has stayed
+    below tol for patience successive tests. Pass a nmf_cpu.ConvergenceMonitor as monitor to read the number of
+    iterations and the final objective after the fit.
+    """
+    dtype = np.float32 if precision == "single" else np.float64
+    v = np.asarray(v, dtype=dtype)
+    w = np.array(w, dtype=dtype)
+    h = np.array(h, dtype=dtype)
     n,m = v.shape[0], v.shape[1]
-    EPS = np.float32(np.finfo(float).eps)
-    #h[h <= min_v] = min_v
-    #w[w <= min_v] = min_v
-    initcost = 1000000000000 # a big number
-    conv = 1
+    k = w.shape[1]
+    EPS = dtype(np.finfo(float).eps)
+    
+    # work buffers reused by every iteration
+    wh = np.empty((n, m), dtype=dtype)   # holds the reconstruction w.h and then the ratio v/(w.h)
+    dot1 = np.empty((k, m), dtype=dtype)
+    dot2 = np.empty((n, k), dtype=dtype)
+    x1 = np.empty(k, dtype=dtype)
+    x2 = np.empty(k, dtype=dtype)
+    
+    if monitor is None:
+        monitor = nmf_cpu.ConvergenceMonitor(v, test_conv=test_conv, tolerance=tol, patience=patience)
     for i in range(iterations):
         
         #updata rule for h
-        x1 = np.repeat((np.sum(w,axis=0).T)[:,np.newaxis], m, axis=1)
-        #print(np.linalg.norm(x1))
-        dot1 = np.dot(w.T,(v/(np.dot(w,h))))
-        h= (h*dot1)/x1
-        #print(np.linalg.norm(h))
+        np.dot(w, h, out=wh)
+        np.divide(v, wh, out=wh)
+        np.dot(w.T, wh, out=dot1)
+        np.sum(w, axis=0, out=x1)
+        h *= dot1
+        h /= x1[:, np.newaxis]
         
         #updata rule for w
-        x2 = np.repeat((np.sum(h,axis=1).T)[np.newaxis,:], n, axis=0)
-        #print(np.linalg.norm(x2))
-        dot2 =np.dot((v/(np.dot(w,h))),h.T)
-        w=(w*dot2)/x2
-        #print(np.linalg.norm(w))
+        np.dot(w, h, out=wh)
+        np.divide(v, wh, out=wh)
+        np.dot(wh, h.T, out=dot2)
+        np.sum(h, axis=1, out=x2)
+        w *= dot2
+        w /= x2[np.newaxis, :]
         
         #Adjust small values every ten steps to avoid undeflow
         if (i+1)%10==0:
-            h[h <= EPS] = EPS
-            w[w <= EPS] = EPS
-        if (i+1)%500==0:    
-            est_v = np.dot(w, h)
-            
-            norm_v = np.linalg.norm(v)
-            norm_est_v = np.linalg.norm(est_v)
-            
-            cost = norm_est_v-norm_v
-            
-            diff = abs(initcost-cost)
-            initcost = cost
-            
-            
-            if diff <= tol:
-               #print(diff)
-               #print("diff is smaller than tol")
-               conv+=1
-               if conv==10:
-                  break
-            elif diff>tol:
-               conv =1
+            np.maximum(h, EPS, out=h)
+            np.maximum(w, EPS, out=w)
+        if monitor.due(i):
+            np.dot(w, h, out=wh)
+            if monitor.update(i, w, h, wh)[0]:
+                break
+    else:
+        if iterations % monitor.test_conv:
+            monitor.update(iterations-1, w, h, np.dot(w, h))
     
     
     return w, h
     
 
 
-def nnmf_gpu(genomes, nfactors):
-    p = current_process()
-    identity = p._identity[0]
-    #print(genomes.shape)
-    gpu_id = identity % torch.cuda.device_count()
-    genomes = torch.from_numpy(genomes).float().cuda(gpu_id)
-    net = nmf_gpu.NMF(genomes,rank=nfactors,max_iterations=100000,test_conv=2000, gpu_id=gpu_id, seed=None)
+def nnmf_gpu(genomes, nfactors, seeds=None, device=None, threads=None, resample=True, extrapolate=False):
+    """Fits one replicate of genomes for every seed of seeds with the torch engine on device, or, if device is None, on the
+    GPU of the worker. If resample is True, every replicate is a bootstrap of genomes, drawn on the device by nmf_gpu.bootstrap.
+    nfactors is the number of signatures, or a list with the number of signatures of every replicate, which are then fitted
+    in one batch padded to the largest one. threads is None or the number of threads torch uses on the CPU. extrapolate
+    selects the extrapolated updates of the "emu" solver. The engine has a convergence test of its own, so the tolerance,
+    test_conv and patience of the CPU engines do not apply to it."""
+    if device is None:
+        p = current_process()
+        identity = p._identity[0]
+        device = torch.device("cuda", identity % torch.cuda.device_count())
+    else:
+        device = torch.device(device)
+    if device.type == "cpu" and threads is not None:
+        torch.set_num_threads(threads)
+    genomes = torch.from_numpy(np.asarray(genomes, dtype=np.float32)).to(device)
+    if resample == True:
+        genomes = nmf_gpu.bootstrap(genomes, seeds, floor=0.0001)
+    else:
+        genomes = genomes.expand(len(seeds), -1, -1)
+    net = nmf_gpu.NMF(genomes,rank=nfactors,max_iterations=100000,test_conv=2000, seed=seeds, device=device, extrapolate=extrapolate)
     net.fit()
     Ws = []
     Hs = []
-    for H in net.H.detach().cpu().numpy():
-        Hs.append(np.matrix(H))
-    for W in net.W.detach().cpu().numpy():
-        Ws.append(np.matrix(W))
+    for H, rank in zip(net.H.detach().cpu().numpy(), net.ranks):
+        Hs.append(np.matrix(H[:rank]))
+    for W, rank in zip(net.W.detach().cpu().numpy(), net.ranks):
+        Ws.append(np.matrix(W[:, :rank]))
+    
+    # every replicate stops on its own convergence, so the iterations and the objective are reported per replicate
+    losses = nmf_gpu.NMF._kl_losses(net._V, net.W, net.H).cpu().numpy()
+    iterations = list(net.iterations)
 
-    return Ws, Hs
+    return Ws, Hs, iterations, losses
 
-def nnmf(genomes, nfactors, init="nndsvd"):
-    
-   
-    genomes = np.array(genomes)
-   
-    #print(init)       
-    #model_init = NMF(n_components=nfactors, max_iter=1, solver= "mu",init= "nndsvd", tol=0.0, beta_loss = 'kullback-leibler',  verbose=False)
-    #w = model_init.fit_transform(genomes)
-    #h = model_init.components_
-    w,h=initialize_nmf(genomes, nfactors, init=init, eps=1e-6,random_state=None)
-    W, H = inhouse_nmf(genomes, w=w, h=h, k=nfactors, iterations=200000, tol=0.0005)
-    
-    
+def convergence_information(genomes, W, H, iterations, loss):
     
+    """ 
+    Summarises a replicate for the NMF convergence report: the average L1, L1 %, L2, L2 % and KL divergence over 
+    the samples, followed by the number of NMF iterations and the final KL objective of the fit.
+    """
     #calculate L1, L2 and KL for the solution 
     est_genome = np.array(np.dot(W, H))
-    
     similarities = calculate_similarities(genomes, est_genome, sample_names=False)[0].iloc[:,2:]
     similarities = np.array(np.mean(similarities, axis=0)).T
     
-    
-    
-
-    return W, H, similarities
+    return np.append(similarities, [iterations, loss])
 
 
+# The CPU NMF solvers selectable in nnmf: name -> (solver, default number of solver iterations between convergence tests)
+NMF_SOLVERS = {"mu": (inhouse_nmf, 500),                      # multiplicative updates
+               "amu": (nmf_cpu.accelerated_mu_nmf, 100),     # accelerated multiplicative updates
+               "hals": (nmf_cpu.hals_kl_nmf, 10),            # KL coordinate descent
+               "emu": (nmf_cpu.extrapolated_mu_nmf, 500)}    # extrapolated multiplicative updates
 
 
-def BootstrapCancerGenomes(genomes, seed=None):
-    np.random.seed(seed) # Every time initiate a random seed so that all processors don't get the same seed
+def nnmf(genomes, nfactors, init="nndsvd", precision="single", tolerance=1e-6, test_conv=None, patience=3, solver="mu", warm_start=None, random_state=None, svd_store=None, seed=None, starts=1, start_iterations=500):
+    """Fits one replicate. svd_store is None or an initialization.SVDStore, which gives the SVD of genomes for the NNDSVD
+    initializations under seed, the seed of the replicate. If starts is more than 1, the dense engine fits the best of
+    starts initializations, chosen by successive_halving with a first round of start_iterations iterations."""
     
-    """
-    index = genomes.index
-    cols = genomes.columns
+    # a scipy.sparse genome matrix is fitted by the sparse engine, and only made dense for the initialization and the report
+    sparse_genomes = None
+    if scipy.sparse.issparse(genomes):
+        if solver != "mu":
+            raise ValueError("The sparse NMF engine only supports the \"mu\" solver")
+        sparse_genomes = scipy.sparse.csc_matrix(genomes)
+        genomes = sparse_genomes.toarray()
     genomes = np.array(genomes)
-    n = 100
-    stderr = genomes*0.025
-    std = stderr*math.sqrt(n)
-    genomes = np.random.normal(genomes, std, size=None).astype(int)
-    genomes[genomes<0] = 0
-
-    dataframe = pd.DataFrame(genomes)
-    dataframe.index = index
-    dataframe.columns = cols 
-    """
-    #normalize the data 
-    a = pd.DataFrame(genomes.sum(0))  #performing the sum of each column. variable a store the sum
-    a = a.transpose()  #transfose the value so that if gets a proper dimention to normalize the data
-    repmat = pd.concat([a]*genomes.shape[0])  #normalize the data to get the probility of each datapoint to perform the "random.multinomial" operation
-    normGenomes = genomes/np.array(repmat)      #part of normalizing step
+   
+    #print(init)       
+    #model_init = NMF(n_components=nfactors, max_iter=1, solver= "mu",init= "nndsvd", tol=0.0, beta_loss = 'kullback-leibler',  verbose=False)
+    #w = model_init.fit_transform(genomes)
+    #h = model_init.components_
+    spent = 0 # the iterations of the multi-start rounds
+    if warm_start is None:
+        svd = None if svd_store is None or init == "random" else svd_store.svd(genomes, seed, nfactors)
+        if starts > 1 and sparse_genomes is None:
+            w,h,spent=successive_halving(genomes, nfactors, starts=starts, iterations=start_iterations, init=init, eps=1e-6, random_state=random_state, svd=svd, precision=precision)
+        else:
+            w,h=initialize_nmf(genomes, nfactors, init=init, eps=1e-6,random_state=random_state, svd=svd)
+    else:
+        w,h=extend_nmf(genomes, warm_start[0], warm_start[1], eps=1e-6, random_state=random_state)
+    try:
+        nmf_solver, default_test_conv = NMF_SOLVERS[solver]
+    except KeyError:
+        raise ValueError("Invalid NMF solver {}. Valid options are: {}".format(solver, ", ".join(NMF_SOLVERS)))
+    if test_conv is None:
+        test_conv = default_test_conv
+    if sparse_genomes is None:
+        monitor = nmf_cpu.ConvergenceMonitor(genomes, test_conv=test_conv, tolerance=tolerance, patience=patience)
+        W, H = nmf_solver(genomes, w=w, h=h, k=nfactors, iterations=200000, precision=precision, monitor=monitor)
+    else:
+        monitor = nmf_cpu.SparseConvergenceMonitor(sparse_genomes, test_conv=test_conv, tolerance=tolerance, patience=patience)
+        W, H = nmf_cpu.sparse_kl_nmf(sparse_genomes, w=w, h=h, k=nfactors, iterations=200000, precision=precision, monitor=monitor)
     
+    similarities = convergence_information(genomes, W, H, spent+monitor.iterations[0], monitor.loss[0])
+
+    return W, H, similarities
+
+
+def nnmf_batch(genome_list, nfactors, init="nndsvd", precision="single", tolerance=1e-6, test_conv=None, patience=3, warm_starts=None, random_states=None, svd_store=None, seeds=None, starts=1, start_iterations=500):
+    
+    # initialize every replicate on its own matrix, with its own random state, then fit all of them as one stacked problem
+    genome_list = [np.array(genomes) for genomes in genome_list]
+    if warm_starts is None:
+        warm_starts = [None]*len(genome_list)
+    if random_states is None:
+        random_states = [None]*len(genome_list)
+    if seeds is None:
+        seeds = [None]*len(genome_list)
+    # init is the initialization of all the replicates, or a list of the initialization of every replicate
+    init_list = [replicate_init(init, i) for i in range(len(genome_list))]
+    svds = [None if svd_store is None or init == "random" or warm_start is not None else svd_store.svd(genomes, seed, nfactors)
+            for genomes, warm_start, seed, init in zip(genome_list, warm_starts, seeds, init_list)]
+    inits = [extend_nmf(genomes, warm_start[0], warm_start[1], eps=1e-6, random_state=random_state) + (0,) if warm_start is not None
+             else successive_halving(genomes, nfactors, starts=starts, iterations=start_iterations, init=init, eps=1e-6, random_state=random_state, svd=svd, precision=precision) if starts > 1
+             else initialize_nmf(genomes, nfactors, init=init, eps=1e-6, random_state=random_state, svd=svd) + (0,)
+             for genomes, warm_start, random_state, svd, init in zip(genome_list, warm_starts, random_states, svds, init_list)]
+    net = nmf_cpu.NMF(np.array(genome_list), np.array([w for w, _, _ in inits]), np.array([h for _, h, _ in inits]),
+                      max_iterations=200000, tolerance=tolerance, test_conv=test_conv or NMF_SOLVERS["mu"][1], patience=patience,
+                      floating_point_precision='float' if precision=="single" else 'double')
+    net.fit()
     
-    #Get the normGenomes as Matlab/ alternation of the "mnrnd" fuction in Matlap
-    #do the Boostraping 
-    dataframe = pd.DataFrame() #declare an empty variable to populate with the Bootstrapped data
-    for i in range(0,normGenomes.shape[1]):
-        #print a.iloc[:,i]
-        #print normGenomes.iloc[:,i]
-        dataframe[i]=list(np.random.multinomial(a.iloc[:,i], normGenomes.iloc[:,i], 1)[0])
-        
-   
-    return dataframe
+    results = []
+    for genomes, W, H, iterations, loss, (_, _, spent) in zip(genome_list, net.W, net.H, net.iterations, net.loss, inits):
+        results.append((W, H, convergence_information(genomes, W, H, spent+iterations, loss)))
+    
+    return results
+
+
+
+
+# the initializations that start every replicate at the same point: without resampling, all the replicates are the same
+DETERMINISTIC_INITS = ("nndsvd", "nndsvda", "alexandrov-lab-custom")
+# the initializations that diverse_inits gives the replicates after the first one, in turn
+DIVERSE_INITS = ("nndsvdar", "random")
+
+def identical_replicates(resample=True, init="nndsvd", gpu=False, starts=1):
+    """True if all the replicates of a number of signatures fit the same factorisation: the CPU engines start every replicate
+    of the genomes, which are not resampled, from the same deterministic initialization. The GPU engine starts every replicate
+    from random matrices of its own seed, and with starts > 1 the other starts of every replicate are seeded initializations."""
+    return resample == False and gpu == False and starts == 1 and init in DETERMINISTIC_INITS
+
+def diverse_inits(init, iterations):
+    """The initialization of every replicate of a run with identical_replicates: the first replicate keeps init, and the others
+    take the seeded initializations of DIVERSE_INITS in turn, so that they start from different points."""
+    return [init]+[DIVERSE_INITS[(j-1) % len(DIVERSE_INITS)] for j in range(1, iterations)]
+
+def replicate_init(init, j):
+    """The initialization of replicate j, where init is one initialization for all the replicates or a list of diverse_inits"""
+    return init if isinstance(init, str) else init[j]
+
+def copy_replicate(Wall, Hall, totalProcesses, iterations):
+    """Copies the W and H of the first replicate for totalProcesses signatures to all the iterations replicates of the
+    SharedArrays Wall and Hall, for the runs with identical_replicates that fit only the first one"""
+    k = totalProcesses
+    Wall = Wall.open()
+    Hall = Hall.open()
+    # one replicate at a time, as the out-of-core Hall does not fit in memory
+    for j in range(1, iterations):
+        Wall[:, j*k:(j+1)*k] = Wall[:, :k]
+        Hall[j*k:(j+1)*k, :] = Hall[:k, :]
+    Wall.flush()
+    Hall.flush()
+
+def replicate_streams(seed=None):
+    """The independent random streams of the NMF replicate with the given seed, as child streams of its numpy SeedSequence:
+    a numpy Generator for the bootstrap, and a RandomState driven by its own stream for the initialization, which is the
+    random state that initialize_nmf accepts. A replicate gets the same streams whatever worker or chunk fits it."""
+    bootstrap, initialization = np.random.SeedSequence(None if seed is None else int(seed)).spawn(2)
+    return np.random.default_rng(bootstrap), np.random.RandomState(np.random.MT19937(initialization))
+
+def clustering_seed(seeds, totalProcesses):
+    """The SeedSequence of the clustering restarts for totalProcesses signatures, derived from the seeds of the replicates
+    so that the clustering is as reproducible as the replicates."""
+    if seeds is None:
+        return np.random.SeedSequence()
+    return np.random.SeedSequence([int(seed) for seed in seeds]+[totalProcesses])
+
+def BootstrapCancerGenomes(genomes, seed=None):
+    """Resamples the mutations of every sample (column) of genomes with a multinomial distribution, and returns the
+    bootstrapped genomes as a DataFrame. seed is a seed, a SeedSequence or a numpy Generator. The NMF engines use
+    bootstrap.bootstrap_genomes, which returns the array they consume."""
+    return pd.DataFrame(bootstrap.bootstrap_genomes(genomes, seed=seed))
+
+def BootstrapSparseCancerGenomes(genomes, seed=None):
+    """Sparse version of BootstrapCancerGenomes: resamples the mutations of every sample among its nonzero mutation types
+    only, and returns the bootstrapped genomes as a scipy.sparse CSC matrix."""
+    return bootstrap.bootstrap_sparse_genomes(genomes, seed=seed)
 
 # NMF version for the multiprocessing library
-def pnmf(batch_size=1, genomes=1, totalProcesses=1, resample=True, init="nndsvd", seeds=None, normalization_cutoff=10000000, gpu=False):
+def pnmf(batch_size=1, genomes=1, totalProcesses=1, resample=True, init="nndsvd", seeds=None, normalization_cutoff=10000000, gpu=False, precision="single", tolerance=1e-6, test_conv=None, patience=3, solver="mu", warm_start=None, sparse=False, device=None, torch_threads=None, svd_store=None, bootstraps=None, replicate=None, starts=1, start_iterations=500):
+    """Fits the replicate with seed seeds (or, with gpu, a batch of replicates with the list of seeds seeds). bootstraps is None
+    or the SharedArray of bootstrap_replicates, whose replicate-th bootstrap the CPU engine takes instead of drawing it again.
+    starts and start_iterations are the multi-start of the CPU engine, see nnmf."""
     tic = time.time()
+    genomes = shared_data(genomes)
     totalMutations = np.sum(genomes, axis =0)
-    genomes = pd.DataFrame(genomes) #creating/loading a dataframe/matrix
 
     if gpu:
-        nmf_fn = nnmf_gpu
+        nmf_fn = partial(nnmf_gpu, device=device, threads=torch_threads, resample=resample, extrapolate=solver=="emu")
         results = []
-        genome_list = []
 
-        for b in range(batch_size):
-            if resample == True:
-                bootstrapGenomes= BootstrapCancerGenomes(genomes)
-                bootstrapGenomes[bootstrapGenomes<0.0001]= 0.0001
-                genome_list.append(bootstrapGenomes.values)
-            else:
-                genome_list.append(genomes)
-            #print(genomes.shape)
-       
-        g = np.array(genome_list)
-        W, H = nmf_fn(g, totalProcesses)
+        # seeds holds the seed of every replicate of the batch, which is bootstrapped on the device of the engine
+        if seeds is None:
+            seeds = [None]*batch_size
+        W, H, iterations, losses = nmf_fn(genomes, totalProcesses, seeds=seeds)
         for i in range(len(W)):
             
             _W = np.array(W[i])
@@ -467,27 +587,34 @@ def pnmf(batch_size=1, genomes=1, totalProcesses=1, resample=True, init="nndsvd"
             total = _W.sum(axis=0)[np.newaxis]
             _W = _W/total
             _H = _H*total.T
-            results.append((_W, _H))
+            results.append((_W, _H, iterations[i], losses[i]))
             print ("process " +str(totalProcesses)+" continues please wait... ")
             print ("execution time: {} seconds \n".format(round(time.time()-tic), 2))
 
         return results
 
     else:
-        nmf_fn = nnmf
+        rng, random_state = replicate_streams(seeds)  # seeds is the seed of the replicate
+        nmf_fn = partial(nnmf, random_state=random_state, svd_store=svd_store, seed=seeds, starts=starts, start_iterations=start_iterations)
         
-        if resample == True:
-            bootstrapGenomes= BootstrapCancerGenomes(genomes, seed=seeds)
-            
-            #print(pool_constant)
-            #print(bootstrapGenomes.iloc[0,:].T)
-            #print("\n\n\n")
-            
-            
-            bootstrapGenomes[bootstrapGenomes<0.0001]= 0.0001
+        if sparse == True:
+            # the zeros are left as they are, so that the sparse engine only works on the observed mutation types
+            if resample == True:
+                genomes = bootstrap.bootstrap_sparse_genomes(genomes, seed=rng)
+            else:
+                genomes = scipy.sparse.csc_matrix(genomes)
+            totalMutations = np.asarray(genomes.sum(axis=0)).ravel()
+            log2_of_tM = np.log2(totalMutations)
+            W, H, kl = nmf_fn(genomes,totalProcesses, init= init, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, solver=solver, warm_start=warm_start)  #uses custom function nnmf
+        
+        elif resample == True:
+            # drawn directly in the floating point type of the engine, so the engine does not copy it
+            if bootstraps is None:
+                bootstrapGenomes= bootstrap.bootstrap_genomes(genomes, seed=rng, dtype=np.float32 if precision=="single" else np.float64, floor=0.0001)
+            else:
+                bootstrapGenomes= stored_bootstrap(bootstraps, replicate, dtype=np.float32 if precision=="single" else np.float64)
             
             # normalize the samples to handle the hypermutators
-            bootstrapGenomes = np.array(bootstrapGenomes)
             #print(normalization_cutoff)
             #bootstrapGenomes = normalize_samples(bootstrapGenomes, normalize=True, all_samples=False, number=normalization_cutoff)
             #print(type(bootstrapGenomes))
@@ -495,12 +622,13 @@ def pnmf(batch_size=1, genomes=1, totalProcesses=1, resample=True, init="nndsvd"
             totalMutations = np.sum(bootstrapGenomes, axis=0)
             log2_of_tM = np.log2(totalMutations)
             #bootstrapGenomes = bootstrapGenomes/totalMutations*log2_of_tM
-            W, H, kl = nmf_fn(bootstrapGenomes,totalProcesses, init=init)  #uses custom function nnmf
+            W, H, kl = nmf_fn(bootstrapGenomes,totalProcesses, init=init, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, solver=solver, warm_start=warm_start)  #uses custom function nnmf
         
         else:
             #genomes = normalize_samples(genomes[:,:,seed], normalize=False, all_samples=False, number=normalization_cutoff)
             #print(genomes)
-            W, H, kl = nmf_fn(genomes,totalProcesses, init= init)  #uses custom function nnmf
+            log2_of_tM = np.log2(totalMutations)
+            W, H, kl = nmf_fn(genomes,totalProcesses, init= init, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, solver=solver, warm_start=warm_start)  #uses custom function nnmf
         #print ("initital W: ", W); print("\n");
         #print ("initial H: ", H); print("\n");
         W = np.array(W)
@@ -519,6 +647,102 @@ def pnmf(batch_size=1, genomes=1, totalProcesses=1, resample=True, init="nndsvd"
         return W, H, kl
 
 
+# Out-of-core NMF version for the multiprocessing library: one replicate of a genome matrix that does not fit in memory
+def pnmf_out_of_core(seed=None, genomes=None, totalProcesses=1, resample=True, init="nndsvd", precision="single", tolerance=1e-6, test_conv=None, patience=3, block_size=4096, replicate=0, Wall=None, Hall=None):
+    """genomes is the SharedArray of the transposed genome matrix (samples in rows). The bootstrap replicate and the transposed
+    H are kept in memory-mapped files next to it and processed block_size samples at a time, and W and H are written into
+    the shared Wall and Hall at the position of replicate. Returns the convergence information of the replicate in a list."""
+    tic = time.time()
+    genomes_t = genomes.open(mode="r")
+    totalGenomes = genomes_t.shape[0]
+    directory = tempfile.mkdtemp(prefix="sigprofiler_", dir=os.path.dirname(genomes.path))
+    rng, random_state = replicate_streams(seed)
+    try:
+        if resample == True:
+            # bootstrap the samples block by block, with the samples of a block drawn together
+            bootstrapGenomes = SharedArray.create(directory, "bootstrap", shape=genomes_t.shape).open()
+            for start in range(0, totalGenomes, block_size):
+                bootstrapGenomes[start:start+block_size] = bootstrap.bootstrap_genomes(genomes_t[start:start+block_size].T, seed=rng, floor=0.0001).T
+        else:
+            bootstrapGenomes = genomes_t
+        
+        # W from the first block of samples, and H from W by least squares
+        w, _ = initialize_nmf(np.array(bootstrapGenomes[:block_size], dtype=np.float64).T, totalProcesses, init=init, eps=1e-6, random_state=random_state)
+        h_t = SharedArray.create(directory, "H", shape=(totalGenomes, totalProcesses)).open()
+        pseudo_inverse = np.linalg.pinv(w)
+        for start in range(0, totalGenomes, block_size):
+            block = np.asarray(bootstrapGenomes[start:start+block_size])
+            h_t[start:start+block_size] = np.maximum(np.dot(block, pseudo_inverse.T), 1e-6)
+        
+        monitor = nmf_cpu.OutOfCoreConvergenceMonitor(bootstrapGenomes, block_size=block_size, test_conv=test_conv or NMF_SOLVERS["mu"][1], tolerance=tolerance, patience=patience)
+        W = nmf_cpu.out_of_core_kl_nmf(bootstrapGenomes, w, h_t, iterations=200000, precision=precision, monitor=monitor, block_size=block_size)
+        
+        # the report of convergence_information, averaged over the blocks of samples
+        similarities = 0
+        for start in range(0, totalGenomes, block_size):
+            block = np.asarray(bootstrapGenomes[start:start+block_size], dtype=np.float64)
+            est_genome = np.dot(W, np.asarray(h_t[start:start+block_size], dtype=np.float64).T)
+            similarities = similarities + np.array(calculate_similarities(block.T, est_genome, sample_names=False)[0].iloc[:,2:]).sum(axis=0)
+        information = np.append(similarities/totalGenomes, [monitor.iterations[0], monitor.loss[0]])
+        
+        # normalize W and denormalize H as pnmf does, and write them into the shared Wall and Hall
+        W = np.array(W, dtype=np.float64)
+        total = W.sum(axis=0)
+        k = totalProcesses
+        Wall = Wall.open()
+        Hall = Hall.open()
+        Wall[:, replicate*k:(replicate+1)*k] = W/total
+        for start in range(0, totalGenomes, block_size):
+            H = np.asarray(h_t[start:start+block_size], dtype=np.float64).T*total[:, np.newaxis]
+            totalMutations = np.asarray(bootstrapGenomes[start:start+block_size], dtype=np.float64).sum(axis=1)
+            Hall[replicate*k:(replicate+1)*k, start:start+block_size] = denormalize_samples(H, totalMutations)
+        Wall.flush()
+        Hall.flush()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    
+    print ("process " +str(totalProcesses)+" continues please wait... ")
+    print ("execution time: {} seconds \n".format(round(time.time()-tic), 2))
+    
+    return [information]
+
+
+# Batched NMF version for the multiprocessing library: fits all the replicates of a chunk of seeds together
+def pnmf_batch(seeds, genomes=1, totalProcesses=1, resample=True, init="nndsvd", normalization_cutoff=10000000, precision="single", tolerance=1e-6, test_conv=None, patience=3, warm_starts=None, svd_store=None, bootstraps=None, replicates=None, starts=1, start_iterations=500):
+    """Fits the replicates with the seeds seeds together. bootstraps is None or the SharedArray of bootstrap_replicates, whose
+    bootstraps of indices replicates are taken instead of drawing them again. starts and start_iterations are the multi-start
+    of every replicate, see nnmf."""
+    tic = time.time()
+    genomes = shared_data(genomes)
+    
+    genome_list = []
+    streams = [replicate_streams(seed) for seed in seeds]
+    for i, (rng, _) in enumerate(streams):
+        if resample == True and bootstraps is not None:
+            genome_list.append(stored_bootstrap(bootstraps, replicates[i]))
+        elif resample == True:
+            genome_list.append(bootstrap.bootstrap_genomes(genomes, seed=rng, floor=0.0001))
+        else:
+            genome_list.append(np.array(genomes))
+    
+    results = []
+    for replicate, (W, H, kl) in zip(genome_list, nnmf_batch(genome_list, totalProcesses, init=init, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, warm_starts=warm_starts, random_states=[random_state for _, random_state in streams], svd_store=svd_store, seeds=seeds, starts=starts, start_iterations=start_iterations)):
+        W = np.array(W)
+        H = np.array(H)
+        total = W.sum(axis=0)[np.newaxis]
+        W = W/total
+        H = H*total.T
+        
+        # denormalize H
+        H = denormalize_samples(H, np.sum(replicate, axis=0))
+        results.append((W, H, kl))
+    
+    print ("process " +str(totalProcesses)+" continues please wait... ")
+    print ("execution time: {} seconds \n".format(round(time.time()-tic), 2))
+    
+    return results
+
+
 # =============================================================================
 # def pnmf(seed=None, genomes=1, totalProcesses=1, resample=True, init="random", normalization_cutoff=10000000, gpu=False):
 #     
@@ -576,38 +800,280 @@ def pnmf(batch_size=1, genomes=1, totalProcesses=1, resample=True, init="nndsvd"
 #     return W, H, kl
 # =============================================================================
 
-def parallel_runs(genomes=1, totalProcesses=1, iterations=1, seeds=None, init="nndsvd", normalization_cutoff=1000000, n_cpu=-1, verbose = False, resample=True, gpu=False, batch_size=128):
-    if verbose:
-        print ("Process "+str(totalProcesses)+ " is in progress\n===================================>")
-    if n_cpu==-1:
-        pool = multiprocessing.Pool()
-    else:
-        pool = multiprocessing.Pool(processes=n_cpu)
-
+class SharedArray:
+    def __init__(self, path, shape, dtype=np.float64):
+
+        """
+        A numpy array kept in a memory-mapped file. It is pickled as its path, shape and dtype, so the workers
+        of a pool map the same memory instead of receiving a copy of the data.
+
+        :param path: the file of the array
+        :param shape: the shape of the array
+        :param dtype: the dtype of the array
+        """
+
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def create(cls, directory, name, shape=None, dtype=np.float64, array=None):
+        """Creates the file of a new shared array in directory, filled with array if it is given, else with zeros"""
+        if array is not None:
+            array = np.asarray(array)
+            shape, dtype = array.shape, array.dtype
+        shared = cls(os.path.join(directory, name+".dat"), shape, dtype)
+        data = shared.open(mode="w+")
+        if array is not None:
+            data[...] = array
+        data.flush()
+        return shared
+
+    def open(self, mode="r+"):
+        """Maps the array; "r+" writes to the shared memory and "c" keeps the writes private to the process"""
+        return np.memmap(self.path, dtype=self.dtype, mode=mode, shape=self.shape)
+
+    def read(self):
+        """Returns an in-memory copy of the array"""
+        return np.array(self.open(mode="r"))
+
+def bootstrap_replicates(genomes, seeds, directory, pool):
+    """Draws the bootstrap replicate of every seed of seeds once for all the numbers of signatures of a run, on the workers of
+    pool, into a SharedArray of replicates x mutation types x samples of int32 mutation counts in directory. Replicate j holds
+    the counts that pnmf would draw from the bootstrap stream of seeds[j]; stored_bootstrap reads it back."""
+    genomes = np.asarray(genomes)
+    bootstraps = SharedArray.create(directory, "bootstraps", shape=(len(seeds),)+genomes.shape, dtype=np.int32)
+    sharedGenomes = SharedArray.create(directory, "bootstrap_genomes", array=genomes)
+    pool.starmap(draw_bootstrap, [(sharedGenomes, bootstraps, j, seed) for j, seed in enumerate(seeds)])
+    os.remove(sharedGenomes.path)
+    return bootstraps
+
+def draw_bootstrap(genomes, bootstraps, replicate, seed):
+    """Worker call of bootstrap_replicates: draws the bootstrap replicate of seed into bootstraps"""
+    data = bootstraps.open()
+    data[replicate] = bootstrap.bootstrap_genomes(shared_data(genomes), seed=replicate_streams(seed)[0], dtype=np.int32)
+    data.flush()
+
+def stored_bootstrap(bootstraps, replicate, dtype=np.float64, floor=0.0001):
+    """The replicate-th bootstrap replicate of the SharedArray of bootstrap_replicates, in dtype and floored at floor, the same
+    array as bootstrap.bootstrap_genomes returns for its seed"""
+    return np.maximum(bootstraps.open(mode="r")[replicate].astype(dtype), floor)
+
+def shared_data(array):
+    """Returns array, or the data behind it if it is a SharedArray"""
+    if isinstance(array, SharedArray):
+        return array.open(mode="c")
+    return array
+
+def nmf_chunks(iterations=1, n_cpu=-1, gpu=False, batch_size=128, batched=False, device=None):
+    """Splits the replicates of one number of signatures into the chunks that are fitted by one worker call.
+    Returns a list of arrays with the indices of the replicates (and of their seeds) in every chunk.
+    The torch engine (gpu True) on the CPU device is split as the batched CPU engine, so that every worker gets a chunk."""
     num_full_batches = iterations // batch_size
     last_batch_size = iterations % batch_size
 
     batches = [batch_size for _ in range(num_full_batches)]
     if last_batch_size != 0:
         batches.append(last_batch_size)
-
-    
     
+    if gpu==True and not str(device).startswith("cpu"):
+        return np.split(np.arange(iterations), np.cumsum(batches)[:-1])
+    elif batched==True or gpu==True:
+        # split the seeds into at least one chunk per processor, with no more than batch_size seeds in a chunk
+        n_workers = multiprocessing.cpu_count() if n_cpu==-1 else n_cpu
+        n_chunks = max(len(batches), min(n_workers, iterations))
+        return [chunk for chunk in np.array_split(np.arange(iterations), n_chunks) if len(chunk)]
+    else:
+        return [np.array([j]) for j in range(iterations)]
+
+def rank_packs(ranks, iterations=1, n_cpu=-1, batch_size=128, device=None):
+    """Packs the replicates of all the numbers of signatures of ranks, the largest first, into the batches of the GPU engine,
+    which fits replicates of different numbers of signatures together. A batch holds batch_size replicates, or on the CPU
+    device an equal share of them for every worker. Returns the chunks of every number of signatures, as a dictionary of
+    lists of arrays of replicate indices like nmf_chunks, and the batches, as lists of (number of signatures, index of a chunk)."""
+    replicates = [(k, j) for k in sorted(ranks, reverse=True) for j in range(iterations)]
+    if str(device).startswith("cpu"):
+        n_workers = multiprocessing.cpu_count() if n_cpu==-1 else n_cpu
+        batch_size = min(batch_size, -(-len(replicates)//n_workers))
+    chunks = {k: [] for k in ranks}
+    packs = []
+    for start in range(0, len(replicates), batch_size):
+        pack = []
+        for k, group in itertools.groupby(replicates[start:start+batch_size], key=lambda replicate: replicate[0]):
+            chunks[k].append(np.array([j for _, j in group]))
+            pack.append((k, len(chunks[k])-1))
+        packs.append(pack)
+    return chunks, packs
+
+def pnmf_packed(pieces, genomes=None, seeds=None, Wall=None, Hall=None, resample=True, device=None, torch_threads=None, solver="mu"):
+    """Worker call of a batch of rank_packs: fits the replicates of pieces, a list of (number of signatures k, replicates of a
+    chunk), in one batch of the GPU engine, and writes their W and H into the SharedArrays Wall[k] and Hall[k] as pnmf_shared does.
+    Returns the convergence information of the replicates of every piece."""
+    data = shared_data(genomes)
+    ranks = [k for k, chunk in pieces for j in chunk]
+    batch_seeds = [seeds[j] for k, chunk in pieces for j in chunk]
+    W, H, iterations, losses = nnmf_gpu(data, ranks, seeds=batch_seeds, device=device, threads=torch_threads, resample=resample, extrapolate=solver=="emu")
+    
+    replicates = iter(zip(W, H, iterations, losses))
+    information = []
+    for k, chunk in pieces:
+        sharedWall = Wall[k].open()
+        sharedHall = Hall[k].open()
+        information.append([])
+        for j in chunk:
+            _W, _H, iteration, loss = next(replicates)
+            _W = np.array(_W)
+            _H = np.array(_H)
+            total = _W.sum(axis=0)[np.newaxis]
+            _W = _W/total
+            _H = _H*total.T
+            sharedWall[:, j*k:(j+1)*k] = _W
+            sharedHall[j*k:(j+1)*k, :] = _H
+            information[-1].append(convergence_information(data, _W, _H, iteration, loss))
+        sharedWall.flush()
+        sharedHall.flush()
+    return information
+
+def nmf_task(chunk, genomes=1, totalProcesses=1, seeds=None, init="nndsvd", normalization_cutoff=1000000, resample=True, gpu=False, batched=False, precision="single", tolerance=1e-6, test_conv=None, patience=3, solver="mu", warm_starts=None, Wall=None, Hall=None, sparse=False, out_of_core=False, block_size=4096, device=None, torch_threads=None, svd_store=None, bootstraps=None, starts=1, start_iterations=500):
+    """Returns the function, the arguments and the keywords of the worker call that fits the replicates of a chunk.
+    genomes, Wall and Hall are SharedArrays: the worker writes the W and H of replicate j into the columns and rows
+    j*totalProcesses to (j+1)*totalProcesses of Wall and Hall and only returns the convergence information of the replicates.
+    warm_starts is None or holds the (W, H) of the previous number of signatures for every replicate.
+    sparse selects the sparse engine of the single CPU engine and out_of_core its out-of-core engine, which processes
+    block_size samples at a time and expects the transposed genomes; both are ignored by the batched and GPU engines.
+    device and torch_threads are the torch device of the GPU engine and its number of threads on the CPU, see nnmf_gpu.
+    svd_store is None or the initialization.SVDStore of the CPU engines, and bootstraps None or the SharedArray of the
+    bootstrap_replicates that the dense and batched CPU engines take. init is one initialization for all the replicates or,
+    for the CPU engines, the list of the initialization of every replicate returned by diverse_inits. starts and
+    start_iterations are the multi-start of the dense and batched CPU engines, see nnmf."""
     if gpu==True:
-        pool_nmf=partial(pnmf, genomes=genomes, totalProcesses=totalProcesses, resample=resample, seeds=seeds, init=init, normalization_cutoff=normalization_cutoff, gpu=gpu)
-        result_list = pool.map(pool_nmf, batches) 
-        pool.close()
-        pool.join()
-        #result_list_flattened = [s for sublist for sublist in result_list]
-        flat_list = [item for sublist in result_list for item in sublist]
+        pool_nmf, args, kwds = partial(pnmf, genomes=genomes, totalProcesses=totalProcesses, resample=resample, seeds=[seeds[j] for j in chunk], init=init, normalization_cutoff=normalization_cutoff, gpu=gpu, solver=solver, device=device, torch_threads=torch_threads), (len(chunk),), {}
+    elif batched==True:
+        if solver != "mu":
+            raise ValueError("The batched CPU engine only supports the \"mu\" solver")
+        pool_nmf=partial(pnmf_batch, genomes=genomes, totalProcesses=totalProcesses, resample=resample, init=[replicate_init(init, j) for j in chunk], normalization_cutoff=normalization_cutoff, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, svd_store=svd_store, bootstraps=bootstraps, starts=starts, start_iterations=start_iterations)
+        args, kwds = ([seeds[j] for j in chunk],), {"warm_starts": None if warm_starts is None else [warm_starts[j] for j in chunk], "replicates": list(chunk)}
+    elif out_of_core==True:
+        pool_nmf=partial(pnmf_out_of_core, genomes=genomes, totalProcesses=totalProcesses, resample=resample, init=replicate_init(init, chunk[0]), precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, block_size=block_size, replicate=chunk[0], Wall=Wall, Hall=Hall)
+        return pool_nmf, (seeds[chunk[0]],), {}
+    else:
+        pool_nmf=partial(pnmf, genomes=genomes, totalProcesses=totalProcesses, resample=resample, init=replicate_init(init, chunk[0]), normalization_cutoff=normalization_cutoff, gpu=gpu, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, solver=solver, sparse=sparse, svd_store=svd_store, bootstraps=bootstraps, starts=starts, start_iterations=start_iterations)
+        args, kwds = (), {"seeds": seeds[chunk[0]], "warm_start": None if warm_starts is None else warm_starts[chunk[0]], "replicate": chunk[0]}
+    return partial(pnmf_shared, pool_nmf, chunk=chunk, genomes=genomes, Wall=Wall, Hall=Hall, gpu=gpu, batched=batched), args, kwds
+
+def pnmf_shared(pool_nmf, *args, chunk=None, genomes=None, Wall=None, Hall=None, gpu=False, batched=False, **kwds):
+    """Worker call of nmf_task: fits the replicates of a chunk with pool_nmf and writes their W and H into the shared Wall and Hall.
+    Returns the convergence information of every replicate."""
+    result = pool_nmf(*args, **kwds)
+    if gpu==False and batched==False:
+        result = [result]
+    
+    Wall = Wall.open()
+    Hall = Hall.open()
+    information = []
+    for j, item in zip(chunk, result):
+        W = item[0]
+        H = item[1]
+        k = W.shape[1]
+        Wall[:, j*k:(j+1)*k] = W
+        Hall[j*k:(j+1)*k, :] = H
+        if gpu==True:
+            information.append(convergence_information(shared_data(genomes), W, H, item[2], item[3]))
+        else:
+            information.append(item[2])
+    Wall.flush()
+    Hall.flush()
+    return information
+
+def restore_replicates(stores, k, chunk, Wall, Hall):
+    """stores holds checkpoint.Checkpoint and cache.ReplicateCache objects, or None. Writes the replicates of a chunk for k
+    signatures into the SharedArrays Wall and Hall from the first store that holds all of them, and saves them in the
+    stores before it. Returns the convergence information of the replicates, or None if no store holds them."""
+    stores = [store for store in stores if store is not None]
+    for i, store in enumerate(stores):
+        information = store.restore(k, chunk, Wall, Hall)
+        if information is not None:
+            save_replicates(stores[:i], k, chunk, Wall, Hall, information)
+            return information
+    return None
+
+def save_replicates(stores, k, chunk, Wall, Hall, information):
+    """Saves the replicates of a chunk for k signatures, which are in the SharedArrays Wall and Hall, in every store of stores that is not None."""
+    for store in stores:
+        if store is not None:
+            store.save(k, chunk, Wall, Hall, information)
+
+def save_replicates_callback(errors, stores, k, chunk, Wall, Hall, information):
+    """save_replicates as the callback of an apply_async. An exception in a callback stops the result handler of the pool, so
+    that no later result ever arrives, so it is appended to the list errors for the caller to raise instead."""
+    try:
+        save_replicates(stores, k, chunk, Wall, Hall, information)
+    except Exception as error:
+        errors.append(error)
+
+def parallel_runs(genomes=1, totalProcesses=1, iterations=1, seeds=None, init="nndsvd", normalization_cutoff=1000000, n_cpu=-1, verbose = False, resample=True, gpu=False, batch_size=128, batched=False, precision="single", tolerance=1e-6, test_conv=None, patience=3, solver="mu", warm_start=None, pool=None, sparse=False, out_of_core=False, block_size=4096, directory=None, checkpoint=None, cache=None, device=None, torch_threads=None, svd_store=None, bootstraps=None, identical=False, starts=1, start_iterations=500):
+    """Fits all the replicates of one number of signatures. Returns Wall, Hall and the convergence information of every replicate.
+    The shared arrays are created in directory, or in a temporary directory that is removed at the end if it is None. With
+    out_of_core, Hall is returned as the SharedArray in directory instead of being read into memory.
+    If checkpoint is a checkpoint.Checkpoint or cache a cache.ReplicateCache, the replicates they hold are restored instead of
+    fitted, and every replicate is saved in them as soon as it is fitted. svd_store is None or the initialization.SVDStore that
+    shares the SVD of every bootstrap replicate among the numbers of signatures, and bootstraps None or the SharedArray of
+    bootstrap_replicates, which holds the bootstrap replicates of all the numbers of signatures. If identical is True, as
+    identical_replicates decides, only the first replicate is fitted and copied to the others. starts and start_iterations are
+    the multi-start of the CPU engines, see nnmf."""
+    if verbose:
+        print ("Process "+str(totalProcesses)+ " is in progress\n===================================>")
+    # reuse the pool of the caller, if any, so that the workers are not started again for every number of signatures
+    own_pool = pool is None
+    if own_pool and n_cpu==-1:
+        pool = multiprocessing.Pool()
+    elif own_pool:
+        pool = multiprocessing.Pool(processes=n_cpu)
 
+    # the solution of the previous rank for every replicate, in the order of the seeds
+    if warm_start is not None and gpu==False:
+        previousWall, previousHall = warm_start
+        previous_processes = previousWall.shape[1]//iterations
+        warm_starts = [(previousWall[:, j*previous_processes:(j+1)*previous_processes], previousHall[j*previous_processes:(j+1)*previous_processes, :]) for j in range(iterations)]
     else:
-         pool_nmf=partial(pnmf, genomes=genomes, totalProcesses=totalProcesses, resample=resample, init=init, normalization_cutoff=normalization_cutoff, gpu=gpu)
-         result_list = pool.map(pool_nmf, seeds) 
-         pool.close()
-         pool.join()
-         flat_list = result_list
-    return flat_list#result_list
+        warm_starts = None
+    
+    # the genomes are shared with the workers, and the workers write their W and H into Wall and Hall, instead of pickling them
+    own_directory = directory is None
+    if own_directory:
+        directory = tempfile.mkdtemp(prefix="sigprofiler_")
+    try:
+        genomes = np.array(genomes)
+        sharedGenomes = SharedArray.create(directory, "genomes", array=genomes.T if out_of_core else genomes)
+        sharedWall = SharedArray.create(directory, "Wall", shape=(genomes.shape[0], totalProcesses*iterations))
+        sharedHall = SharedArray.create(directory, "Hall", shape=(totalProcesses*iterations, genomes.shape[1]))
+        
+        results = []
+        save_errors = []
+        for chunk in nmf_chunks(1 if identical else iterations, n_cpu=n_cpu, gpu=gpu, batch_size=batch_size, batched=batched, device=device):
+            restored = restore_replicates([checkpoint, cache], totalProcesses, chunk, sharedWall, sharedHall)
+            if restored is not None:
+                results.append(restored)
+                continue
+            pool_nmf, args, kwds = nmf_task(chunk, genomes=sharedGenomes, totalProcesses=totalProcesses, seeds=seeds, init=init, normalization_cutoff=normalization_cutoff, resample=resample, gpu=gpu, batched=batched, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, solver=solver, warm_starts=warm_starts, Wall=sharedWall, Hall=sharedHall, sparse=sparse, out_of_core=out_of_core, block_size=block_size, device=device, torch_threads=torch_threads, svd_store=svd_store, bootstraps=bootstraps, starts=starts, start_iterations=start_iterations)
+            # the replicates are saved as soon as they are done, so the ones that finished survive a failure of the others
+            callback = partial(save_replicates_callback, save_errors, [checkpoint, cache], totalProcesses, chunk, sharedWall, sharedHall)
+            results.append(pool.apply_async(pool_nmf, args=args, kwds=kwds, callback=callback))
+        converge_information = np.array([information for p in results for information in (p if isinstance(p, list) else p.get())])
+        if save_errors:
+            raise save_errors[0]
+        if identical:
+            copy_replicate(sharedWall, sharedHall, totalProcesses, iterations)
+            converge_information = np.repeat(converge_information, iterations, axis=0)
+        Wall = sharedWall.read()
+        Hall = sharedHall if out_of_core else sharedHall.read()
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+        if own_directory:
+            shutil.rmtree(directory, ignore_errors=True)
+    return Wall, Hall, converge_information
 # =============================================================================
 # def parallel_runs(genomes=1, totalProcesses=1, iterations=1,  n_cpu=-1, verbose = False, resample=True, seeds = None, init="random", normalization_cutoff=10000000, gpu=False):
 #     if verbose:
@@ -790,14 +1256,30 @@ def pairwise_cluster_raw(mat1=([0]), mat2=([0]), mat1T=([0]), mat2T=([0]), gpu=F
 
 
 ################################################################### FUNCTION  ###################################################################
-def reclustering(tempWall=0, tempHall=0, processAvg=0, exposureAvg=0, gpu=False):
-    # exposureAvg is not important here. It can be any matrix with the same size of a single exposure matrix
+def cluster_exposures(Hall, rows, block_size=4096):
+    """The average and the standard error of the exposures of every cluster. rows[cluster, iteration] is the row of Hall of the
+    member of the cluster in the replicate iteration. Hall, which may be a memory-mapped file, is read block_size samples at a
+    time, so that only the exposures of one block of samples of all the replicates are in memory at once."""
+    exposureAvg = np.zeros((rows.shape[0], Hall.shape[1]))
+    exposureSTE = np.zeros((rows.shape[0], Hall.shape[1]))
+    for start in range(0, Hall.shape[1], block_size):
+        exposure3D = np.asarray(Hall[:, start:start+block_size], dtype=np.float64)[rows]
+        exposureAvg[:, start:start+block_size] = np.mean(exposure3D, axis=1)
+        exposureSTE[:, start:start+block_size] = scipy.stats.sem(exposure3D, axis=1, ddof=1)
+    return exposureAvg, exposureSTE
+
+
+def reclustering(tempWall=0, tempHall=0, processAvg=0, exposureAvg=0, gpu=False, exposures=True):
+    # exposureAvg is not important here: the clusters only depend on the signatures. If exposures is False, the exposures of
+    # the clusters are not computed: the rows of tempHall of their members are returned instead of exposureAvg, for
+    # cluster_exposures, and exposureSTE is None
     iterations = int(tempWall.shape[1]/processAvg.shape[1])
     processes =  processAvg.shape[1]
     idxIter = list(range(0, tempWall.shape[1], processes))
    
     processes3D = np.zeros([processAvg.shape[1], processAvg.shape[0], iterations])
-    exposure3D = np.zeros([exposureAvg.shape[0], iterations, exposureAvg.shape[1]])
+    # the row of tempHall of the member of every cluster in every replicate
+    rows = np.zeros([processes, iterations], dtype=int)
     
     for  iteration_number in range(len(idxIter)):
         
@@ -805,13 +1287,13 @@ def reclustering(tempWall=0, tempHall=0, processAvg=0, exposureAvg=0, gpu=False)
         #print(i)
         statidx = idxIter[iteration_number]
         loopidx = list(range(statidx, statidx+processes))
-        lstCluster, idxPair, lstClusterT = pairwise_cluster_raw(mat1=processAvg, mat2=tempWall[:, loopidx], mat1T=exposureAvg, mat2T=tempHall[loopidx,:],gpu=gpu)
+        lstCluster, idxPair, lstClusterT = pairwise_cluster_raw(mat1=processAvg, mat2=tempWall[:, loopidx], mat1T=processAvg.T, mat2T=tempWall[:, loopidx].T,gpu=gpu) # the exposures are not used by the clustering
         
         for cluster_items in idxPair:
             cluster_number = cluster_items[0]
             query_idx = cluster_items[1]
             processes3D[cluster_number,:,iteration_number]=tempWall[:,statidx+query_idx]
-            exposure3D[cluster_number, iteration_number, :] = tempHall[statidx+query_idx,:]
+            rows[cluster_number, iteration_number] = statidx+query_idx
             
     
     
@@ -849,8 +1331,10 @@ def reclustering(tempWall=0, tempHall=0, processAvg=0, exposureAvg=0, gpu=False)
         
     processAvg = np.mean(processes3D, axis=2).T
     processSTE = scipy.stats.sem(processes3D, axis=2, ddof=1).T
-    exposureAvg = np.mean(exposure3D, axis=1) 
-    exposureSTE = scipy.stats.sem(exposure3D, axis=1, ddof=1)
+    if exposures:
+        exposureAvg, exposureSTE = cluster_exposures(tempHall, rows)
+    else:
+        exposureAvg, exposureSTE = rows, None
     
         
     return  processAvg, exposureAvg, processSTE,  exposureSTE, avgSilhouetteCoefficients, clusterSilhouetteCoefficients
@@ -858,15 +1342,18 @@ def reclustering(tempWall=0, tempHall=0, processAvg=0, exposureAvg=0, gpu=False)
 
 
 
-def cluster_converge_innerloop(Wall, Hall, totalprocess, iteration=1, gpu=False):
+def cluster_converge_innerloop(Wall, Hall, totalprocess, iteration=1, gpu=False, seed=None):
     
-    processAvg = np.random.rand(Wall.shape[0],totalprocess)
-    exposureAvg = np.random.rand(totalprocess, Hall.shape[1])
+    # seed is the SeedSequence of this restart of the clustering
+    rng = np.random.default_rng(seed)
+    Hall = shared_data(Hall)
+    processAvg = rng.random((Wall.shape[0],totalprocess))
+    exposureAvg = None
     
     result = 0
     convergence_count = 0
     while True:
-        processAvg, exposureAvg, processSTE,  exposureSTE, avgSilhouetteCoefficients, clusterSilhouetteCoefficients = reclustering(Wall, Hall, processAvg, exposureAvg, gpu=gpu)
+        processAvg, rows, processSTE,  _, avgSilhouetteCoefficients, clusterSilhouetteCoefficients = reclustering(Wall, Hall, processAvg, exposureAvg, gpu=gpu, exposures=False)
         
         if result == avgSilhouetteCoefficients:
             break
@@ -875,32 +1362,58 @@ def cluster_converge_innerloop(Wall, Hall, totalprocess, iteration=1, gpu=False)
         else:
             result = avgSilhouetteCoefficients
             convergence_count = convergence_count + 1
+    
+    # the exposures of the final clusters only, read from Hall in blocks of samples
+    exposureAvg, exposureSTE = cluster_exposures(Hall, rows)
         
     return processAvg, exposureAvg, processSTE,  exposureSTE, avgSilhouetteCoefficients, clusterSilhouetteCoefficients
 
 
 
-def parallel_clustering(Wall, Hall, totalProcesses, iterations=50,  n_cpu=-1, gpu=False):
+def parallel_clustering(Wall, Hall, totalProcesses, iterations=50,  n_cpu=-1, gpu=False, pool=None, seed=None):
     
-    if n_cpu==-1:
+    own_pool = pool is None
+    if own_pool and n_cpu==-1:
         pool = multiprocessing.Pool()
-    else:
+    elif own_pool:
         pool = multiprocessing.Pool(processes=n_cpu)
         
-    pool_nmf=partial(cluster_converge_innerloop, Wall, Hall, totalProcesses)
-    result_list = pool.map(pool_nmf, range(iterations)) 
-    pool.close()
-    pool.join()
-    return result_list
+    # every restart has its own child stream of seed, a SeedSequence or a seed
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    # the restarts are compared as they are done, so that only the best one so far is kept with its exposures
+    pool_nmf=partial(clustering_restart, Wall, Hall, totalProcesses, gpu)
+    best = None
+    for restart, clustering in pool.imap_unordered(pool_nmf, enumerate(seed.spawn(iterations))):
+        best = better_clustering(best, restart, clustering)
+    if own_pool:
+        pool.close()
+        pool.join()
+    return best[1]
+
+def clustering_restart(Wall, Hall, totalProcesses, gpu, restart):
+    """Worker call of parallel_clustering: restart is the pair of the index and the seed of the restart"""
+    i, seed = restart
+    return i, cluster_converge_innerloop(Wall, Hall, totalProcesses, i, gpu, seed)
+
+def better_clustering(best, restart, clustering):
+    """best is None or the pair of the index and the result of a restart of the clustering. Returns the better of best and
+    (restart, clustering): the one with the higher average silhouette coefficient, or the earlier restart if they are equal,
+    which is the one best_clustering chooses among all the restarts"""
+    if best is None or clustering[4] > best[1][4] or (clustering[4] == best[1][4] and restart < best[0]):
+        return restart, clustering
+    return best
 
 # To select the best clustering converge of the cluster_converge_innerloop
-def cluster_converge_outerloop(Wall, Hall, totalprocess, gpu=False):
-    avgSilhouetteCoefficients = -1  # intial avgSilhouetteCoefficients 
-    
+def cluster_converge_outerloop(Wall, Hall, totalprocess, gpu=False, pool=None, seed=None):
     #do the parallel clustering 
-    result_list = parallel_clustering(Wall, Hall, totalprocess, iterations=50,  n_cpu=-1, gpu=False)
+    return parallel_clustering(Wall, Hall, totalprocess, iterations=50,  n_cpu=-1, gpu=False, pool=pool, seed=seed)
+
+# To select the clustering with the highest average silhouette coefficient
+def best_clustering(result_list):
+    avgSilhouetteCoefficients = -1  # intial avgSilhouetteCoefficients 
     
-    for i in range(50):  # using 10 iterations to get the best clustering 
+    for i in range(len(result_list)):  # using 10 iterations to get the best clustering 
         
         temp_processAvg, temp_exposureAvg, temp_processSTE,  temp_exposureSTE, temp_avgSilhouetteCoefficients, temp_clusterSilhouetteCoefficients = result_list[i][0], result_list[i][1], result_list[i][2], result_list[i][3], result_list[i][4], result_list[i][5]
         
@@ -1121,7 +1634,7 @@ def signature_decomposition(signatures, mtype, directory, genome_build="GRCh37",
 #################################### Decipher Signatures ###################################################
 #############################################################################################################
 """
-def decipher_signatures(genomes=[0], i=1, totalIterations=1, cpu=-1, mut_context="96", resample=True, seeds = None, init="alexandrov-lab-custom", normalization_cutoff=1, gpu=False, batch_size=128):
+def decipher_signatures(genomes=[0], i=1, totalIterations=1, cpu=-1, mut_context="96", resample=True, seeds = None, init="alexandrov-lab-custom", normalization_cutoff=1, gpu=False, batch_size=128, batched=False, precision="single", tolerance=1e-6, test_conv=None, patience=3, solver="mu", warm_start=None, pool=None, sparse=False, out_of_core=False, block_size=4096, checkpoint=None, cache=None, device=None, torch_threads=None, svd_store=None, bootstraps=None, identical=False, starts=1, start_iterations=500):
     
     
         
@@ -1140,59 +1653,62 @@ def decipher_signatures(genomes=[0], i=1, totalIterations=1, cpu=-1, mut_context
     ##############################################################################################################################################################################         
     ############################################################# The parallel processing takes place here #######################################################################  
     ############################################################################################################################################################################## 
-    if gpu==True:
-        results = []
-        flat_list = parallel_runs(genomes=genomes, totalProcesses=totalProcesses, iterations=totalIterations,  n_cpu=cpu, verbose = False, resample=resample, seeds = seeds, init=init, normalization_cutoff=normalization_cutoff, gpu=gpu)
+    # the out-of-core Hall stays in a memory-mapped file until the clustering is done
+    directory = tempfile.mkdtemp(prefix="sigprofiler_") if out_of_core else None
+    try:
+        Wall, Hall, converge_information = parallel_runs(genomes=genomes, totalProcesses=totalProcesses, iterations=totalIterations,  n_cpu=cpu, verbose = False, resample=resample, seeds = seeds, init=init, normalization_cutoff=normalization_cutoff, gpu=gpu, batch_size=batch_size, batched=batched, precision=precision, tolerance=tolerance, test_conv=test_conv, patience=patience, solver=solver, warm_start=warm_start, pool=pool, sparse=sparse, out_of_core=out_of_core, block_size=block_size, directory=directory, checkpoint=checkpoint, cache=cache, device=device, torch_threads=torch_threads, svd_store=svd_store, bootstraps=bootstraps, identical=identical, starts=starts, start_iterations=start_iterations)
+        #print(results[0][2])     
+        toc = time.time()
+        print ("Time taken to collect {} iterations for {} signatures is {} seconds".format(totalIterations , i, round(toc-tic, 2)))
+        ##############################################################################################################################################################################       
+        ######################################################### The parallel processing ends here ##################################################################################      
+        ##############################################################################################################################################################################        
+        
+        
+        ################### Achieve the best clustering by shuffling results list using a few iterations ##########        
+        if out_of_core:
+            # the errors and reconstructions of every replicate are as large as the cohort times the replicates
+            finalgenomeErrors, finalgenomesReconstructed = None, None
+            sharedHall, Hall = Hall, Hall.open(mode="c")
+        else:
+            finalgenomeErrors, finalgenomesReconstructed = collect_replicates(genomes, Wall, Hall, totalProcesses)
+            sharedHall = Hall
         
-        for items in range(len(flat_list)):
-            
-            W = flat_list[items][0]
-            H = flat_list[items][1]
-            #calculate L1, L2 and KL for the solution 
-            est_genome = np.array(np.dot(W, H))
-            
-            similarities = calculate_similarities(genomes, est_genome, sample_names=False)[0].iloc[:,2:]
-            similarities = np.array(np.mean(similarities, axis=0)).T
-            
-            results.append([W,H,similarities])
-    else:
-        results = parallel_runs(genomes=genomes, totalProcesses=totalProcesses, iterations=totalIterations,  n_cpu=cpu, verbose = False, resample=resample, seeds = seeds, init=init, normalization_cutoff=normalization_cutoff, gpu=gpu)
-    #print(results[0][2])     
-    toc = time.time()
-    print ("Time taken to collect {} iterations for {} signatures is {} seconds".format(totalIterations , i, round(toc-tic, 2)))
-    ##############################################################################################################################################################################       
-    ######################################################### The parallel processing ends here ##################################################################################      
-    ##############################################################################################################################################################################        
-    
+        
+        processes=i #renamed the i as "processes"    
+        clustering = None if checkpoint is None else checkpoint.clustering(processes)
+        if clustering is None:
+            clustering = cluster_converge_outerloop(Wall, sharedHall, processes, gpu=gpu, pool=pool, seed=clustering_seed(seeds, processes))
+            if checkpoint is not None:
+                checkpoint.save_clustering(processes, clustering)
+        processAvg, exposureAvg, processSTE,  exposureSTE, avgSilhouetteCoefficients, clusterSilhouetteCoefficients = clustering
+        reconstruction_error = round(LA.norm(genomes-np.dot(processAvg, exposureAvg), 'fro')/LA.norm(genomes, 'fro'), 2)   
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
     
-    ################### Achieve the best clustering by shuffling results list using a few iterations ##########        
-    Wall = np.zeros((totalMutationTypes, totalProcesses * totalIterations));
-    #print (Wall.shape)
-    Hall = np.zeros((totalProcesses * totalIterations, totalGenomes));
-    converge_information = np.zeros((totalIterations, 5))
+
+    return  processAvg, exposureAvg, processSTE, exposureSTE, avgSilhouetteCoefficients, np.round(clusterSilhouetteCoefficients,3), finalgenomeErrors, finalgenomesReconstructed, Wall, Hall, converge_information, reconstruction_error, processes
+
+
+def collect_replicates(genomes, Wall, Hall, totalProcesses):
+    """Returns the errors and the reconstructions of the genomes of all the replicates stacked in Wall and Hall"""
+    totalMutationTypes = genomes.shape[0];
+    totalGenomes = genomes.shape[1];
+    totalIterations = Wall.shape[1]//totalProcesses
     
     finalgenomeErrors = np.zeros((totalMutationTypes, totalGenomes, totalIterations));
     finalgenomesReconstructed = np.zeros((totalMutationTypes, totalGenomes, totalIterations))
     
     processCount=0
-    for j in range(len(results)):
-        W = results[j][0]
-        H = results[j][1]
-        converge_information[j,:] = results[j][2][:]
+    for j in range(totalIterations):
+        W = Wall[ :, processCount : (processCount + totalProcesses) ]
+        H = Hall[ processCount : (processCount + totalProcesses), : ]
         finalgenomeErrors[:, :, j] = genomes -  np.dot(W,H);
         finalgenomesReconstructed[:, :, j] = np.dot(W,H);
-        Wall[ :, processCount : (processCount + totalProcesses) ] = W;
-        Hall[ processCount : (processCount + totalProcesses), : ] = H;
         processCount = processCount + totalProcesses;
     
-    
-    processes=i #renamed the i as "processes"    
-    processAvg, exposureAvg, processSTE,  exposureSTE, avgSilhouetteCoefficients, clusterSilhouetteCoefficients = cluster_converge_outerloop(Wall, Hall, processes, gpu=gpu)
-    reconstruction_error = round(LA.norm(genomes-np.dot(processAvg, exposureAvg), 'fro')/LA.norm(genomes, 'fro'), 2)   
-    
-
-    return  processAvg, exposureAvg, processSTE, exposureSTE, avgSilhouetteCoefficients, np.round(clusterSilhouetteCoefficients,3), finalgenomeErrors, finalgenomesReconstructed, Wall, Hall, converge_information, reconstruction_error, processes
-
+    return finalgenomeErrors, finalgenomesReconstructed
 
 
 
@@ -1496,7 +2012,7 @@ def export_information(loopResults, mutation_context, output, index, colnames, w
     converge_information = loopResults[13]
     converge_information = pd.DataFrame(np.around(converge_information, decimals=3))
     conv_index = list(range(1,len(converge_information)+1)) 
-    colmetrices = ['L1', 'L1 %', 'L2', 'L2 %', 'KL Divergence']
+    colmetrices = ['L1', 'L1 %', 'L2', 'L2 %', 'KL Divergence', 'NMF Iterations', 'NMF KL Objective']
     converge_information.index = conv_index 
     converge_information.columns = colmetrices
     converge_information.to_csv(subdirectory+"/"+mutation_type+"_S"+str(i)+"_"+"NMF_Convergence_Information.txt", "\t", index_label="Iteration")
@@ -1993,7 +2509,7 @@ def norm(x):
     return sqrt(squared_norm(x))
 
 def initialize_nmf(X, n_components, init=None, eps=1e-6,
-                    random_state=None):
+                    random_state=None, svd=None):
     """Algorithms for NMF initialization.
     Computes an initial guess for the non-negative
     rank k matrix approximation for X: X = WH
@@ -2026,6 +2542,9 @@ def initialize_nmf(X, n_components, init=None, eps=1e-6,
         If RandomState instance, random_state is the random number generator;
         If None, the random number generator is the RandomState instance used
         by `np.random`. Used when ``random`` == 'nndsvdar' or 'random'.
+    svd : None or the (U, S, V) of a truncated SVD of X, such as
+        initialization.SVDStore.svd returns. If it has at least n_components singular
+        triplets, its leading ones are used instead of a randomized SVD of X.
     Returns
     -------
     W : array-like, shape (n_samples, n_components)
@@ -2067,7 +2586,10 @@ def initialize_nmf(X, n_components, init=None, eps=1e-6,
         return W, H
 
     # NNDSVD initialization
-    U, S, V = randomized_svd(X, n_components, random_state=random_state)
+    if svd is None or len(svd[1]) < n_components:
+        U, S, V = randomized_svd(X, n_components, random_state=random_state)
+    else:
+        U, S, V = svd[0][:, :n_components], svd[1][:n_components], svd[2][:n_components]
     W, H = np.zeros(U.shape), np.zeros(V.shape)
 
     # The leading singular triplet is non-negative
@@ -2126,4 +2648,97 @@ def initialize_nmf(X, n_components, init=None, eps=1e-6,
             'Invalid init parameter: got %r instead of one of %r' %
             (init, (None, 'random', 'nndsvd', 'nndsvda', 'nndsvdar')))
 
-    return W, H    
+    return W, H
+
+
+def extend_nmf(X, W, H, eps=1e-6, random_state=None):
+    """Initialization of a rank k+1 NMF from a rank k solution.
+    The rank k factors W and H are kept and one component is added: the NNDSVD
+    rank one approximation of the positive part of the residual X - WH.
+    Parameters
+    ----------
+    X : array-like, shape (n_samples, n_features)
+        The data matrix to be decomposed.
+    W : array-like, shape (n_samples, k)
+        The basis matrix of the rank k solution.
+    H : array-like, shape (k, n_features)
+        The coefficient matrix of the rank k solution.
+    eps : float
+        Truncate all values less then this in the new component to zero. No
+        entry of W and H starts below eps times the largest entry of its factor.
+    random_state : int, RandomState instance or None, optional, default: None
+        The random state of the randomized SVD of the residual.
+    Returns
+    -------
+    W : array-like, shape (n_samples, k+1)
+        Initial guesses for solving X ~= WH
+    H : array-like, shape (k+1, n_features)
+        Initial guesses for solving X ~= WH
+    """
+    X = np.array(X, dtype=np.float64)
+    W = np.array(W, dtype=np.float64)
+    H = np.array(H, dtype=np.float64)
+    
+    # H may come from a denormalized or bootstrapped matrix, so match it to the sample sizes of X
+    scale = np.divide(X.sum(axis=0), np.dot(W, H).sum(axis=0), out=np.ones(X.shape[1]), where=np.dot(W, H).sum(axis=0)>0)
+    H = H*scale
+    
+    residual = np.maximum(X - np.dot(W, H), 0)
+    if residual.any():
+        w, h = initialize_nmf(residual, 1, init="nndsvd", eps=eps, random_state=random_state)
+    else:
+        w, h = np.zeros((X.shape[0], 1)), np.zeros((1, X.shape[1]))
+    W = np.hstack([W, w])
+    H = np.vstack([H, h])
+    
+    # the multiplicative updates cannot move an entry away from zero, so the entries are floored, on the scale of their own
+    # factor: W has normalized columns and H is on the scale of the counts, so the smallest count of X would wipe out W
+    W = np.maximum(W, eps*W.max()) if W.max() > 0 else np.full(W.shape, eps)
+    H = np.maximum(H, eps*H.max()) if H.max() > 0 else np.full(H.shape, eps)
+    return W, H
+
+
+def successive_halving(X, n_components, starts=4, iterations=500, init="nndsvd", eps=1e-6,
+                       random_state=None, svd=None, precision="single"):
+    """Multi-start initialization of a rank n_components NMF of X by successive halving.
+    starts initializations are made, the first with init and the others with the
+    seeded initializations of diverse_inits, and they are fitted together by the
+    batched multiplicative updates of nmf_cpu.NMF for iterations iterations. The
+    half of the starts with the lowest KL objective is kept and fitted for twice
+    as many iterations, and so on until one start is left.
+    Parameters
+    ----------
+    X : array-like, shape (n_samples, n_features)
+        The data matrix to be decomposed.
+    n_components : integer
+        The number of components desired in the approximation.
+    starts : integer
+        The number of starts of the first round.
+    iterations : integer
+        The number of iterations of the first round.
+    init, eps, random_state, svd : as in initialize_nmf, for every start.
+    precision : "single" or "double", the floating point type of the fits.
+    Returns
+    -------
+    W : array-like, shape (n_samples, n_components)
+    H : array-like, shape (n_components, n_features)
+        The factors of the best start, to be fitted to convergence by the caller.
+    spent : integer
+        The number of iterations the best start was fitted for.
+    """
+    X = np.asarray(X)
+    candidates = [initialize_nmf(X, n_components, init=start, eps=eps, random_state=random_state, svd=svd)
+                  for start in diverse_inits(init, starts)]
+    W = np.array([w for w, _ in candidates])
+    H = np.array([h for _, h in candidates])
+    spent = 0
+    while len(W) > 1:
+        # one objective test at the end of the round, so that no start stops early
+        net = nmf_cpu.NMF(np.broadcast_to(X, (len(W),)+X.shape), W, H, max_iterations=iterations, test_conv=iterations,
+                          floating_point_precision='float' if precision=="single" else 'double')
+        net.fit()
+        keep = np.argsort(net.loss, kind="stable")[:(len(W)+1)//2]
+        W, H = net.W[keep], net.H[keep]
+        spent += iterations
+        iterations *= 2
+    return W[0], H[0], spent
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the vectorised bootstrap (bootstrap.bootstrap_genomes) against the former
+sample by sample loop over a DataFrame, on synthetic SBS96 cohorts, and of the sparse
+bootstrap (bootstrap.bootstrap_sparse_genomes) on SBS1536 cohorts of low burden. Both
+bootstraps are floored at 0.0001 as in pnmf.
+
+Usage: python benchmarks/bootstrap.py [replicates]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from SigProfilerExtractor import bootstrap
+
+
+def cohort(n_types, n_samples, burden, n_signatures=10, seed=0):
+    rng = np.random.RandomState(seed)
+    signatures = rng.dirichlet(np.ones(n_types)*0.5, size=n_signatures).T
+    exposures = rng.gamma(0.5, burden/n_signatures*2, size=(n_signatures, n_samples))
+    return rng.poisson(np.dot(signatures, exposures)).astype(np.float64)
+
+
+def loop_bootstrap(genomes, seed):
+    # the bootstrap of pnmf before the bootstrap module
+    rng = np.random.default_rng(seed)
+    genomes = pd.DataFrame(genomes)
+    columns = []
+    for i in range(genomes.shape[1]):
+        n = int(round(genomes.iloc[:, i].sum()))
+        p = np.array(genomes.iloc[:, i])/n if n > 0 else np.zeros(genomes.shape[0])
+        columns.append(rng.multinomial(n, p))
+    bootstrapGenomes = pd.DataFrame(np.array(columns).T)
+    bootstrapGenomes[bootstrapGenomes < 0.0001] = 0.0001
+    return np.array(bootstrapGenomes)
+
+
+def timed(fn, replicates):
+    tic = time.time()
+    for seed in range(replicates):
+        fn(seed)
+    return (time.time()-tic)/replicates
+
+
+def main():
+    replicates = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("Seconds per replicate, mean of {} replicates".format(replicates))
+    print("{:>8} {:>8} {:>12} {:>12} {:>12} {:>8}".format("types", "samples", "loop", "vectorised", "sparse", "speedup"))
+    for n_types, n_samples, burden in ((96, 1000, 2000), (96, 10000, 2000), (1536, 10000, 200)):
+        genomes = cohort(n_types, n_samples, burden)
+        loop_time = timed(lambda seed: loop_bootstrap(genomes, seed), replicates)
+        vectorised_time = timed(lambda seed: bootstrap.bootstrap_genomes(genomes, seed=seed, floor=0.0001), replicates)
+        sparse_time = timed(lambda seed: bootstrap.bootstrap_sparse_genomes(genomes, seed=seed), replicates)
+        print("{:>8} {:>8} {:>12.3f} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+            n_types, n_samples, loop_time, vectorised_time, sparse_time, loop_time/vectorised_time))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the extrapolated multiplicative updates ("emu") against the plain ones ("mu"): the time,
+the number of iterations and the final KL objective of bootstrap replicates fitted to the default
+tolerance, on the bundled Samples.txt and on synthetic cohorts. The NumPy engine (subroutines.nnmf)
+fits the replicates one at a time, and the torch engine (nmf_gpu.NMF) on the CPU fits them in one batch.
+
+Usage: python benchmarks/nmf_extrapolation.py [replicates]
+"""
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ["OPENBLAS_NUM_THREADS"] = "1"
+import sys
+import time
+import numpy as np
+import pandas as pd
+import torch
+from SigProfilerExtractor import bootstrap
+from SigProfilerExtractor import nmf_gpu
+from SigProfilerExtractor import sigpro as sig
+from SigProfilerExtractor import subroutines as sub
+from nmf_kernel import synthetic_cohort
+
+
+def run_numpy(batch, rank, solver):
+    tic = time.time()
+    results = [sub.nnmf(v, rank, init="alexandrov-lab-custom", solver=solver, random_state=np.random.RandomState(j))
+               for j, v in enumerate(batch)]
+    return time.time()-tic, np.mean([info[-2] for _, _, info in results]), np.mean([info[-1] for _, _, info in results])
+
+
+def run_torch(batch, rank, extrapolate):
+    tic = time.time()
+    # the settings of subroutines.nnmf_gpu
+    net = nmf_gpu.NMF(torch.from_numpy(batch), rank, max_iterations=100000, test_conv=2000, seed=list(range(len(batch))),
+                      device="cpu", extrapolate=extrapolate)
+    net.fit()
+    elapsed = time.time()-tic
+    return elapsed, np.mean(net.iterations), nmf_gpu.NMF._kl_losses(net._V, net.W, net.H).mean().item()
+
+
+def benchmark(title, genomes, ranks, replicates):
+    batch = bootstrap.bootstrap_genomes(genomes, seed=0, replicates=replicates, dtype=np.float32, floor=0.0001)
+    print("\n{} ({} x {}), {} replicates".format(title, genomes.shape[0], genomes.shape[1], replicates))
+    print("{:>5} {:>14} {:>10} {:>12} {:>16}".format("rank", "engine", "time (s)", "iterations", "mean final KL"))
+    for rank in ranks:
+        for name, run in (("numpy mu", lambda: run_numpy(batch, rank, "mu")),
+                          ("numpy emu", lambda: run_numpy(batch, rank, "emu")),
+                          ("torch mu", lambda: run_torch(batch, rank, False)),
+                          ("torch emu", lambda: run_torch(batch, rank, True))):
+            elapsed, iterations, loss = run()
+            print("{:>5} {:>14} {:>10.2f} {:>12.0f} {:>16.3f}".format(rank, name, elapsed, iterations, loss))
+            sys.stdout.flush()
+
+
+def main():
+    replicates = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    torch.set_num_threads(1)
+    genomes = np.array(pd.read_csv(sig.importdata("text"), sep="\t").iloc[:, 1:], dtype=np.float64)
+    benchmark("Samples.txt", genomes, (4, 8), replicates)
+    benchmark("Synthetic SBS96 cohort, 10 signatures", synthetic_cohort(96, 300), (6, 10), replicates)
+    benchmark("Synthetic SBS96 cohort, 10 signatures", synthetic_cohort(96, 2000), (10,), replicates)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the KL multiplicative update kernel (subroutines.inhouse_nmf) against the
+previous implementation, which upcast every iteration and reallocated its work matrices.
+
+Usage: python benchmarks/nmf_kernel.py [iterations]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from SigProfilerExtractor import sigpro as sig
+from SigProfilerExtractor import subroutines as sub
+
+
+def legacy_inhouse_nmf(v, w=0, h=0, k=2, iterations=200000, tol=None):
+    # the kernel as it was before the single-precision/preallocated rewrite
+    v = np.float32(v)
+    n, m = v.shape[0], v.shape[1]
+    EPS = np.float32(np.finfo(float).eps)
+    initcost = 1000000000000
+    conv = 1
+    for i in range(iterations):
+        x1 = np.repeat((np.sum(w, axis=0).T)[:, np.newaxis], m, axis=1)
+        dot1 = np.dot(w.T, (v/(np.dot(w, h))))
+        h = (h*dot1)/x1
+        x2 = np.repeat((np.sum(h, axis=1).T)[np.newaxis, :], n, axis=0)
+        dot2 = np.dot((v/(np.dot(w, h))), h.T)
+        w = (w*dot2)/x2
+        if (i+1) % 10 == 0:
+            h[h <= EPS] = EPS
+            w[w <= EPS] = EPS
+        if (i+1) % 500 == 0:
+            cost = np.linalg.norm(np.dot(w, h))-np.linalg.norm(v)
+            diff = abs(initcost-cost)
+            initcost = cost
+            if diff <= tol:
+                conv += 1
+                if conv == 10:
+                    break
+            elif diff > tol:
+                conv = 1
+    return w, h
+
+
+def kl_divergence(v, w, h):
+    est_v = np.dot(w, h)
+    return np.sum(v*np.log(v/est_v)) - np.sum(v) + np.sum(est_v)
+
+
+def iterations_per_second(fn, v, w, h, k, iterations, repeats=3, **kwargs):
+    best = np.inf
+    for _ in range(repeats):
+        tic = time.time()
+        W, H = fn(v, w=w.copy(), h=h.copy(), k=k, iterations=iterations, tol=-1, **kwargs)  # tol<0 never converges
+        best = min(best, time.time()-tic)
+    return iterations/best, kl_divergence(v, np.float64(W), np.float64(H))
+
+
+def synthetic_cohort(n_types, n_samples, n_signatures=10, seed=0):
+    rng = np.random.RandomState(seed)
+    signatures = rng.dirichlet(np.ones(n_types)*0.5, size=n_signatures).T
+    exposures = rng.gamma(0.5, 2000, size=(n_signatures, n_samples))
+    v = rng.poisson(np.dot(signatures, exposures)).astype(np.float64)
+    v[v < 0.0001] = 0.0001
+    return v
+
+
+def benchmark(title, v, iterations):
+    print("\n{} ({} x {}), {} iterations".format(title, v.shape[0], v.shape[1], iterations))
+    print("{:>5} {:>12} {:>12} {:>12} {:>8} {:>14} {:>14}".format(
+        "rank", "legacy it/s", "double it/s", "single it/s", "speedup", "KL legacy", "KL single"))
+    for k in (2, 5, 10, 15):
+        w, h = sub.initialize_nmf(v, k, init="alexandrov-lab-custom")
+        legacy, kl_legacy = iterations_per_second(legacy_inhouse_nmf, v, w, h, k, iterations)
+        double, _ = iterations_per_second(sub.inhouse_nmf, v, w, h, k, iterations, precision="double")
+        single, kl_single = iterations_per_second(sub.inhouse_nmf, v, w, h, k, iterations, precision="single")
+        print("{:>5} {:>12.0f} {:>12.0f} {:>12.0f} {:>7.2f}x {:>14.4f} {:>14.4f}".format(
+            k, legacy, double, single, single/legacy, kl_legacy, kl_single))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    genomes = pd.read_csv(sig.importdata("text"), sep="\t").iloc[:, 1:]
+    v = np.array(sub.BootstrapCancerGenomes(genomes, seed=0), dtype=np.float64)
+    v[v < 0.0001] = 0.0001
+    benchmark("Samples.txt bootstrap", v, iterations)
+    benchmark("Synthetic SBS96 cohort", synthetic_cohort(96, 500), iterations//5)
+    benchmark("Synthetic SBS1536 cohort", synthetic_cohort(1536, 500), iterations//25)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the CPU NMF solvers (subroutines.NMF_SOLVERS): wall time, final KL objective and
+stability (average silhouette of the clustered replicates) against the multiplicative updates,
+on bootstraps of the bundled Samples.txt and of synthetic cohorts.
+
+Usage: python benchmarks/nmf_solvers.py [replicates]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from SigProfilerExtractor import sigpro as sig
+from SigProfilerExtractor import subroutines as sub
+from nmf_kernel import synthetic_cohort
+
+
+def run_solver(bootstraps, rank, solver):
+    tic = time.time()
+    results = [sub.nnmf(v, rank, init="alexandrov-lab-custom", solver=solver, random_state=np.random.RandomState(j))
+               for j, v in enumerate(bootstraps)]
+    elapsed = time.time()-tic
+
+    Wall = np.hstack([W/W.sum(axis=0) for W, _, _ in results])
+    Hall = np.vstack([H*W.sum(axis=0)[:, np.newaxis] for W, H, _ in results])
+    stability = sub.cluster_converge_innerloop(Wall, Hall, rank, seed=0)[4]
+    iterations = np.mean([info[-2] for _, _, info in results])
+    loss = np.mean([info[-1] for _, _, info in results])
+    return elapsed, iterations, loss, stability
+
+
+def benchmark(title, genomes, ranks, replicates):
+    bootstraps = []
+    for seed in range(replicates):
+        v = np.array(sub.BootstrapCancerGenomes(pd.DataFrame(genomes), seed=seed), dtype=np.float64)
+        v[v < 0.0001] = 0.0001
+        bootstraps.append(v)
+
+    print("\n{} ({} x {}), {} replicates".format(title, genomes.shape[0], genomes.shape[1], replicates))
+    print("{:>5} {:>7} {:>10} {:>12} {:>16} {:>10}".format("rank", "solver", "time (s)", "iterations", "mean final KL", "stability"))
+    for rank in ranks:
+        for solver in sub.NMF_SOLVERS:
+            elapsed, iterations, loss, stability = run_solver(bootstraps, rank, solver)
+            print("{:>5} {:>7} {:>10.2f} {:>12.0f} {:>16.3f} {:>10.3f}".format(rank, solver, elapsed, iterations, loss, stability))
+            sys.stdout.flush()
+
+
+def main():
+    replicates = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    genomes = np.array(pd.read_csv(sig.importdata("text"), sep="\t").iloc[:, 1:])
+    benchmark("Samples.txt", genomes, (4, 8, 12), replicates)
+    benchmark("Synthetic SBS96 cohort, 10 signatures", synthetic_cohort(96, 300), (6, 10, 15), replicates)
+    benchmark("Synthetic SBS1536 cohort, 10 signatures", synthetic_cohort(1536, 300), (10,), replicates)
+
+
+if __name__ == '__main__':
+    main()
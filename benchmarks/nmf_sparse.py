@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the sparse KL multiplicative update engine (nmf_cpu.sparse_kl_nmf) against the
+dense kernel (subroutines.inhouse_nmf) on synthetic SBS1536 cohorts of 5000 samples with
+decreasing mutation burdens, i.e. decreasing densities. The dense kernel runs on the
+bootstrap floored at 0.0001 as in pnmf, the sparse engine on the sparse bootstrap.
+
+Like sigProfilerExtractor, the benchmark runs BLAS on one thread per process.
+
+Usage: python benchmarks/nmf_sparse.py [iterations]
+"""
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ["OPENBLAS_NUM_THREADS"] = "1"
+import sys
+import time
+import numpy as np
+import pandas as pd
+from scipy.special import xlogy
+from SigProfilerExtractor import subroutines as sub
+from SigProfilerExtractor import nmf_cpu
+
+
+def sparse_cohort(n_types, n_samples, burden, n_signatures=10, seed=0):
+    rng = np.random.RandomState(seed)
+    signatures = rng.dirichlet(np.ones(n_types)*0.5, size=n_signatures).T
+    exposures = rng.gamma(0.5, burden/n_signatures*2, size=(n_signatures, n_samples))
+    v = rng.poisson(np.dot(signatures, exposures)).astype(np.float64)
+    return v[:, v.sum(axis=0) > 0]
+
+
+def kl_divergence(v, w, h):
+    est_v = np.dot(w, h)
+    return np.sum(xlogy(v, v) - xlogy(v, est_v)) - np.sum(v) + np.sum(est_v)
+
+
+def timed(fn, v, w, h, iterations, **kwargs):
+    tic = time.time()
+    W, H = fn(v, w=w.copy(), h=h.copy(), iterations=iterations, tol=-1, test_conv=iterations+1, **kwargs)  # tol<0 never converges
+    return time.time()-tic, np.float64(W), np.float64(H)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rank = 10
+    print("Synthetic SBS1536 cohorts, 5000 samples, rank {}, {} iterations".format(rank, iterations))
+    print("{:>8} {:>8} {:>12} {:>12} {:>8} {:>14} {:>14}".format(
+        "burden", "density", "dense (s)", "sparse (s)", "speedup", "KL dense", "KL sparse"))
+    for burden in (50, 200, 1000, 5000):
+        genomes = sparse_cohort(1536, 5000, burden)
+        dense = np.array(sub.BootstrapCancerGenomes(pd.DataFrame(genomes), seed=0), dtype=np.float64)
+        dense[dense < 0.0001] = 0.0001
+        sparse = sub.BootstrapSparseCancerGenomes(genomes, seed=0)
+        w, h = sub.initialize_nmf(sparse.toarray(), rank, init="alexandrov-lab-custom")
+
+        dense_time, W, H = timed(sub.inhouse_nmf, dense, w, h, iterations)
+        kl_dense = kl_divergence(sparse.toarray(), W, H)
+        sparse_time, W, H = timed(nmf_cpu.sparse_kl_nmf, sparse, w, h, iterations)
+        kl_sparse = kl_divergence(sparse.toarray(), W, H)
+        print("{:>8} {:>8.3f} {:>12.2f} {:>12.2f} {:>7.2f}x {:>14.1f} {:>14.1f}".format(
+            burden, sparse.nnz/np.prod(sparse.shape), dense_time, sparse_time, dense_time/sparse_time, kl_dense, kl_sparse))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the batched torch engine (nmf_gpu.NMF) on the CPU device against the NumPy
+kernel (subroutines.inhouse_nmf) of one process, which fits the replicates one at a time.
+Both run a fixed number of KL multiplicative updates on a batch of bootstrap replicates of
+a synthetic SBS96 cohort; the torch engine runs with an increasing number of threads.
+
+Usage: python benchmarks/nmf_torch.py [replicates] [iterations]
+"""
+import os
+
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ["OPENBLAS_NUM_THREADS"] = "1"
+import multiprocessing
+import sys
+import time
+import numpy as np
+import torch
+from SigProfilerExtractor import bootstrap
+from SigProfilerExtractor import nmf_gpu
+from SigProfilerExtractor import subroutines as sub
+
+
+def cohort(n_types, n_samples, burden, n_signatures=10, seed=0):
+    rng = np.random.RandomState(seed)
+    signatures = rng.dirichlet(np.ones(n_types)*0.5, size=n_signatures).T
+    exposures = rng.gamma(0.5, burden/n_signatures*2, size=(n_signatures, n_samples))
+    return rng.poisson(np.dot(signatures, exposures)).astype(np.float64)
+
+
+def main():
+    replicates = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rank = 10
+    genomes = cohort(96, 2000, 2000)
+    batch = bootstrap.bootstrap_genomes(genomes, seed=0, replicates=replicates, dtype=np.float32, floor=0.0001)
+    print("Synthetic SBS96 cohort, 2000 samples, rank {}, {} replicates, {} iterations".format(rank, replicates, iterations))
+    print("{:>24} {:>12} {:>14}".format("engine", "time (s)", "replicates/s"))
+
+    tic = time.time()
+    for v in batch:
+        w, h = sub.initialize_nmf(v, rank, init="random")
+        sub.inhouse_nmf(v, w=w, h=h, iterations=iterations, tol=-1, test_conv=iterations+1)  # tol<0 never converges
+    numpy_time = time.time()-tic
+    print("{:>24} {:>12.2f} {:>14.2f}".format("numpy, 1 process", numpy_time, replicates/numpy_time))
+    sys.stdout.flush()
+
+    threads = 1
+    while threads <= multiprocessing.cpu_count():
+        torch.set_num_threads(threads)
+        tic = time.time()
+        # test_conv above max_iterations: the loss is only computed once, so every replicate runs all the iterations
+        net = nmf_gpu.NMF(torch.from_numpy(batch), rank, max_iterations=iterations, test_conv=iterations+1,
+                          seed=0, floating_point_precision="float", device="cpu")
+        net.fit()
+        torch_time = time.time()-tic
+        print("{:>24} {:>12.2f} {:>14.2f}".format("torch cpu, {} threads".format(threads), torch_time, replicates/torch_time))
+        sys.stdout.flush()
+        threads *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the KL update and loss of the torch engine (nmf_gpu.NMF._update and
+NMF._kl_losses) against the previous implementation, which materialised a tensor of
+ones the size of V and allocated a new reconstruction and ratio at every step. Both run
+on CPU tensors; every variant runs in a fresh process, whose peak resident memory during
+the updates is reported.
+
+Usage: python benchmarks/nmf_torch_kernel.py [iterations]
+"""
+import multiprocessing
+import resource
+import sys
+import time
+import numpy as np
+import torch
+from SigProfilerExtractor import nmf_gpu
+
+
+def legacy_update(V, W, H, ones):
+    # the beta=1 update as it was before the fused rewrite
+    ht = H.transpose(1, 2)
+    numerator = (V / (W @ H)) @ ht
+    denomenator = ones @ ht
+    W *= numerator / denomenator
+    wt = W.transpose(1, 2)
+    numerator = wt @ (V / (W @ H))
+    denomenator = wt @ ones
+    H *= numerator / denomenator
+
+
+def legacy_loss(V, W, H):
+    return (V * (V / (W @ H)).log()).sum() - V.sum() + (W @ H).sum()
+
+
+def run(variant, shape, rank, iterations, queue):
+    torch.set_num_threads(1)
+    generator = torch.Generator().manual_seed(0)
+    V = torch.rand(shape, generator=generator, dtype=torch.float64)*100+0.0001
+    W = torch.rand(shape[0], shape[1], rank, generator=generator, dtype=torch.float64)
+    H = torch.rand(shape[0], rank, shape[2], generator=generator, dtype=torch.float64)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tic = time.time()
+    with torch.no_grad():
+        if variant == "legacy":
+            ones = torch.ones(V.shape, dtype=V.dtype)
+            for i in range(iterations):
+                legacy_update(V, W, H, ones)
+            loss = legacy_loss(V, W, H).item()
+        else:
+            buffer = torch.empty_like(V)
+            for i in range(iterations):
+                nmf_gpu.NMF._update(V, W, H, 1, buffer)
+            loss = nmf_gpu.NMF._kl_losses(V, W, H, buffer).sum().item()
+    elapsed = time.time()-tic
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-before
+    queue.put((iterations/elapsed, peak/1024, loss))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rank = 10
+    context = multiprocessing.get_context("spawn")
+    print("KL updates of a batch of float64 CPU tensors, rank {}, {} iterations, 1 thread".format(rank, iterations))
+    print("{:>18} {:>8} {:>12} {:>16} {:>16}".format("batch shape", "variant", "iter/s", "peak extra (MB)", "KL"))
+    for shape in ((32, 96, 2000), (8, 1536, 2000)):
+        for variant in ("legacy", "fused"):
+            queue = context.Queue()
+            process = context.Process(target=run, args=(variant, shape, rank, iterations, queue))
+            process.start()
+            speed, peak, loss = queue.get()
+            process.join()
+            print("{:>18} {:>8} {:>12.1f} {:>16.1f} {:>16.1f}".format("x".join(map(str, shape)), variant, speed, peak, loss))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
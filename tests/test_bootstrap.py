@@ -0,0 +1,37 @@
+import numpy as np
+import scipy.sparse
+
+from SigProfilerExtractor import bootstrap
+
+
+def test_bootstrap_genomes_keeps_the_number_of_mutations_of_every_sample():
+    genomes = np.random.RandomState(0).poisson(5, size=(96, 10)).astype(np.float64)
+    genomes[:, 3] = 0
+
+    replicate = bootstrap.bootstrap_genomes(genomes, seed=1)
+
+    assert replicate.shape == genomes.shape and replicate.flags.c_contiguous
+    np.testing.assert_array_equal(replicate.sum(axis=0), genomes.sum(axis=0))
+    # a mutation type without mutations in a sample is never drawn for it
+    assert (replicate[genomes == 0] == 0).all()
+
+
+def test_bootstrap_genomes_replicates_and_seed():
+    genomes = np.random.RandomState(0).poisson(5, size=(96, 10)).astype(np.float64)
+
+    replicates = bootstrap.bootstrap_genomes(genomes, seed=1, replicates=3, dtype=np.float32, floor=1e-4)
+
+    assert replicates.shape == (3, 96, 10) and replicates.dtype == np.float32
+    assert replicates.min() == np.float32(1e-4)
+    np.testing.assert_array_equal(replicates, bootstrap.bootstrap_genomes(genomes, seed=1, replicates=3, dtype=np.float32, floor=1e-4))
+    assert not np.array_equal(replicates[0], replicates[1])
+    assert not np.array_equal(bootstrap.bootstrap_genomes(genomes, seed=1), bootstrap.bootstrap_genomes(genomes, seed=2))
+
+
+def test_bootstrap_sparse_genomes_keeps_the_sparsity_pattern():
+    genomes = scipy.sparse.random(96, 10, density=0.1, random_state=0, format="csc")*20
+
+    replicate = bootstrap.bootstrap_sparse_genomes(genomes, seed=1)
+
+    np.testing.assert_array_equal(replicate.sum(axis=0), np.rint(genomes.sum(axis=0)))
+    assert set(zip(*replicate.nonzero())) <= set(zip(*genomes.nonzero()))
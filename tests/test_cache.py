@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from SigProfilerExtractor import cache
+from SigProfilerExtractor import subroutines as sub
+
+
+def shared(directory, name, k, replicates=3):
+    return (sub.SharedArray.create(str(directory), "Wall_"+name, shape=(96, k*replicates)),
+            sub.SharedArray.create(str(directory), "Hall_"+name, shape=(k*replicates, 10)))
+
+
+def test_replicate_cache_saves_and_restores_replicates(tmp_path):
+    genomes = np.ones((96, 10))
+    replicates = cache.ReplicateCache(str(tmp_path/"cache"), genomes, [1, 2, 3], {"init": "nndsvd"})
+    Wall, Hall = shared(tmp_path, "saved", 2)
+    H = Hall.open()
+    H[...] = np.arange(H.size).reshape(H.shape)
+    H.flush()
+    replicates.save(2, [0, 2], Wall, Hall, [np.array([1.0]), np.array([3.0])])
+
+    Wall2, Hall2 = shared(tmp_path, "restored", 2)
+    assert replicates.restore(2, [0, 1], Wall2, Hall2) is None
+    assert replicates.restore(3, [0], *shared(tmp_path, "other", 3)) is None
+    information = replicates.restore(2, [0, 2], Wall2, Hall2)
+
+    assert [float(info[0]) for info in information] == [1.0, 3.0]
+    np.testing.assert_array_equal(Hall2.read()[[0, 1, 4, 5]], Hall.read()[[0, 1, 4, 5]])
+    assert not Hall2.read()[2:4].any()
+
+    # another run on other settings does not find them
+    other = cache.ReplicateCache(str(tmp_path/"cache"), genomes, [1, 2, 3], {"init": "random"})
+    assert other.restore(2, [0, 2], Wall2, Hall2) is None
+
+
+def test_replicate_cache_reuses_the_seeds_of_the_first_run(tmp_path):
+    genomes = np.ones((96, 10))
+    directory = str(tmp_path/"cache")
+    # seeds drawn as uint64 can exceed the range of int64
+    seeds = np.array([2**64-1, 2**63, 5], dtype=np.uint64)
+    first = cache.ReplicateCache(directory, genomes, seeds, {})
+    assert first.seeds.dtype == np.uint64
+
+    reused = cache.ReplicateCache(directory, genomes, [7, 8, 9], {})
+    own = cache.ReplicateCache(directory, genomes, [7, 8, 9], {}, reuse_seeds=False)
+
+    np.testing.assert_array_equal(first.seeds, seeds)
+    np.testing.assert_array_equal(reused.seeds, seeds)
+    assert list(own.seeds) == [7, 8, 9]
+    assert reused._path(2, 0) == first._path(2, 0) != own._path(2, 0)
+
+
+def test_replicate_cache_evicts_the_least_recently_used(tmp_path):
+    replicates = cache.ReplicateCache(str(tmp_path/"cache"), np.ones((96, 10)), [1, 2, 3], {})
+    Wall, Hall = shared(tmp_path, "saved", 2)
+    W = Wall.open()
+    W[...] = np.random.RandomState(0).rand(*W.shape)
+    W.flush()
+    replicates.save(2, [0, 1, 2], Wall, Hall, [np.zeros(1)]*3)
+    paths = [replicates._path(2, j) for j in range(3)]
+    for j, used in enumerate([300, 100, 200]):
+        os.utime(paths[j], (used, used))
+
+    # room for the two replicates used last
+    replicates.max_size = sum(os.path.getsize(path) for path in paths) - 1
+    replicates._size = None
+    replicates.evict()
+
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
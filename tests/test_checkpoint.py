@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from SigProfilerExtractor import checkpoint
+from SigProfilerExtractor import subroutines as sub
+
+
+def shared(directory, name, k, replicates=3):
+    return (sub.SharedArray.create(str(directory), "Wall_"+name, shape=(96, k*replicates)),
+            sub.SharedArray.create(str(directory), "Hall_"+name, shape=(k*replicates, 10)))
+
+
+def test_checkpoint_saves_and_restores_replicates(tmp_path):
+    genomes = np.ones((96, 10))
+    store, _ = checkpoint.Checkpoint.open(str(tmp_path/"checkpoint"), genomes, [1, 2, 3], {"init": "nndsvd"})
+    Wall, Hall = shared(tmp_path, "saved", 2)
+    W = Wall.open()
+    W[...] = np.arange(W.size).reshape(W.shape)
+    W.flush()
+    store.save(2, [1, 2], Wall, Hall, [np.array([10.0]), np.array([20.0])])
+
+    Wall2, Hall2 = shared(tmp_path, "restored", 2)
+    assert store.restore(2, [0, 1], Wall2, Hall2) is None
+    information = store.restore(2, [1, 2], Wall2, Hall2)
+
+    assert [float(info[0]) for info in information] == [10.0, 20.0]
+    np.testing.assert_array_equal(Wall2.read()[:, 2:], Wall.read()[:, 2:])
+    assert not Wall2.read()[:, :2].any()
+
+
+def test_checkpoint_resumes_with_the_seeds_of_the_first_run(tmp_path):
+    genomes = np.ones((96, 10))
+    directory = str(tmp_path/"checkpoint")
+    # seeds drawn as uint64 can exceed the range of int64
+    seeds = np.array([2**64-1, 2**63, 5], dtype=np.uint64)
+    checkpoint.Checkpoint.open(directory, genomes, seeds, {"init": "nndsvd"})
+
+    _, resumed = checkpoint.Checkpoint.open(directory, genomes, [7, 8, 9], {"init": "nndsvd"}, resume=True)
+    np.testing.assert_array_equal(resumed, seeds)
+    assert resumed.dtype == np.uint64
+
+    with pytest.raises(ValueError):
+        checkpoint.Checkpoint.open(directory, genomes, [7, 8, 9], {"init": "random"}, resume=True)
+
+    _, fresh = checkpoint.Checkpoint.open(directory, genomes, [7, 8, 9], {"init": "nndsvd"})
+    assert list(fresh) == [7, 8, 9]
+
+
+def test_checkpoint_clustering(tmp_path):
+    store, _ = checkpoint.Checkpoint.open(str(tmp_path), np.ones((96, 10)), [1], {})
+    assert store.clustering(2) is None
+
+    clustering = (np.ones((96, 2)), np.ones((2, 10)), np.zeros((96, 2)), np.zeros((2, 10)), 0.5, np.array([0.4, 0.6]))
+    store.save_clustering(2, clustering)
+    restored = store.clustering(2)
+
+    assert restored[4] == 0.5
+    for saved, loaded in zip(clustering, restored):
+        np.testing.assert_array_equal(saved, loaded)
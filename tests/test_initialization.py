@@ -0,0 +1,26 @@
+import numpy as np
+
+from SigProfilerExtractor import initialization
+
+
+def test_svd_rank():
+    assert [initialization.svd_rank(k) for k in (1, 8, 9, 16, 17, 40)] == [8, 8, 16, 16, 32, 64]
+
+
+def test_svd_store_does_not_depend_on_the_other_ranks(tmp_path):
+    X = np.random.RandomState(0).poisson(20, size=(96, 40)).astype(np.float64)
+    first = initialization.SVDStore(str(tmp_path/"first"))
+    second = initialization.SVDStore(str(tmp_path/"second"))
+    (tmp_path/"first").mkdir()
+    (tmp_path/"second").mkdir()
+
+    first.svd(X, 7, 12)
+    U, S, V = first.svd(X, 7, 3)
+    U2, S2, V2 = second.svd(X, 7, 3)
+
+    assert len(S) == initialization.MIN_RANK
+    np.testing.assert_array_equal(S, S2)
+    np.testing.assert_array_equal(U, U2)
+    np.testing.assert_array_equal(V, V2)
+    assert len(first.svd(X, 7, 12)[1]) == 16
+    assert first.svd(X, None, 3) is None
@@ -0,0 +1,75 @@
+import numpy as np
+from scipy.special import xlogy
+
+from SigProfilerExtractor import nmf_cpu
+
+
+def counts(shape, seed=0):
+    return np.random.RandomState(seed).poisson(50, size=shape).astype(np.float64)
+
+
+def factors(shape, rank, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(1, 2, size=shape[:-2]+(shape[-2], rank)), rng.uniform(1, 2, size=shape[:-2]+(rank, shape[-1]))
+
+
+def test_convergence_monitor_kl_loss():
+    V = counts((2, 96, 20))
+    W, H = factors(V.shape, 3)
+    WH = W @ H
+    monitor = nmf_cpu.ConvergenceMonitor(V)
+
+    expected = (xlogy(V, V/WH) - V + WH).sum(axis=(1, 2))
+    np.testing.assert_allclose(monitor.kl_loss(W, H, WH), expected)
+    np.testing.assert_allclose(monitor.kl_loss(W[1:], H[1:], WH[1:], active=np.array([1])), expected[1:])
+
+
+def test_convergence_monitor_waits_for_patience_and_min_iterations():
+    monitor = nmf_cpu.ConvergenceMonitor(counts((2, 96, 20)), tolerance=1e-6, patience=2, min_iterations=2000)
+
+    assert not monitor.record(499, np.array([100.0, 100.0])).any()
+    # a first passing test, then a second one, of which only replicate 1 is past min_iterations
+    monitor.record(999, np.array([100.0, 100.0]))
+    assert not monitor.record(1499, np.array([100.0]), active=np.array([0])).any()
+    assert monitor.record(1999, np.array([100.0]), active=np.array([1])).tolist() == [True]
+
+    assert monitor.converged.tolist() == [False, True]
+    assert monitor.iterations.tolist() == [1500, 2000]
+
+
+def test_convergence_monitor_does_not_pass_a_rise():
+    monitor = nmf_cpu.ConvergenceMonitor(counts((3, 96, 20)), tolerance=1e-6, patience=2)
+    monitor.record(499, np.array([100.0, 100.0, 100.0]))
+    monitor.record(999, np.array([100.0, 100.0, 100.0]))
+
+    # flat, risen, and risen within the tolerance
+    monitor.record(1499, np.array([100.0, 101.0, 100.00001]))
+
+    assert monitor.converged.tolist() == [True, False, True]
+
+
+def test_nmf_fits_every_replicate_of_the_batch_on_its_own():
+    V = np.stack([counts((96, 20), seed) for seed in range(3)])
+    W, H = factors(V.shape, 3)
+    batch = nmf_cpu.NMF(V, W, H, max_iterations=5000, test_conv=100)
+    batch.fit()
+
+    for b in range(3):
+        alone = nmf_cpu.NMF(V[b], W[b], H[b], max_iterations=5000, test_conv=100)
+        alone.fit()
+        assert batch.iterations[b] == alone.iterations[0]
+        np.testing.assert_allclose(batch.W[b], alone.W[0])
+        np.testing.assert_allclose(batch.H[b], alone.H[0])
+
+
+def test_nmf_decreases_the_objective_until_it_converges():
+    V = counts((96, 20))
+    W, H = factors(V.shape, 3)
+    net = nmf_cpu.NMF(V, W, H, max_iterations=20000, test_conv=100)
+    initial = net.monitor.kl_loss(net.W, net.H, net.reconstruction)[0]
+    net.fit()
+
+    assert net.converged[0] and net.iterations[0] < 20000
+    assert net.loss[0] < initial
+    np.testing.assert_allclose(net.monitor.kl_loss(net.W, net.H, net.reconstruction)[0], net.loss[0])
+    assert (net.W > 0).all() and (net.H > 0).all()
@@ -0,0 +1,83 @@
+import numpy as np
+
+from SigProfilerExtractor import subroutines as sub
+
+
+def counts(shape, seed=0):
+    return np.random.RandomState(seed).poisson(50, size=shape).astype(np.float64)
+
+
+def test_extend_nmf_keeps_the_carried_components():
+    # a rank 2 solution with normalized columns, as the warm start takes it from Wall
+    rng = np.random.RandomState(1)
+    X = counts((96, 20))
+    W = rng.uniform(0.001, 1, size=(96, 2))
+    W /= W.sum(axis=0)
+    H = rng.uniform(10, 100, size=(2, 20))
+    H *= X.sum(axis=0)/np.dot(W, H).sum(axis=0)
+
+    W3, H3 = sub.extend_nmf(X, W, H, random_state=0)
+
+    assert W3.shape == (96, 3) and H3.shape == (3, 20)
+    np.testing.assert_allclose(W3[:, :2], W)
+    np.testing.assert_allclose(H3[:2], H)
+    assert (W3 > 0).all() and (H3 > 0).all()
+
+
+def test_cluster_exposures_matches_the_full_average():
+    rng = np.random.RandomState(2)
+    Hall = rng.uniform(size=(3*5, 11))
+    # cluster c holds component (c+r) % 3 of replicate r
+    rows = np.array([[r*3+(c+r) % 3 for r in range(5)] for c in range(3)])
+    average, error = sub.cluster_exposures(Hall, rows, block_size=4)
+    exposure3D = Hall[rows]
+    np.testing.assert_allclose(average, exposure3D.mean(axis=1))
+    np.testing.assert_allclose(error, exposure3D.std(axis=1, ddof=1)/np.sqrt(5))
+
+
+def test_better_clustering_keeps_the_first_of_the_best():
+    clusterings = [(None, None, None, None, silhouette, None) for silhouette in (0.5, 0.9, 0.9, 0.1)]
+    best = None
+    for restart in (3, 2, 0, 1):
+        best = sub.better_clustering(best, restart, clusterings[restart])
+    assert best[0] == 1 and best[1] is clusterings[1]
+
+
+def test_identical_replicates():
+    assert sub.identical_replicates(resample=False, init="nndsvd")
+    assert not sub.identical_replicates(resample=True, init="nndsvd")
+    assert not sub.identical_replicates(resample=False, init="random")
+    assert not sub.identical_replicates(resample=False, init="nndsvd", gpu=True)
+    assert not sub.identical_replicates(resample=False, init="nndsvd", starts=4)
+
+
+def test_rank_packs_puts_every_replicate_in_one_batch():
+    chunks, packs = sub.rank_packs([2, 3, 4], iterations=5, batch_size=4)
+
+    # the replicates of the largest numbers of signatures first, in batches of batch_size
+    assert packs[0] == [(4, 0)] and packs[1] == [(4, 1), (3, 0)]
+    assert [sum(len(chunks[k][c]) for k, c in pack) for pack in packs] == [4, 4, 4, 3]
+    for k in (2, 3, 4):
+        assert sorted(np.concatenate(chunks[k]).tolist()) == list(range(5))
+    assert sorted((k, c) for pack in packs for k, c in pack) == sorted((k, c) for k in chunks for c in range(len(chunks[k])))
+
+
+def test_rank_packs_shares_the_replicates_among_the_cpu_workers():
+    chunks, packs = sub.rank_packs([2, 3], iterations=4, n_cpu=3, batch_size=128, device="cpu")
+
+    assert [sum(len(chunks[k][c]) for k, c in pack) for pack in packs] == [3, 3, 2]
+
+
+def test_successive_halving_rounds():
+    X = counts((96, 20))
+    W, H, spent = sub.successive_halving(X, 3, starts=4, iterations=50, random_state=0)
+
+    # two rounds: 4 starts for 50 iterations, then 2 for 100
+    assert W.shape == (96, 3) and H.shape == (3, 20) and spent == 150
+    assert (W >= 0).all() and (H >= 0).all()
+
+    single_W, single_H, single_spent = sub.successive_halving(X, 3, starts=1, random_state=0)
+    initial_W, initial_H = sub.initialize_nmf(X, 3, init="nndsvd", random_state=0)
+    assert single_spent == 0
+    np.testing.assert_allclose(single_W, initial_W)
+    np.testing.assert_allclose(single_H, initial_H)